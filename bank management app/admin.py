@@ -0,0 +1,127 @@
+import argparse
+import datetime
+import time
+from collections import namedtuple
+ 
+import database
+import rollups
+from fx import BASE, FXRates
+from models import format_money
+from replica import replica_from_env
+ 
+ROLES = ('customer', 'admin')
+ 
+# Totals, type/status balances and daily volume are in the base currency; top account balances in their own
+AdminOverview = namedtuple('AdminOverview', 'total_deposits accounts by_type_status top_accounts daily')
+TopAccount = namedtuple('TopAccount', 'account_number account_type full_name balance currency')
+ 
+ 
+class AdminReports:
+    """Bank-wide figures for the admin console
+     
+    Everything comes from the rollup tables (see rollups.py) or an index
+    walk, so the cost doesn't grow with the number of transactions. With
+    a ``replica`` (replica.Replica) the figures are read from its snapshot.
+    The rollups are kept per currency; ``fx`` (fx.FXRates) converts them
+    to the base currency before they are added up or ranked.
+    """
+     
+    def __init__(self, path=None, replica=None, fx=None):
+        self.path = path
+        self.replica = replica
+        self.fx = fx or FXRates(path)
+     
+    def overview(self, days=30, top=10, conn=None):
+        own = conn is None
+        if own:
+            conn = self.replica.connect() if self.replica else database.connect(self.path, readonly=True)
+        try:
+            # One row per type, status and currency, added up in the base currency
+            totals = {}
+            currencies = set()
+            for account_type, status, currency, count, balance in conn.execute('''
+            SELECT account_type, status, currency, accounts, balance FROM rollup_accounts
+            WHERE accounts > 0 ORDER BY account_type, status
+            '''):
+                previous = totals.get((account_type, status), (0, 0.0))
+                totals[(account_type, status)] = (previous[0] + count, previous[1] + self.fx.to_base(balance, currency))
+                if status == 'active':
+                    currencies.add(currency)
+            by_type_status = [(account_type, status, count, balance) for (account_type, status), (count, balance) in totals.items()]
+            total_deposits = sum(row[3] for row in by_type_status if row[1] == 'active')
+            accounts = sum(row[2] for row in by_type_status)
+             
+            # The largest accounts of each currency, ranked together by their value in the base currency
+            candidates = []
+            for currency in sorted(currencies):
+                candidates.extend(TopAccount._make(row) for row in conn.execute('''
+                SELECT a.account_number, a.account_type, u.full_name, a.balance, a.currency
+                FROM accounts a JOIN users u ON u.id = a.user_id
+                WHERE a.status = 'active' AND a.currency = ?
+                ORDER BY a.balance DESC LIMIT ?
+                ''', (currency, top)))
+            top_accounts = sorted(candidates, key=lambda account: self.fx.to_base(account.balance, account.currency), reverse=True)[:top]
+             
+            since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+            daily = rollups.volume(conn, 'day', since, fx=self.fx)
+        finally:
+            if own:
+                conn.close()
+        return AdminOverview(total_deposits, accounts, by_type_status, top_accounts, daily)
+ 
+ 
+def set_role(username, role, path=None):
+    """Give a user a role; returns False if there is no such user"""
+    if role not in ROLES:
+        raise ValueError(f"Unknown role: {role}")
+    conn = database.connect(path)
+    try:
+        changed = conn.execute("UPDATE users SET role = ? WHERE username = ?", (role, username)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return changed > 0
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Bank manager tools")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    grant = commands.add_parser("grant", help="Make a user an admin")
+    grant.add_argument("username")
+    revoke = commands.add_parser("revoke", help="Make an admin a plain customer again")
+    revoke.add_argument("username")
+    commands.add_parser("rebuild", help="Recompute the rollup tables from the ledger")
+    commands.add_parser("overview", help="Print the admin overview")
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    if args.command == "rebuild":
+        start = time.perf_counter()
+        rollups.rebuild(conn)
+        print(f"Rollups rebuilt in {time.perf_counter() - start:.2f}s")
+    conn.close()
+     
+    if args.command in ("grant", "revoke"):
+        if not set_role(args.username, "admin" if args.command == "grant" else "customer", args.db):
+            parser.error(f"No user named {args.username}")
+        print(f"{args.username} is now {'an admin' if args.command == 'grant' else 'a customer'}")
+    elif args.command == "overview":
+        start = time.perf_counter()
+        overview = AdminReports(args.db, replica_from_env(args.db)).overview()
+        elapsed = time.perf_counter() - start
+        print(f"Total deposits: {format_money(overview.total_deposits, BASE, grouping=True)} in {overview.accounts} accounts")
+        for account_type, status, count, balance in overview.by_type_status:
+            print(f"  {account_type:<12} {status:<8} {count:>8} {format_money(balance, BASE, grouping=True)}")
+        print("Top accounts:")
+        for account in overview.top_accounts:
+            print(f"  {account.account_number:<14} {account.account_type:<12} {account.full_name:<24} {format_money(account.balance, account.currency, grouping=True)}")
+        print("Daily volume:")
+        for day in overview.daily:
+            print(f"  {day.bucket} {day.transactions:>8} in ${day.credits:,.2f} out ${day.debits:,.2f}")
+        print(f"({elapsed * 1000:.1f} ms)")
+ 
+ 
+if __name__ == "__main__":
+    main()
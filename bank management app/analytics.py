@@ -0,0 +1,255 @@
+import argparse
+import threading
+import time
+from array import array
+from collections import namedtuple
+ 
+import database
+from cache import LRUCache
+from replica import replica_from_env
+ 
+try:
+    import numpy as np
+except ImportError:
+    # Same results from plain loops over array-module columns, just slower on big scopes
+    np = None
+ 
+# Category of each transaction type; credits raise the balance, debits lower it
+CATEGORIES = ("Deposit", "Withdrawal", "Transfer (In)", "Transfer (Out)", "Other")
+CREDITS = (0, 2)
+DEBITS = (1, 3, 4)
+ 
+# Rows fetched and folded per pass
+CHUNK = 100000
+ 
+FlowReport = namedtuple('FlowReport', 'months inflow outflow net rolling balance categories')
+ 
+ 
+def month_index(year, month):
+    return year * 12 + month - 1
+ 
+ 
+def month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+ 
+ 
+class Flows:
+    """Per-month, per-category totals of one scope (a user, or the whole bank)
+     
+    Months are buckets keyed by ``year * 12 + month - 1``. Only rows newer
+    than ``last_id`` are pulled on each refresh, so once a scope is loaded,
+    keeping it current costs a few rows per posting. Months that were moved
+    to the archive contribute their inflow/outflow from transaction_summaries;
+    their category split isn't kept there.
+    """
+     
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self.last_id = 0
+        self.months = {}
+        self.archived = {}
+        self.balance = 0.0
+     
+    def refresh(self, conn):
+        if not self.last_id:
+            self._load_archived(conn)
+        if self.user_id is None:
+            query = "SELECT t.id, {columns} FROM transactions t WHERE t.id > ? AND t.status != 'failed' ORDER BY t.id"
+            params = (self.last_id,)
+        else:
+            query = '''
+            SELECT t.id, {columns} FROM transactions t JOIN accounts a ON t.account_id = a.id
+            WHERE a.user_id = ? AND t.id > ? AND t.status != 'failed' ORDER BY t.id
+            '''
+            params = (self.user_id, self.last_id)
+        # Month index, category code and a pending flag are computed by SQLite, so rows arrive as plain numbers
+        columns = '''
+            CAST(substr(t.transaction_date, 1, 4) AS INTEGER) * 12 + CAST(substr(t.transaction_date, 6, 2) AS INTEGER) - 1,
+            CASE t.transaction_type WHEN 'Deposit' THEN 0 WHEN 'Withdrawal' THEN 1
+                 WHEN 'Transfer (In)' THEN 2 WHEN 'Transfer (Out)' THEN 3 ELSE 4 END,
+            t.amount, t.status = 'pending'
+        '''
+        cursor = conn.execute(query.format(columns=columns), params)
+        while True:
+            rows = cursor.fetchmany(CHUNK)
+            if not rows:
+                break
+            if not self._fold(rows):
+                break
+         
+        if self.user_id is None:
+            row = conn.execute("SELECT SUM(balance) FROM accounts").fetchone()
+        else:
+            row = conn.execute("SELECT SUM(balance) FROM accounts WHERE user_id = ?", (self.user_id,)).fetchone()
+        self.balance = row[0] or 0.0
+        return self
+     
+    def _load_archived(self, conn):
+        query = "SELECT s.month, SUM(s.credits), SUM(s.debits) FROM transaction_summaries s"
+        params = ()
+        if self.user_id is not None:
+            query += " JOIN accounts a ON s.account_id = a.id WHERE a.user_id = ?"
+            params = (self.user_id,)
+        for month, credits, debits in conn.execute(query + " GROUP BY s.month", params):
+            self.archived[month_index(int(month[:4]), int(month[5:7]))] = (credits, debits)
+     
+    def _fold(self, rows):
+        """Add a chunk of (id, month, category, amount, pending) rows; False once a pending row stops it
+         
+        A pending row may still settle or fail, so folding stops just before
+        it and the next refresh starts there again.
+        """
+        if np is not None:
+            data = np.array(rows, dtype=np.float64)
+            pending = np.flatnonzero(data[:, 4])
+            complete = pending.size == 0
+            if not complete:
+                data = data[:pending[0]]
+            if len(data):
+                months = data[:, 1].astype(np.int64)
+                first = int(months.min())
+                span = int(months.max()) - first + 1
+                keys = (months - first) * len(CATEGORIES) + data[:, 2].astype(np.int64)
+                totals = np.bincount(keys, weights=data[:, 3], minlength=span * len(CATEGORIES)).reshape(span, len(CATEGORIES))
+                for offset in np.flatnonzero(totals.any(axis=1)):
+                    bucket = self.months.setdefault(first + int(offset), array('d', bytes(8 * len(CATEGORIES))))
+                    for category, amount in enumerate(totals[offset].tolist()):
+                        bucket[category] += amount
+                self.last_id = int(data[-1, 0])
+            return complete
+         
+        ids, months, categories, amounts, pending = (array(code, column) for code, column in zip("qqqdq", zip(*rows)))
+        for index in range(len(ids)):
+            if pending[index]:
+                return False
+            bucket = self.months.get(months[index])
+            if bucket is None:
+                bucket = self.months[months[index]] = array('d', bytes(8 * len(CATEGORIES)))
+            bucket[categories[index]] += amounts[index]
+            self.last_id = ids[index]
+        return True
+     
+    def report(self, months=12, window=3, today=None):
+        """Inflow/outflow, net, a ``window``-month rolling average of net and end-of-month balance
+         
+        Lists cover the last ``months`` months up to today; categories are
+        totals over the same months.
+        """
+        today = today or time.localtime()
+        last = month_index(today.tm_year, today.tm_mon)
+        first = min(list(self.months) + list(self.archived) + [last])
+        span = last - first + 1
+         
+        inflow = [0.0] * span
+        outflow = [0.0] * span
+        categories = [0.0] * len(CATEGORIES)
+        for month, bucket in self.months.items():
+            if month > last:
+                continue
+            inflow[month - first] += sum(bucket[category] for category in CREDITS)
+            outflow[month - first] += sum(bucket[category] for category in DEBITS)
+            if month > last - months:
+                for category, amount in enumerate(bucket):
+                    categories[category] += amount
+        for month, (credits, debits) in self.archived.items():
+            if month <= last:
+                inflow[month - first] += credits
+                outflow[month - first] += debits
+         
+        if np is not None:
+            inflow_array = np.array(inflow)
+            net_array = inflow_array - np.array(outflow)
+            running = np.cumsum(net_array)
+            # Balance at the end of each month: today's balance minus everything that came after
+            balance = (self.balance - (running[-1] - running)).tolist()
+            previous = np.concatenate((np.zeros(window), running))[:span]
+            rolling = ((running - previous) / np.minimum(np.arange(1, span + 1), window)).tolist()
+            net = net_array.tolist()
+        else:
+            net = [credit - debit for credit, debit in zip(inflow, outflow)]
+            running = []
+            total = 0.0
+            for value in net:
+                total += value
+                running.append(total)
+            balance = [self.balance - (total - value) for value in running]
+            rolling = [(running[i] - (running[i - window] if i >= window else 0.0)) / min(i + 1, window) for i in range(span)]
+         
+        shown = slice(max(0, span - months), span)
+        return FlowReport(
+            months=[month_label(first + offset) for offset in range(span)][shown],
+            inflow=inflow[shown],
+            outflow=outflow[shown],
+            net=net[shown],
+            rolling=rolling[shown],
+            balance=balance[shown],
+            categories=dict(zip(CATEGORIES, categories)),
+        )
+ 
+ 
+class Analytics:
+    """Cash-flow reports per user (or bank-wide with user_id=None), cached per scope
+     
+    Each scope keeps its month buckets between calls and only folds in the
+    transactions posted since; reports for an unchanged scope in the same
+    month come straight from the cache. With a ``replica`` (replica.Replica)
+    the bank-wide scope is read from its snapshot; a user's own report
+    stays current.
+    """
+     
+    def __init__(self, path=None, maxsize=64, replica=None):
+        self.path = path
+        self.replica = replica
+        self.flows = LRUCache(maxsize)
+        self.reports = LRUCache(maxsize)
+        self.lock = threading.Lock()
+     
+    def report(self, user_id=None, months=12, conn=None):
+        own = conn is None
+        if own:
+            if self.replica and user_id is None:
+                conn = self.replica.connect()
+            else:
+                conn = database.connect(self.path, readonly=True)
+        try:
+            with self.lock:
+                flows = self.flows.get(user_id)
+                if flows is None:
+                    flows = Flows(user_id)
+                    self.flows.put(user_id, flows)
+                flows.refresh(conn)
+                key = (user_id, months, flows.last_id, flows.balance, time.strftime("%Y-%m"))
+                report = self.reports.get(key)
+                if report is None:
+                    report = flows.report(months)
+                    self.reports.put(key, report)
+        finally:
+            if own:
+                conn.close()
+        return report
+     
+    def invalidate(self, user_id=None):
+        """Forget a scope, e.g. after transactions were archived or corrected by hand"""
+        self.flows.pop(user_id)
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Print a monthly cash-flow report")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    parser.add_argument("--user", type=int, default=None, help="User id (default: the whole bank)")
+    parser.add_argument("--months", type=int, default=12)
+    args = parser.parse_args()
+     
+    start = time.perf_counter()
+    report = Analytics(args.db, replica=replica_from_env(args.db)).report(args.user, args.months)
+    elapsed = time.perf_counter() - start
+    print(f"{'month':<8} {'inflow':>14} {'outflow':>14} {'net':>14} {'rolling':>14} {'balance':>14}")
+    for row in zip(report.months, report.inflow, report.outflow, report.net, report.rolling, report.balance):
+        print(f"{row[0]:<8} " + " ".join(f"{value:>14.2f}" for value in row[1:]))
+    for category, amount in report.categories.items():
+        print(f"{category:<16} {amount:>14.2f}")
+    print(f"({'numpy' if np is not None else 'array fallback'}, {elapsed * 1000:.1f} ms)")
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,559 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import queue
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+ 
+import database
+import timeutil
+from backup import BackupThread
+from fraud import FraudRules
+from fx import BASE, FXRates
+from outbox import OutboxDispatcher, sinks_from_env
+from scheduler import Scheduler, INTERVALS, create_order, cancel_order, list_orders
+from ledger import Ledger, LedgerError, verify_login
+from session import SessionManager, LoginThrottle
+from sharding import ShardedLedger, ShardedWriter, shard_paths
+from writer import PostingWriter, WriterBusy
+ 
+# Largest request body accepted (bytes)
+MAX_BODY = 64 * 1024
+ 
+# Idle keep-alive connections are dropped after this many seconds
+IDLE_TIMEOUT = 30
+ 
+# Page size limits for history endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+ 
+# Longest accepted Idempotency-Key header, and how often expired keys are purged
+MAX_IDEMPOTENCY_KEY = 255
+PURGE_INTERVAL = 3600
+ 
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+ 
+ 
+class HTTPError(Exception):
+    """Turns into an error response with a JSON body"""
+     
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+ 
+ 
+class Request:
+    """A parsed HTTP request"""
+     
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'client', 'params', 'user')
+     
+    def __init__(self, method, path, query, headers, body, client):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.client = client
+        self.params = {}
+        self.user = None
+     
+    def json(self):
+        """Decode the body as a JSON object"""
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Body must be valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return data
+     
+    def arg(self, name, default=None):
+        """Return a query string argument"""
+        values = self.query.get(name)
+        return values[0] if values else default
+     
+    def idempotency_key(self):
+        """Return the Idempotency-Key header, if the client sent one"""
+        key = self.headers.get("idempotency-key")
+        if key is not None and not 0 < len(key) <= MAX_IDEMPOTENCY_KEY:
+            raise HTTPError(400, f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY} characters")
+        return key
+ 
+ 
+async def read_request(reader, client):
+    """Read one request from a stream; returns None when the client hangs up"""
+    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+    if not line:
+        return None
+     
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+     
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+        if len(headers) > 100:
+            raise HTTPError(400, "Too many headers")
+     
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+     
+    if version == "HTTP/1.0" and headers.get("connection", "").lower() != "keep-alive":
+        headers["connection"] = "close"
+     
+    url = urlsplit(target)
+    return Request(method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), headers, body, client)
+ 
+ 
+def encode_response(status, payload, keep_alive):
+    """Serialize a JSON response"""
+    body = json.dumps(payload).encode()
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+ 
+ 
+class ReadPool:
+    """Fixed set of read-only connections shared by the reader threads
+     
+    Readers never open the database file themselves, and ``mode=ro``
+    guarantees they can never take the write lock.
+    """
+     
+    def __init__(self, path, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(database.connect(path, readonly=True, check_same_thread=False))
+     
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+     
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+ 
+ 
+class ShardedReadPool:
+    """ReadPool stand-in for sharded mode, where each shard keeps its own reader connections"""
+     
+    @contextmanager
+    def connection(self):
+        yield None
+     
+    def close(self):
+        pass
+ 
+ 
+def parse_amount(data, name="amount"):
+    """Read a finite number from a JSON body"""
+    try:
+        amount = float(data[name])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPError(400, f"'{name}' must be a number")
+    if not math.isfinite(amount):
+        raise HTTPError(400, f"'{name}' must be a finite number")
+    return amount
+ 
+ 
+def parse_id(data, name):
+    """Read an integer id from a JSON body"""
+    try:
+        return int(data[name])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPError(400, f"'{name}' must be an integer")
+ 
+ 
+def page_payload(transactions, limit):
+    """Serialize a history page with the cursor for the next one"""
+    rows = [transaction._asdict() for transaction in transactions]
+    next_before = rows[-1]["id"] if len(rows) == limit else None
+    return {"transactions": rows, "next_before": next_before}
+ 
+ 
+class APIServer:
+    """JSON API over the ledger for thin clients such as branch terminals
+     
+    Reads run on a thread pool with pooled read-only connections; postings
+    go through the bounded queue of a group-committing PostingWriter. Given
+    a ShardedLedger instead, both are routed to the shard of each user.
+    """
+     
+    def __init__(self, path=None, readers=8, queue_size=1000, sharded=None):
+        self.path = path or database.DB_PATH
+        self.sharded = sharded
+        self.fx = sharded.fx if sharded else FXRates(self.path)
+        # Posting notifications (see outbox.py); like standing orders, only on a single database
+        sinks = [] if sharded else sinks_from_env()
+        self.ledger = sharded or Ledger(self.path, rules=FraudRules(self.path, self.fx), fx=self.fx)
+        self.dispatcher = OutboxDispatcher(sinks, self.path) if sinks else None
+        self.sessions = SessionManager()
+        self.throttle = LoginThrottle()
+        self.readers = readers
+        self.read_pool = None
+        self.writer = ShardedWriter(sharded) if sharded else PostingWriter(self.path, queue_size=queue_size)
+        # Standing orders need a single database; the sharded layout doesn't run them
+        self.scheduler = None if sharded else Scheduler(self.ledger, self.writer, self.path)
+        self.read_executor = ThreadPoolExecutor(readers, thread_name_prefix="reader")
+        # Password hashing is memory-hard, so only a few run at once
+        self.auth_executor = ThreadPoolExecutor(4, thread_name_prefix="auth")
+         
+        self.routes = [
+            ("POST", r"/login", self.login, False),
+            ("POST", r"/logout", self.logout, True),
+            ("GET", r"/accounts", self.list_accounts, True),
+            ("POST", r"/accounts", self.open_account, True),
+            ("GET", r"/accounts/(?P<account_id>\d+)", self.get_account, True),
+            ("GET", r"/accounts/(?P<account_id>\d+)/transactions", self.account_history, True),
+            ("GET", r"/transactions", self.history, True),
+            ("GET", r"/transactions/(?P<transaction_id>\d+)", self.get_transaction, True),
+            ("POST", r"/deposit", self.deposit, True),
+            ("POST", r"/withdraw", self.withdraw, True),
+            ("POST", r"/transfer", self.transfer, True),
+            ("GET", r"/standing-orders", self.list_standing_orders, True),
+            ("POST", r"/standing-orders", self.create_standing_order, True),
+            ("DELETE", r"/standing-orders/(?P<order_id>\d+)", self.cancel_standing_order, True),
+            ("GET", r"/fx-rates", self.fx_rates, True),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), handler, auth) for method, pattern, handler, auth in self.routes]
+     
+    # Plumbing
+     
+    async def read(self, func, *args, **kwargs):
+        """Run a ledger query on a reader thread with a pooled connection"""
+        def call():
+            with self.read_pool.connection() as conn:
+                return func(*args, conn=conn, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, call)
+     
+    async def post(self, func, *args, **kwargs):
+        """Hand a ledger posting to the writer and wait until it is committed"""
+        try:
+            future = self.writer.submit(func, *args, **kwargs)
+        except WriterBusy as e:
+            raise HTTPError(503, str(e))
+        return await asyncio.wrap_future(future)
+     
+    async def purge_idempotency_keys(self):
+        """Drop expired idempotency keys once in a while"""
+        while True:
+            await asyncio.sleep(PURGE_INTERVAL)
+            try:
+                await self.post(self.ledger.purge_idempotency_keys)
+            except (HTTPError, sqlite3.Error):
+                pass
+     
+    def authorize(self, request):
+        """Resolve the bearer token to the logged-in user"""
+        header = request.headers.get("authorization", "")
+        token = header[7:] if header.lower().startswith("bearer ") else None
+        session = self.sessions.get(token) if token else None
+        if session is None:
+            raise HTTPError(401, "Missing or expired session token")
+        self.sessions.touch(token)
+        return session.user
+     
+    async def dispatch(self, request):
+        """Route a request to its handler and return (status, payload)"""
+        allowed = False
+        for method, pattern, handler, auth in self.routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            allowed = True
+            if method != request.method:
+                continue
+            request.params = match.groupdict()
+            if auth:
+                request.user = self.authorize(request)
+            return await handler(request)
+        if allowed:
+            raise HTTPError(405, "Method not allowed")
+        raise HTTPError(404, "Not found")
+     
+    async def handle(self, reader, writer):
+        """Serve requests on one (keep-alive) connection"""
+        client = writer.get_extra_info("peername")
+        client = client[0] if client else "unknown"
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await read_request(reader, client)
+                    if request is None:
+                        break
+                    keep_alive = request.headers.get("connection", "").lower() != "close"
+                    status, payload = await self.dispatch(request)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except LedgerError as e:
+                    status, payload = 400, {"error": str(e)}
+                except sqlite3.OperationalError as e:
+                    status, payload = 503, {"error": f"Database busy: {e}"}
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                 
+                writer.write(encode_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+     
+    async def serve(self, host="127.0.0.1", port=8080):
+        """Start listening and serve until cancelled"""
+        if self.sharded:
+            self.read_pool = ShardedReadPool()
+        else:
+            # Make sure the schema exists (and WAL is on) before readers connect
+            conn = database.connect(self.path)
+            database.create_schema(conn)
+            self.ledger.rules.load(conn)
+            self.fx.load(conn)
+            conn.close()
+            self.read_pool = ReadPool(self.path, self.readers)
+        self.writer.start()
+        if self.scheduler:
+            self.scheduler.start()
+        if self.dispatcher:
+            self.dispatcher.start()
+        purge_task = asyncio.create_task(self.purge_idempotency_keys())
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            purge_task.cancel()
+            if self.scheduler:
+                self.scheduler.stop()
+            self.writer.stop()
+            if self.dispatcher:
+                self.dispatcher.stop()
+            self.read_pool.close()
+     
+    # Handlers
+     
+    async def login(self, request):
+        data = request.json()
+        username = str(data.get("username") or "")
+        password = str(data.get("password") or "")
+        if not username or not password:
+            raise HTTPError(400, "Username and password are required")
+         
+        wait = self.throttle.retry_after(username, request.client)
+        if wait:
+            raise HTTPError(429, f"Too many failed attempts, retry in {int(wait) + 1} seconds")
+         
+        def check():
+            # The pooled connection goes back before the deliberately slow hash check
+            with self.read_pool.connection() as conn:
+                user = self.ledger.get_user(username, conn=conn)
+            return verify_login(user, password)
+         
+        user, replacement = await asyncio.get_running_loop().run_in_executor(self.auth_executor, check)
+        if user is None:
+            self.throttle.record_failure(username, request.client)
+            raise HTTPError(401, "Invalid username or password")
+         
+        self.throttle.reset(username)
+        if replacement:
+            await self.post(self.ledger.rehash_password, user, replacement)
+         
+        session = self.sessions.create(user.profile())
+        return 200, {"token": session.token, "user": session.user._asdict()}
+     
+    async def logout(self, request):
+        self.sessions.revoke(request.headers["authorization"][7:])
+        return 200, {"status": "logged out"}
+     
+    async def list_accounts(self, request):
+        accounts = await self.read(self.ledger.get_accounts, request.user.id)
+        return 200, {"accounts": [account._asdict() for account in accounts]}
+     
+    async def get_account(self, request):
+        account = await self.read(self.ledger.get_account, int(request.params["account_id"]), request.user.id)
+        if account is None:
+            raise HTTPError(404, "Account not found")
+        return 200, account._asdict()
+     
+    async def open_account(self, request):
+        data = request.json()
+        account_type = data.get("account_type")
+        if account_type not in ("Savings", "Checking", "Fixed Deposit", "Loan"):
+            raise HTTPError(400, "Unknown account type")
+        initial_deposit = parse_amount(data, "initial_deposit") if "initial_deposit" in data else 0.0
+        currency = data.get("currency", BASE)
+        if not isinstance(currency, str):
+            raise HTTPError(400, "currency must be a currency code")
+        result = await self.post(self.ledger.open_account, request.user.id, account_type, initial_deposit,
+                                 idempotency_key=request.idempotency_key(), currency=currency)
+        return 201, result._asdict()
+     
+    async def fx_rates(self, request):
+        """Current exchange rates: units of the base currency per unit of each currency"""
+        snapshot = self.fx.current()
+        return 200, {"version": snapshot.version, "base": BASE,
+                     "rates": {currency: snapshot.rate(currency) for currency in sorted(snapshot.index)}}
+     
+    def page_args(self, request):
+        try:
+            limit = min(max(int(request.arg("limit", DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            before = request.arg("before")
+            return limit, int(before) if before else None
+        except ValueError:
+            raise HTTPError(400, "'limit' and 'before' must be integers")
+     
+    def range_args(self, request):
+        """Optional ?since=&until= local dates ('YYYY-MM-DD[ HH:MM]', until inclusive) as epoch microseconds"""
+        try:
+            return timeutil.local_range(request.arg("since"), request.arg("until"))
+        except ValueError:
+            raise HTTPError(400, "'since' and 'until' must be dates like 2024-05-01")
+     
+    async def history(self, request):
+        limit, before = self.page_args(request)
+        since, until = self.range_args(request)
+        account_id = request.arg("account_id")
+        account_id = int(account_id) if account_id and account_id.isdigit() else None
+        transactions = await self.read(self.ledger.history, request.user.id, account_id, limit, before, since=since, until=until)
+        return 200, page_payload(transactions, limit)
+     
+    async def account_history(self, request):
+        request.query["account_id"] = [request.params["account_id"]]
+        return await self.history(request)
+     
+    async def get_transaction(self, request):
+        transaction = await self.read(self.ledger.get_transaction, int(request.params["transaction_id"]), request.user.id)
+        if transaction is None:
+            raise HTTPError(404, "Transaction not found")
+        return 200, transaction._asdict()
+     
+    async def deposit(self, request):
+        data = request.json()
+        result = await self.post(
+            self.ledger.deposit, parse_id(data, "account_id"), parse_amount(data),
+            data.get("description"), user_id=request.user.id,
+            idempotency_key=request.idempotency_key())
+        return 200, result._asdict()
+     
+    async def withdraw(self, request):
+        data = request.json()
+        result = await self.post(
+            self.ledger.withdraw, parse_id(data, "account_id"), parse_amount(data),
+            data.get("description"), user_id=request.user.id,
+            idempotency_key=request.idempotency_key())
+        return 200, result._asdict()
+     
+    async def transfer(self, request):
+        data = request.json()
+        result = await self.post(
+            self.ledger.transfer, parse_id(data, "from_account_id"), parse_id(data, "to_account_id"),
+            parse_amount(data), data.get("description"), user_id=request.user.id,
+            idempotency_key=request.idempotency_key())
+        return 200, result._asdict()
+     
+    def require_scheduler(self):
+        if self.scheduler is None:
+            raise HTTPError(404, "Standing orders are not available in sharded mode")
+     
+    async def list_standing_orders(self, request):
+        self.require_scheduler()
+        orders = await self.read(lambda conn: list_orders(conn, request.user.id))
+        return 200, {"standing_orders": [order._asdict() for order in orders]}
+     
+    async def create_standing_order(self, request):
+        self.require_scheduler()
+        data = request.json()
+        if data.get("interval") not in INTERVALS:
+            raise HTTPError(400, f"'interval' must be one of {', '.join(INTERVALS)}")
+        try:
+            first_run = timeutil.from_local_text(data["start"]) if data.get("start") else None
+            end_time = timeutil.local_range(None, data["end"])[1] if data.get("end") else None
+        except (TypeError, ValueError):
+            raise HTTPError(400, "'start' and 'end' must be dates like 2024-05-01")
+        order = await self.post(
+            create_order, self.ledger, request.user.id, parse_id(data, "from_account_id"), parse_id(data, "to_account_id"),
+            parse_amount(data), data["interval"], data.get("description"), first_run, end_time)
+        self.scheduler.add(order.id, order.next_run)
+        return 201, order._asdict()
+     
+    async def cancel_standing_order(self, request):
+        self.require_scheduler()
+        if not await self.post(cancel_order, int(request.params["order_id"]), request.user.id):
+            raise HTTPError(404, "Standing order not found")
+        return 200, {"cancelled": int(request.params["order_id"])}
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Serve the bank ledger as a JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    parser.add_argument("--readers", type=int, default=8, help="Read-only connections / reader threads")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Pending postings before new ones get 503")
+    parser.add_argument("--shards", type=int, default=0, help="Spread users over this many database files (sharded mode)")
+    parser.add_argument("--shard-dir", default="shards", help="Folder for the shard files in sharded mode")
+    parser.add_argument("--journal-dir", default=database.JOURNAL_DIR, help="Log every commit here for point-in-time restore (default: BANK_JOURNAL_DIR)")
+    parser.add_argument("--backup-dir", default=None, help="Take periodic online backups into this folder")
+    parser.add_argument("--backup-interval", type=int, default=3600, help="Seconds between online backups")
+    args = parser.parse_args()
+     
+    sharded = None
+    if args.shards:
+        os.makedirs(args.shard_dir, exist_ok=True)
+        sharded = ShardedLedger(*shard_paths(args.shard_dir, args.shards)).start()
+    if args.journal_dir and not sharded:
+        database.enable_journal(args.journal_dir, args.db)
+    server = APIServer(args.db, readers=args.readers, queue_size=args.queue_size, sharded=sharded)
+    backups = None
+    if args.backup_dir and not sharded:
+        backups = BackupThread(args.db, args.backup_dir, args.backup_interval).start()
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if backups:
+            backups.stop()
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+ 
+import database
+import timeutil
+from models import TransactionDetail
+ 
+# Transactions older than this many days move to the monthly archives
+HORIZON_DAYS = 365
+ 
+ARCHIVE_COLUMNS = "id, account_id, transaction_type, amount, description, transaction_date, reference_number, status, transaction_time, account_number"
+ 
+ 
+def archive_dir(path=None):
+    """Folder of the monthly archive files: BANK_ARCHIVE_DIR, or <db name>_archive next to the database"""
+    if os.environ.get('BANK_ARCHIVE_DIR'):
+        return os.environ['BANK_ARCHIVE_DIR']
+    path = path or database.DB_PATH
+    return os.path.splitext(os.path.abspath(path))[0] + "_archive"
+ 
+ 
+def create_archive_schema(conn):
+    """One archive file holds one month; user_id and account_number are copied in so it needs no joins"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY,
+        account_id INTEGER,
+        user_id INTEGER,
+        transaction_type TEXT NOT NULL,
+        amount REAL NOT NULL,
+        description TEXT,
+        transaction_date TEXT,
+        reference_number TEXT,
+        status TEXT,
+        account_number TEXT,
+        transaction_time INTEGER
+    )
+    ''')
+    # Files archived before the time column existed get it added and filled
+    if 'transaction_time' not in [column[1] for column in conn.execute("PRAGMA table_info(transactions)")]:
+        conn.execute("ALTER TABLE transactions ADD COLUMN transaction_time INTEGER")
+        conn.execute(f"UPDATE transactions SET transaction_time = {timeutil.TEXT_TO_MICROS.format(column='transaction_date')}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_user ON transactions (user_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_account ON transactions (account_id, id)")
+    conn.commit()
+ 
+ 
+def upgrade_archives(conn, path=None):
+    """Bring every archive file listed in the catalog up to the current schema"""
+    months = archived_months(conn)
+    if not months:
+        return
+    directory = archive_dir(path or conn.execute("PRAGMA database_list").fetchone()[2])
+    for month, file_name, min_id, max_id in months:
+        if os.path.exists(os.path.join(directory, file_name)):
+            archive_conn = database.connect(os.path.join(directory, file_name))
+            try:
+                create_archive_schema(archive_conn)
+            finally:
+                archive_conn.close()
+ 
+ 
+def month_range(month):
+    """First and one-past-last timestamp of a 'YYYY-MM' month, in the stored date format"""
+    year, number = int(month[:4]), int(month[5:7])
+    following = f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+    return f"{month}-01 00:00:00", f"{following}-01 00:00:00"
+ 
+ 
+def archive_transactions(path=None, horizon_days=HORIZON_DAYS, directory=None, today=None):
+    """Move whole months older than the horizon out of the hot database
+     
+    Each month is first copied into its archive file and committed there;
+    only then are the copied rows summarized per account and deleted from
+    the hot database in one transaction. A crash in between leaves the
+    rows in both places, and the next run finishes the move. Pending
+    (two-phase) transfer rows always stay hot. Returns {month: rows moved}.
+    """
+    directory = directory or archive_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    # Files outside the default folder go into the catalog with their absolute path, which the
+    # readers' os.path.join(archive_dir(), file) keeps as is; default ones stay relative to the database
+    custom = os.path.abspath(directory) != os.path.abspath(archive_dir(path))
+    today = today or datetime.date.today()
+    horizon = today - datetime.timedelta(days=horizon_days)
+    cutoff = f"{horizon.year:04d}-{horizon.month:02d}-01 00:00:00"
+     
+    conn = database.connect(path)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    moved = {}
+    try:
+        months = [row[0] for row in conn.execute(
+            "SELECT DISTINCT substr(transaction_date, 1, 7) FROM transactions WHERE transaction_date < ? AND status != 'pending'",
+            (cutoff,))]
+        for month in sorted(months):
+            start, end = month_range(month)
+            file_name = f"transactions_{month.replace('-', '_')}.db"
+            catalog_name = os.path.abspath(os.path.join(directory, file_name)) if custom else file_name
+            archive_conn = database.connect(os.path.join(directory, file_name))
+            create_archive_schema(archive_conn)
+            archive_conn.close()
+             
+            conn.execute("ATTACH DATABASE ? AS archive", (os.path.join(directory, file_name),))
+            try:
+                # Step 1: copy (committed in the archive file only)
+                conn.execute('''
+                INSERT OR IGNORE INTO archive.transactions
+                SELECT t.id, t.account_id, a.user_id, t.transaction_type, t.amount, t.description,
+                       t.transaction_date, t.reference_number, t.status, a.account_number, t.transaction_time
+                FROM main.transactions t
+                JOIN main.accounts a ON t.account_id = a.id
+                WHERE t.transaction_date >= ? AND t.transaction_date < ? AND t.status != 'pending'
+                ''', (start, end))
+                conn.commit()
+                 
+                # Step 2: summarize and delete exactly the rows that reached the archive. Failed rows
+                # (cancelled two-phase transfers) move too, but never touched a balance, so like
+                # the rollups and reconcile the summary only counts the completed ones
+                conn.execute("BEGIN IMMEDIATE")
+                moved_rows = "t.transaction_date >= ? AND t.transaction_date < ? AND t.id IN (SELECT id FROM archive.transactions)"
+                conn.execute(f'''
+                INSERT INTO transaction_summaries (account_id, month, count, credits, debits, first_id, last_id)
+                SELECT t.account_id, ?, COUNT(*),
+                       COALESCE(SUM(CASE WHEN t.transaction_type IN ('Deposit', 'Transfer (In)') THEN t.amount ELSE 0 END), 0),
+                       COALESCE(SUM(CASE WHEN t.transaction_type IN ('Deposit', 'Transfer (In)') THEN 0 ELSE t.amount END), 0),
+                       MIN(t.id), MAX(t.id)
+                FROM main.transactions t
+                WHERE {moved_rows} AND COALESCE(t.status, 'completed') = 'completed'
+                GROUP BY t.account_id
+                ON CONFLICT (account_id, month) DO UPDATE SET
+                    count = count + excluded.count,
+                    credits = credits + excluded.credits,
+                    debits = debits + excluded.debits,
+                    first_id = MIN(first_id, excluded.first_id),
+                    last_id = MAX(last_id, excluded.last_id)
+                ''', (month, start, end))
+                deleted = conn.execute(f"DELETE FROM main.transactions AS t WHERE {moved_rows}", (start, end)).rowcount
+                min_id, max_id, rows = conn.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM archive.transactions").fetchone()
+                conn.execute('''
+                INSERT INTO archive_months (month, file, min_id, max_id, rows, archived_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (month) DO UPDATE SET file = excluded.file, min_id = excluded.min_id, max_id = excluded.max_id,
+                    rows = excluded.rows, archived_at = excluded.archived_at
+                ''', (month, catalog_name, min_id, max_id, rows, time.time()))
+                conn.commit()
+                moved[month] = deleted
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+    return moved
+ 
+ 
+def archived_months(conn, below_id=None):
+    """Catalog rows (month, file, min_id, max_id), newest first; empty if nothing was archived
+     
+    ``file`` is a name in archive_dir(), or an absolute path for months
+    archived to another folder with --archive-dir.
+    """
+    try:
+        rows = conn.execute("SELECT month, file, min_id, max_id FROM archive_months ORDER BY max_id DESC").fetchall()
+    except sqlite3.OperationalError:
+        # Database created before archiving existed
+        return []
+    return [row for row in rows if below_id is None or row[2] < below_id]
+ 
+ 
+def extend_history(page, conn, path, user_id, account_id=None, limit=50, before_id=None, since=None, until=None):
+    """Fill a short history page with older rows from the archives
+     
+    Transaction ids only grow, so archived rows all have smaller ids than
+    the hot ones and the same ``before_id`` cursor keeps working across
+    the boundary. Months entirely outside ``since``/``until`` are skipped
+    without opening their files.
+    """
+    cursor_id = page.ids[-1] if len(page) else before_id
+    directory = None
+    for month, file_name, min_id, max_id in archived_months(conn, cursor_id):
+        first, following = (timeutil.from_local_text(bound) for bound in month_range(month))
+        if (since is not None and following <= since) or (until is not None and first >= until):
+            continue
+        directory = directory or archive_dir(path)
+        archive_conn = database.connect(os.path.join(directory, file_name), readonly=True)
+        try:
+            query = f"SELECT {ARCHIVE_COLUMNS} FROM transactions WHERE user_id = ?"
+            params = [user_id]
+            if account_id is not None:
+                query += " AND account_id = ?"
+                params.append(account_id)
+            if cursor_id is not None:
+                query += " AND id < ?"
+                params.append(cursor_id)
+            if since is not None:
+                query += " AND transaction_time >= ?"
+                params.append(since)
+            if until is not None:
+                query += " AND transaction_time < ?"
+                params.append(until)
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit - len(page))
+            page.extend(archive_conn.execute(query, params))
+        finally:
+            archive_conn.close()
+        if len(page) >= limit:
+            break
+        if len(page):
+            cursor_id = page.ids[-1]
+    return page
+ 
+ 
+def find_transaction(conn, path, transaction_id, user_id=None):
+    """Look a transaction id up in the archive month that covers it"""
+    for month, file_name, min_id, max_id in archived_months(conn):
+        if not min_id <= transaction_id <= max_id:
+            continue
+        archive_conn = database.connect(os.path.join(archive_dir(path), file_name), readonly=True)
+        try:
+            row = archive_conn.execute(f"SELECT {ARCHIVE_COLUMNS}, user_id FROM transactions WHERE id = ?", (transaction_id,)).fetchone()
+        finally:
+            archive_conn.close()
+        if row is None or (user_id is not None and row[-1] != user_id):
+            return None
+        account = conn.execute("SELECT account_type, currency FROM accounts WHERE id = ?", (row[1],)).fetchone()
+        return TransactionDetail._make(row[:-1] + (tuple(account) if account else (None, None)))
+    return None
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Move old transactions into per-month archive databases")
+    parser.add_argument("--db", default=None, help="Hot database (default: BANK_DB_PATH or bank_management.db)")
+    parser.add_argument("--horizon-days", type=int, default=HORIZON_DAYS, help="Keep this many days of transactions hot")
+    parser.add_argument("--archive-dir", default=None, help="Where the monthly files go (default: BANK_ARCHIVE_DIR or <db>_archive)")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the hot database afterwards to give the space back")
+    args = parser.parse_args()
+     
+    moved = archive_transactions(args.db, args.horizon_days, args.archive_dir)
+    for month, count in moved.items():
+        print(f"{month}: {count} transactions archived")
+    if not moved:
+        print("Nothing older than the horizon")
+    if args.vacuum and moved:
+        conn = database.connect(args.db)
+        conn.execute("VACUUM")
+        conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
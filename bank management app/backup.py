@@ -0,0 +1,371 @@
+import argparse
+import datetime
+import glob
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+ 
+import database
+import profiler
+ 
+# Pages copied per backup step, and the pause between steps that lets writers and the UI run
+BACKUP_PAGES = 256
+BACKUP_PAUSE = 0.005
+ 
+# A busy source makes the step-wise copy start over; after this many restarts copy in one step
+MAX_RESTARTS = 5
+ 
+# Journal lines held back while reading to put concurrent writers' entries in order
+REORDER_WINDOW = 1000
+# Statements left out of the journal
+SKIPPED = ("SELECT", "PRAGMA", "EXPLAIN", "BEGIN", "COMMIT", "END", "CREATE", "DROP", "ALTER", "ANALYZE", "VACUUM")
+ 
+ 
+class BackupRestarted(Exception):
+    """The step-wise copy kept restarting because the source was being written"""
+ 
+ 
+def online_backup(path=None, destination=None, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Copy a live database to destination with the SQLite backup API
+     
+    The copy runs ``pages`` pages at a time and sleeps ``pause`` seconds
+    between steps, so it never holds the GIL or the disk for long. Each
+    write to the source by another connection makes SQLite restart the
+    copy; if that keeps happening, the rest is copied in one step, which
+    in WAL mode only holds a read snapshot and doesn't block writers.
+    The file appears under its final name only once complete.
+    Returns the destination path.
+    """
+    path = path or database.DB_PATH
+    destination = destination or time.strftime("backup_%Y%m%d_%H%M%S.db")
+    temporary = destination + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+     
+    source = database.connect(path, readonly=True)
+    target = sqlite3.connect(temporary)
+    restarts = 0
+    last_remaining = None
+     
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise BackupRestarted()
+        last_remaining = remaining
+        time.sleep(pause)
+     
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except BackupRestarted:
+            source.backup(target, pages=-1)
+    finally:
+        target.close()
+        source.close()
+    os.replace(temporary, destination)
+    return destination
+ 
+ 
+class BackupThread:
+    """Takes an online backup every ``interval`` seconds and keeps the newest ``keep``"""
+     
+    def __init__(self, path=None, directory="backups", interval=3600, keep=24):
+        self.path = path
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last = None
+     
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name="backup", daemon=True)
+            self.thread.start()
+        return self
+     
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join(timeout)
+            self.thread = None
+     
+    def backup_now(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = time.strftime("backup_%Y%m%d_%H%M%S.db")
+        self.last = online_backup(self.path, os.path.join(self.directory, name))
+        for old in sorted(glob.glob(os.path.join(self.directory, "backup_*.db")))[:-self.keep]:
+            os.remove(old)
+        return self.last
+     
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.backup_now()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Backup failed: {e}", file=sys.stderr)
+ 
+ 
+class JournalingCursor(profiler.ProfilingCursor):
+    """Cursor that records the writes made through it on its connection"""
+     
+    def execute(self, sql, parameters=()):
+        self.connection.record(sql, parameters)
+        return super().execute(sql, parameters)
+     
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        for parameters in seq_of_parameters:
+            self.connection.record(sql, parameters)
+        return super().executemany(sql, seq_of_parameters)
+ 
+ 
+class JournalingConnection(profiler.ProfilingConnection):
+    """Connection that keeps the writes (with their parameters) of the open transaction and logs them on commit"""
+     
+    journal = None
+    statements = None
+     
+    def cursor(self, factory=JournalingCursor):
+        return super().cursor(factory)
+     
+    def record(self, sql, parameters):
+        if self.journal is None:
+            return
+        verb = sql.lstrip()[:12].upper()
+        # Reads change nothing, the schema is created by create_schema(), and BEGIN/COMMIT are added back on replay
+        if verb.startswith(SKIPPED) or verb.rstrip() == "ROLLBACK":
+            return
+        if not isinstance(parameters, dict):
+            parameters = list(parameters)
+        if self.statements is None:
+            self.statements = []
+        self.statements.append((sql, parameters))
+     
+    def commit(self):
+        if not self.statements:
+            self.statements = None
+            return super().commit()
+        entry = self.journal.seal(self)
+        super().commit()
+        # The transaction is committed whatever happens to its journal line
+        try:
+            self.journal.write(entry)
+        except Exception as e:
+            print(f"Journal write failed for entry {entry['seq']}: {e}", file=sys.stderr)
+     
+    def rollback(self):
+        self.statements = None
+        super().rollback()
+  
+ 
+class Journal:
+    """Append-only log of every committed write to the live database
+     
+    Writable connections opened with database.connect() while the journal
+    is on (BANK_JOURNAL_DIR, or database.enable_journal()) keep the
+    statements of each transaction with their bound parameters. Every
+    commit appends one JSON line with a sequence number, the commit time
+    and those statements to the daily file ``journal_YYYYMMDD.jsonl``:
+    postings, registrations, profile and password changes, admin tools,
+    archive moves alike. The sequence number is read from and stored in
+    the journal_position table inside the committing transaction, so it
+    follows SQLite's commit order across threads and processes, and
+    every backup knows exactly which entries it already contains. Each
+    line is a single append, so processes can share the files; entries
+    may land slightly out of order and read_journal() sorts them. The
+    line is written after the commit; a crash in between loses at most
+    that commit from the journal.
+    """
+     
+    def __init__(self, directory="journal", fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        # Highest sequence number already in the directory; new ones continue after it
+        self.seq = last_seq(directory) if os.path.isdir(directory) else 0
+        self.lock = threading.Lock()
+        self.fd = None
+        self.file_name = None
+        os.makedirs(directory, exist_ok=True)
+     
+    def connect(self, path=None, check_same_thread=True):
+        """Open a connection whose commits are logged here"""
+        conn = database.connect(path, check_same_thread=check_same_thread, factory=JournalingConnection)
+        conn.journal = self
+        return conn
+     
+    def seal(self, conn):
+        """Stamp the open transaction with the next sequence number; call just before COMMIT"""
+        with self.lock:
+            floor = self.seq
+        seq = max(journal_position(conn), floor) + 1
+        conn.execute("INSERT OR REPLACE INTO journal_position (id, seq) VALUES (1, ?)", (seq,))
+        entry = {"seq": seq, "time": time.time(), "statements": conn.statements}
+        conn.statements = None
+        return entry
+     
+    def write(self, entry):
+        """Append a committed transaction"""
+        line = (json.dumps(entry) + "\n").encode()
+        name = os.path.join(self.directory, time.strftime("journal_%Y%m%d.jsonl", time.localtime(entry["time"])))
+        with self.lock:
+            # The number is used up once committed, even if the line below fails
+            self.seq = max(self.seq, entry["seq"])
+            if name != self.file_name:
+                self.close()
+                self.fd = os.open(name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self.file_name = name
+            os.write(self.fd, line)
+            if self.fsync:
+                os.fsync(self.fd)
+     
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.file_name = None
+ 
+ 
+# One Journal per directory in a process, shared by all its connections
+JOURNALS = {}
+JOURNALS_LOCK = threading.Lock()
+ 
+ 
+def open_journal(directory):
+    with JOURNALS_LOCK:
+        journal = JOURNALS.get(directory)
+        if journal is None:
+            journal = JOURNALS[directory] = Journal(directory)
+        return journal
+ 
+ 
+def journal_position(conn):
+    """Sequence number of the last journal batch contained in a database"""
+    try:
+        row = conn.execute("SELECT seq FROM journal_position WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        # Database from before the journal existed
+        return 0
+    return row[0] if row else 0
+ 
+ 
+def last_seq(directory):
+    """Highest sequence number in a journal directory, or 0"""
+    for name in sorted(glob.glob(os.path.join(directory, "journal_*.jsonl")), reverse=True):
+        with open(name) as f:
+            seqs = [json.loads(line)["seq"] for line in f if line.strip()]
+        if seqs:
+            return max(seqs)
+    return 0
+ 
+ 
+def read_journal(directory):
+    """Yield the journal entries of a directory in sequence order
+     
+    Lines of concurrent writers can be a little out of order within a
+    file (and across midnight, between two files), so a small heap
+    reorders them on the way.
+    """
+    pending = []
+    count = 0
+    for name in sorted(glob.glob(os.path.join(directory, "journal_*.jsonl"))):
+        with open(name) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    count += 1
+                    heapq.heappush(pending, (entry["seq"], count, entry))
+                    if len(pending) > REORDER_WINDOW:
+                        yield heapq.heappop(pending)[2]
+    while pending:
+        yield heapq.heappop(pending)[2]
+ 
+ 
+def restore(backup_path, destination, journal_dir=None, until=None):
+    """Rebuild a database from a backup, replaying the journal up to ``until`` (epoch seconds)
+     
+    Without a journal directory this is a plain copy of the backup. The
+    result is written next to destination and moved into place at the
+    end; returns the number of journal batches replayed.
+    """
+    temporary = destination + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    source = database.connect(backup_path, readonly=True)
+    conn = sqlite3.connect(temporary, isolation_level=None)
+    try:
+        source.backup(conn)
+        source.close()
+        seq = journal_position(conn)
+        replayed = 0
+        for entry in read_journal(journal_dir) if journal_dir else ():
+            if entry["seq"] <= seq:
+                continue
+            if until is not None and entry["time"] > until:
+                break
+            if entry["seq"] != seq + 1:
+                raise ValueError(f"Journal is missing batches {seq + 1} to {entry['seq'] - 1}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, parameters in entry["statements"]:
+                    conn.execute(sql, parameters)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            seq = entry["seq"]
+            replayed += 1
+    finally:
+        conn.close()
+    os.replace(temporary, destination)
+    return replayed
+ 
+ 
+def parse_time(text):
+    """Local 'YYYY-MM-DD HH:MM[:SS]' to epoch seconds"""
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Not a time: {text}")
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Online backup and point-in-time restore")
+    commands = parser.add_subparsers(dest="command", required=True)
+     
+    backup_parser = commands.add_parser("backup", help="Copy the live database without stopping it")
+    backup_parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    backup_parser.add_argument("--out", default=None, help="Backup file (default: backup_<time>.db)")
+    backup_parser.add_argument("--pages", type=int, default=BACKUP_PAGES, help="Pages per step")
+    backup_parser.add_argument("--pause", type=float, default=BACKUP_PAUSE, help="Seconds to sleep between steps")
+     
+    restore_parser = commands.add_parser("restore", help="Rebuild a database from a backup and the journal")
+    restore_parser.add_argument("backup", help="Backup file to start from")
+    restore_parser.add_argument("--to", required=True, help="Database file to create")
+    restore_parser.add_argument("--journal", default=None, help="Journal directory to replay")
+    restore_parser.add_argument("--until", type=parse_time, default=None, help="Stop at this local time, e.g. '2024-05-01 14:30'")
+    restore_parser.add_argument("--force", action="store_true", help="Overwrite --to if it exists")
+    args = parser.parse_args()
+     
+    if args.command == "backup":
+        start = time.perf_counter()
+        destination = online_backup(args.db, args.out, args.pages, args.pause)
+        print(f"Backed up to {destination} in {time.perf_counter() - start:.2f}s")
+    else:
+        if os.path.exists(args.to) and not args.force:
+            parser.error(f"{args.to} exists; pass --force to overwrite it")
+        replayed = restore(args.backup, args.to, args.journal, args.until)
+        print(f"Restored {args.to} ({replayed} journal batches replayed)")
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-import sqlite3
 import os
 import base64
 import time
@@ -11,6 +10,30 @@ from math import sin
 from PIL import Image, ImageTk, ImageDraw
 import io
 import threading
+import uuid
+import security
+import database
+import metrics
+import profiler
+import rollups
+import timeutil
+from ledger import Ledger, LedgerError
+from models import User, Account, Transaction, TransactionColumns, format_money
+from cache import LRUCache, AccountCache, MISSING
+from session import SessionManager, LoginThrottle
+from writer import PostingWriter
+from backup import BackupThread
+from events import EventBus, POSTING
+from analytics import Analytics
+from admin import AdminReports
+from replica import replica_from_env
+from fraud import FraudRules
+from fx import BASE, FXRates
+from outbox import OutboxDispatcher, sinks_from_env
+from scheduler import Scheduler, INTERVALS, cancel_order, list_orders
+ 
+# Rows per page of the transaction history screen
+HISTORY_PAGE = 200
  
 class BankManagementSystem:
     def __init__(self, root):
@@ -22,6 +45,30 @@ class BankManagementSystem:
          
         # Initialize database
         self.create_database()
+        # Exchange rates for cross-currency transfers and portfolio totals, cached and reloaded when a new version is loaded
+        self.fx = FXRates().load()
+        # BANK_OUTBOX_FILE, BANK_WEBHOOK_DIR and BANK_MAIL_SPOOL turn on posting notifications (see outbox.py)
+        sinks = sinks_from_env()
+        # Velocity limits and fraud flags are checked as postings are made, from windows rebuilt here
+        self.ledger = Ledger(rules=FraudRules(fx=self.fx).load(), fx=self.fx)
+        # Committed postings are announced on the bus so open views can patch themselves
+        self.events = EventBus()
+        # BANK_JOURNAL_DIR journals every commit (see database.connect), BANK_BACKUP_DIR takes hourly online backups (see backup.py)
+        self.writer = PostingWriter(events=self.events).start()
+        # Standing orders are paid through the same writer when they fall due
+        self.scheduler = Scheduler(self.ledger, self.writer, events=self.events).start()
+        self.backups = BackupThread(directory=os.environ['BANK_BACKUP_DIR']).start() if os.environ.get('BANK_BACKUP_DIR') else None
+        # Notifications are delivered in the background; a committed posting wakes the dispatcher
+        self.dispatcher = OutboxDispatcher(sinks).start() if sinks else None
+        if self.dispatcher:
+            self.events.subscribe(POSTING, self.dispatcher.wake)
+        self.poll_events()
+        # BANK_REPLICA_PATH keeps a snapshot copy, refreshed in the background, for the bank-wide reports (see replica.py)
+        self.replica = replica_from_env()
+        if self.replica:
+            self.replica.start()
+        self.analytics = Analytics(replica=self.replica)
+        self.admin_reports = AdminReports(replica=self.replica, fx=self.fx)
          
         # Load and set icon
         self.load_icons()
@@ -38,60 +85,38 @@ class BankManagementSystem:
         self.current_user = None
         self.current_frame = None
         self.animation_running = False
+        self.login_pending = False
+         
+        # Sessions, cached user rows and brute-force throttling
+        self.sessions = SessionManager()
+        self.session_token = None
+        self.session_check_job = None
+        self.login_throttle = LoginThrottle()
+        self.user_cache = LRUCache(maxsize=256, ttl=60)
+         
+        # Account details and recent transactions for the account dialogs, evicted by every
+        # posting on the bus, including standing orders the scheduler pays in the background
+        self.account_cache = AccountCache()
+        self.events.subscribe(POSTING, self.evict_cached_accounts)
+         
+        # Any keyboard or mouse activity keeps the session alive
+        self.root.bind_all("<Any-KeyPress>", self.touch_session, add="+")
+        self.root.bind_all("<Any-ButtonPress>", self.touch_session, add="+")
+         
+        # F12 shows the query profile when started with BANK_PROFILE=1
+        self.root.bind_all("<F12>", lambda event: self.show_query_profile())
+         
+        # Event-loop lag and screen timings; BANK_METRICS names a .prom or .json export file
+        self.lag_monitor = metrics.LagMonitor(self.root, export_path=os.environ.get("BANK_METRICS")).start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
          
         # Start with login screen
         self.show_login()
      
     def create_database(self):
         """Create database and tables if they don't exist"""
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
-         
-        # Create Users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            phone TEXT,
-            address TEXT,
-            registration_date TEXT,
-            profile_pic BLOB
-        )
-        ''')
-         
-        # Create Accounts table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS accounts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            account_number TEXT UNIQUE NOT NULL,
-            account_type TEXT NOT NULL,
-            balance REAL DEFAULT 0.0,
-            opening_date TEXT,
-            status TEXT DEFAULT 'active',
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-        ''')
-         
-        # Create Transactions table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            account_id INTEGER,
-            transaction_type TEXT NOT NULL,
-            amount REAL NOT NULL,
-            description TEXT,
-            transaction_date TEXT,
-            reference_number TEXT,
-            status TEXT DEFAULT 'completed',
-            FOREIGN KEY (account_id) REFERENCES accounts(id)
-        )
-        ''')
-         
-        conn.commit()
+        conn = database.connect()
+        database.create_schema(conn)
         conn.close()
      
     def load_icons(self):
@@ -167,6 +192,33 @@ class BankManagementSystem:
          
         return frame
      
+    def run_in_background(self, func, callback, error_callback=None, poll_interval=20):
+        """Run func on a worker thread and hand its result to callback on the Tk thread"""
+        result = {}
+         
+        def worker():
+            try:
+                result['value'] = func()
+            except Exception as e:
+                result['error'] = e
+         
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+         
+        # Tk is not thread-safe, so poll from the event loop instead of calling back from the worker
+        def poll():
+            if thread.is_alive():
+                self.root.after(poll_interval, poll)
+            elif 'error' in result:
+                if error_callback:
+                    error_callback(result['error'])
+                else:
+                    messagebox.showerror("Error", str(result['error']))
+            else:
+                callback(result.get('value'))
+         
+        self.root.after(poll_interval, poll)
+     
     def animate_frame(self, frame, direction="right"):
         """Animate frame transition"""
         if self.animation_running:
@@ -269,31 +321,101 @@ class BankManagementSystem:
             error_label.config(text="Username and password are required")
             return
          
-        # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        # Ignore repeated clicks while a check is still running
+        if self.login_pending:
+            return
          
-        # Check credentials
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
+        # Refuse throttled attempts before touching the database
+        wait = self.login_throttle.retry_after(username)
+        if wait:
+            error_label.config(text=f"Too many failed attempts. Try again in {int(wait) + 1} seconds")
+            return
          
-        cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-        user = cursor.fetchone()
+        # Look up the user; the password itself is checked off the Tk thread
+        user = self.find_user(username)
          
         if user:
-            self.current_user = {
-                'id': user[0],
-                'username': user[1],
-                'full_name': user[3],
-                'email': user[4],
-                'phone': user[5],
-                'address': user[6],
-                'registration_date': user[7]
-            }
-            conn.close()
-            self.show_dashboard()
+            check = lambda: security.verify_password(password, user.password)
         else:
-            conn.close()
-            error_label.config(text="Invalid username or password")
+            check = lambda: security.verify_unknown_user(password)
+         
+        self.login_pending = True
+        error_label.config(text="Verifying...")
+        self.run_in_background(
+            check,
+            lambda result: self.finish_login(username, user, result, error_label),
+            lambda e: self.login_failed(f"Error: {str(e)}", error_label)
+        )
+     
+    def find_user(self, username):
+        """Return the users row for a username, from the profile cache when possible"""
+        user = self.user_cache.get(username, MISSING)
+        if user is not MISSING:
+            return user
+         
+        conn = database.connect(readonly=True)
+        cursor = database.model_cursor(conn, User)
+         
+        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        user = cursor.fetchone()
+        conn.close()
+         
+        # Unknown usernames are cached too, so repeated guesses don't reach the database
+        self.user_cache.put(username, user)
+        return user
+     
+    def finish_login(self, username, user, result, error_label):
+        """Complete a login once the password check has finished"""
+        self.login_pending = False
+        valid, replacement = result
+         
+        if not valid:
+            self.login_throttle.record_failure(username)
+            self.login_failed("Invalid username or password", error_label)
+            return
+         
+        self.login_throttle.reset(username)
+         
+        # Upgrade legacy SHA-256 or outdated hashes now that we know the password
+        if replacement:
+            self.post(self.ledger.rehash_password, user, replacement)
+            self.user_cache.pop(username)
+         
+        self.current_user = user.profile()
+        session = self.sessions.create(self.current_user)
+        self.session_token = session.token
+        self.schedule_session_check()
+        self.show_dashboard()
+     
+    def login_failed(self, message, error_label):
+        """Show a login error if the login form is still on screen"""
+        self.login_pending = False
+        if error_label.winfo_exists():
+            error_label.config(text=message)
+     
+    def touch_session(self, event=None):
+        """Extend the current session on user activity"""
+        if self.session_token:
+            self.sessions.touch(self.session_token)
+     
+    def schedule_session_check(self):
+        """Check every 30 seconds whether the session has expired"""
+        if self.session_check_job:
+            self.root.after_cancel(self.session_check_job)
+        self.session_check_job = self.root.after(30000, self.check_session)
+     
+    def check_session(self):
+        """Log the user out once their session has expired"""
+        self.session_check_job = None
+        if not self.session_token:
+            return
+         
+        if self.sessions.get(self.session_token) is None:
+            self.logout()
+            messagebox.showinfo("Session Expired", "You have been logged out after a period of inactivity.")
+            return
+         
+        self.schedule_session_check()
      
     def show_register(self):
         """Display the registration frame"""
@@ -397,29 +519,25 @@ class BankManagementSystem:
             error_label.config(text="Passwords do not match")
             return
          
-        # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-         
-        # Get current date
-        registration_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-         
-        # Save to database
+        # Hash the password on a worker thread; the KDF is slow on purpose
+        error_label.config(text="Creating account...")
+        self.run_in_background(
+            lambda: security.hash_password(password),
+            lambda hashed_password: self.save_new_user(username, hashed_password, fullname, email, phone, address, error_label),
+            lambda e: error_label.config(text=f"Error: {str(e)}")
+        )
+     
+    def save_new_user(self, username, hashed_password, fullname, email, phone, address, error_label):
+        """Store a newly registered user once the password has been hashed"""
+        # Through the writer, like the API and the bank CLI
         try:
-            conn = sqlite3.connect('bank_management.db')
-            cursor = conn.cursor()
-             
-            cursor.execute('''
-            INSERT INTO users (username, password, full_name, email, phone, address, registration_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (username, hashed_password, fullname, email, phone, address, registration_date))
-             
-            conn.commit()
-            conn.close()
+            self.post(self.ledger.register_user, username, hashed_password, fullname, email, phone, address)
+            self.user_cache.pop(username)
              
             messagebox.showinfo("Success", "Registration successful. Please login.")
             self.show_login()
-        except sqlite3.IntegrityError:
-            error_label.config(text="Username or email already exists")
+        except LedgerError as e:
+            error_label.config(text=str(e))
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
@@ -432,7 +550,7 @@ class BankManagementSystem:
         top_bar.pack(fill=tk.X, padx=10, pady=10)
          
         # Welcome message
-        welcome_label = ttk.Label(top_bar, text=f"Welcome, {self.current_user['full_name']}", font=("Helvetica", 16, "bold"), style='TLabel')
+        welcome_label = ttk.Label(top_bar, text=f"Welcome, {self.current_user.full_name}", font=("Helvetica", 16, "bold"), style='TLabel')
         welcome_label.pack(side=tk.LEFT)
          
         # Logout button
@@ -466,12 +584,18 @@ class BankManagementSystem:
         profile_btn_frame = self.create_custom_button(sidebar, "Profile", lambda: self.load_profile_content(main_content), icon="user")
         profile_btn_frame.pack(fill=tk.X, pady=5)
          
+        # Bank managers also get the bank-wide overview
+        if self.current_user.role == 'admin':
+            admin_btn_frame = self.create_custom_button(sidebar, "Bank Overview", lambda: self.load_admin_content(main_content), icon="account")
+            admin_btn_frame.pack(fill=tk.X, pady=5)
+         
         # Load dashboard content by default
         self.load_dashboard_content(main_content)
          
         # Display the frame with animation
         self.animate_frame(dashboard_frame)
      
+    @metrics.timed("screen", "dashboard")
     def load_dashboard_content(self, parent):
         """Load dashboard overview content"""
         # Clear previous content
@@ -487,29 +611,27 @@ class BankManagementSystem:
         stats_frame.pack(fill=tk.X, pady=10)
          
         # Fetch account summary
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
+        conn = database.connect(readonly=True)
+        cursor = database.model_cursor(conn, Account)
          
         # Get accounts
         cursor.execute('''
-        SELECT id, account_number, account_type, balance, status 
+        SELECT * 
         FROM accounts 
         WHERE user_id = ?
-        ''', (self.current_user['id'],))
+        ''', (self.current_user.id,))
          
         accounts = cursor.fetchall()
          
-        # Get total balance
-        total_balance = sum(account[3] for account in accounts)
-         
         # Get recent transactions
+        cursor = database.model_cursor(conn, Transaction)
         cursor.execute('''
         SELECT t.* FROM transactions t
         JOIN accounts a ON t.account_id = a.id
         WHERE a.user_id = ?
-        ORDER BY t.transaction_date DESC
+        ORDER BY t.transaction_time DESC
         LIMIT 5
-        ''', (self.current_user['id'],))
+        ''', (self.current_user.id,))
          
         recent_transactions = cursor.fetchall()
          
@@ -527,7 +649,7 @@ class BankManagementSystem:
         balance_canvas.pack(fill=tk.BOTH, expand=True)
          
         balance_canvas.create_text(100, 30, text="Total Balance", fill="white", font=("Helvetica", 12))
-        balance_canvas.create_text(100, 60, text=f"${total_balance:.2f}", fill="white", font=("Helvetica", 18, "bold"))
+        total_text = balance_canvas.create_text(100, 60, text="", fill="white", font=("Helvetica", 18, "bold"))
          
         # Card 2: Number of Accounts
         accounts_card = ttk.Frame(card_frame, style='TFrame')
@@ -537,7 +659,7 @@ class BankManagementSystem:
         accounts_canvas.pack(fill=tk.BOTH, expand=True)
          
         accounts_canvas.create_text(100, 30, text="Total Accounts", fill="white", font=("Helvetica", 12))
-        accounts_canvas.create_text(100, 60, text=str(len(accounts)), fill="white", font=("Helvetica", 18, "bold"))
+        count_text = accounts_canvas.create_text(100, 60, text=str(len(accounts)), fill="white", font=("Helvetica", 18, "bold"))
          
         # Card 3: Recent Activity
         activity_card = ttk.Frame(card_frame, style='TFrame')
@@ -547,7 +669,27 @@ class BankManagementSystem:
         activity_canvas.pack(fill=tk.BOTH, expand=True)
          
         activity_canvas.create_text(100, 30, text="Recent Activity", fill="white", font=("Helvetica", 12))
-        activity_canvas.create_text(100, 60, text=f"{len(recent_transactions)} transactions", fill="white", font=("Helvetica", 18, "bold"))
+        activity_text = activity_canvas.create_text(100, 60, text=f"{len(recent_transactions)} transactions", fill="white", font=("Helvetica", 18, "bold"))
+         
+        # Cash flow section: monthly inflow/outflow with the balance trend, and a category breakdown
+        chart_frame = ttk.Frame(parent, style='TFrame')
+        chart_frame.pack(fill=tk.X, pady=(20, 0))
+         
+        chart_label = ttk.Label(chart_frame, text="Cash Flow (last 12 months)", font=("Helvetica", 14, "bold"), style='TLabel')
+        chart_label.pack(anchor=tk.W, pady=(0, 10))
+         
+        flow_canvas = tk.Canvas(chart_frame, height=180, bg="white", highlightthickness=0)
+        flow_canvas.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(10, 5))
+        category_canvas = tk.Canvas(chart_frame, width=240, height=180, bg="white", highlightthickness=0)
+        category_canvas.pack(side=tk.LEFT, padx=(5, 10))
+         
+        report = self.analytics.report(self.current_user.id)
+         
+        def draw_charts(event=None):
+            self.draw_cash_flow_chart(flow_canvas, report)
+            self.draw_category_chart(category_canvas, report.categories)
+         
+        flow_canvas.bind("<Configure>", draw_charts)
          
         # Quick Actions section
         actions_frame = ttk.Frame(parent, style='TFrame')
@@ -602,17 +744,225 @@ class BankManagementSystem:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         tree.pack(fill=tk.BOTH, expand=True)
          
+        # Balances and currencies of the accounts, for the total and the amounts below
+        balances = {account.id: account.balance for account in accounts}
+        currencies = {account.id: account.currency for account in accounts}
+         
+        def show_total():
+            # All accounts are converted to the base currency in one batch at the cached rates
+            try:
+                total = format_money(self.fx.total(list(balances.values()), [currencies[account_id] for account_id in balances]), BASE)
+            except ValueError:
+                total = "n/a"
+            balance_canvas.itemconfig(total_text, text=total)
+         
+        show_total()
+         
         # Populate the treeview with transactions
         for transaction in recent_transactions:
-            transaction_id = transaction[0]
-            transaction_type = transaction[2]
-            amount = transaction[3]
-            description = transaction[4]
-            transaction_date = transaction[5]
-            status = transaction[7]
-             
-            tree.insert("", tk.END, values=(transaction_date, transaction_type, f"${amount:.2f}", description, status))
+            tree.insert("", tk.END, iid=transaction.id, values=(timeutil.format_time(transaction.transaction_time, default=transaction.transaction_date), transaction.transaction_type, format_money(transaction.amount, currencies.get(transaction.account_id, BASE)), transaction.description, transaction.status))
+         
+        # Patch the cards and the list in place when a posting touches these accounts
+        def on_posting(result):
+            nonlocal report
+            changed = self.changed_accounts(result, balances)
+            if not changed:
+                return
+            for account in changed:
+                balances[account.id] = account.balance
+                currencies[account.id] = account.currency
+            # Only the new transactions are folded into the cached month buckets
+            report = self.analytics.report(self.current_user.id)
+            draw_charts()
+            show_total()
+            accounts_canvas.itemconfig(count_text, text=str(len(balances)))
+             
+            newest = max((int(iid) for iid in tree.get_children()), default=0)
+            for transaction in reversed(list(self.ledger.history(self.current_user.id, limit=5, after_id=newest))):
+                tree.insert("", 0, iid=transaction.id, values=(timeutil.format_time(transaction.transaction_time, default=transaction.transaction_date), transaction.transaction_type, format_money(transaction.amount, currencies.get(transaction.account_id, BASE)), transaction.description, transaction.status))
+            for iid in tree.get_children()[5:]:
+                tree.delete(iid)
+            activity_canvas.itemconfig(activity_text, text=f"{len(tree.get_children())} transactions")
+         
+        self.events.subscribe(POSTING, on_posting, alive=tree.winfo_exists)
+     
+    @metrics.timed("screen", "admin")
+    def load_admin_content(self, parent):
+        """Load the bank-wide overview for admins"""
+        # Clear previous content
+        for widget in parent.winfo_children():
+            widget.destroy()
+         
+        # Add title and refresh button
+        header_frame = ttk.Frame(parent, style='TFrame')
+        header_frame.pack(fill=tk.X, pady=10)
+         
+        title_label = ttk.Label(header_frame, text="Bank Overview", font=("Helvetica", 16, "bold"), style='TLabel')
+        title_label.pack(side=tk.LEFT)
+         
+        refresh_btn = ttk.Button(header_frame, text="Refresh", command=lambda: self.load_admin_content(parent))
+        refresh_btn.pack(side=tk.RIGHT, padx=5)
+         
+        # All figures come from the rollup tables, so this stays fast however long the ledger gets
+        overview = self.admin_reports.overview()
+        today = overview.daily[-1] if overview.daily and overview.daily[-1].bucket == datetime.date.today().isoformat() else None
+         
+        # Stats cards
+        card_frame = ttk.Frame(parent, style='TFrame')
+        card_frame.pack(fill=tk.X, pady=10)
+         
+        cards = (
+            ("Total Deposits", format_money(overview.total_deposits, BASE, grouping=True), self.primary_color),
+            ("Accounts", str(overview.accounts), self.accent_color),
+            ("Transactions Today", str(today.transactions if today else 0), self.success_color),
+        )
+        for title, value, color in cards:
+            card = tk.Canvas(card_frame, width=200, height=100, bg=color, highlightthickness=0)
+            card.pack(side=tk.LEFT, padx=10, fill=tk.X, expand=True)
+            card.create_text(100, 30, text=title, fill="white", font=("Helvetica", 12))
+            card.create_text(100, 60, text=value, fill="white", font=("Helvetica", 18, "bold"))
+         
+        tables_frame = ttk.Frame(parent, style='TFrame')
+        tables_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+         
+        # Account counts by type and status
+        types_frame = ttk.Frame(tables_frame, style='TFrame')
+        types_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(10, 5))
+         
+        types_label = ttk.Label(types_frame, text="Accounts by Type", font=("Helvetica", 14, "bold"), style='TLabel')
+        types_label.pack(anchor=tk.W, pady=(0, 10))
+         
+        types_tree = ttk.Treeview(types_frame, columns=("type", "status", "count", "balance"), show="headings", height=6)
+        for column, heading, width in (("type", "Type", 100), ("status", "Status", 80), ("count", "Accounts", 80), ("balance", "Balance", 120)):
+            types_tree.heading(column, text=heading)
+            types_tree.column(column, width=width)
+        types_tree.pack(fill=tk.BOTH, expand=True)
+         
+        for account_type, status, count, balance in overview.by_type_status:
+            types_tree.insert("", tk.END, values=(account_type, status, count, format_money(balance, BASE, grouping=True)))
+         
+        # Largest active accounts
+        top_frame = ttk.Frame(tables_frame, style='TFrame')
+        top_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5, 10))
+         
+        top_label = ttk.Label(top_frame, text="Top Accounts", font=("Helvetica", 14, "bold"), style='TLabel')
+        top_label.pack(anchor=tk.W, pady=(0, 10))
+         
+        top_tree = ttk.Treeview(top_frame, columns=("account", "customer", "type", "balance"), show="headings", height=6)
+        for column, heading, width in (("account", "Account", 110), ("customer", "Customer", 140), ("type", "Type", 80), ("balance", "Balance", 110)):
+            top_tree.heading(column, text=heading)
+            top_tree.column(column, width=width)
+        top_tree.pack(fill=tk.BOTH, expand=True)
+         
+        for account in overview.top_accounts:
+            top_tree.insert("", tk.END, values=(account.account_number, account.full_name, account.account_type, format_money(account.balance, account.currency, grouping=True)))
+         
+        # Volume per day over the last 30 days, or per hour today, read from the rollups
+        volume_frame = ttk.Frame(parent, style='TFrame')
+        volume_frame.pack(fill=tk.X, pady=(10, 10))
+         
+        volume_label = ttk.Label(volume_frame, text="Transaction Volume", font=("Helvetica", 14, "bold"), style='TLabel')
+        volume_label.pack(side=tk.LEFT)
+         
+        period_var = tk.StringVar(value="Daily (last 30 days)")
+        period_dropdown = ttk.Combobox(volume_frame, textvariable=period_var, values=["Daily (last 30 days)", "Hourly (today)"], state="readonly")
+        period_dropdown.pack(side=tk.LEFT, padx=10)
+         
+        volume_canvas = tk.Canvas(parent, height=150, bg="white", highlightthickness=0)
+        volume_canvas.pack(fill=tk.X, padx=10, pady=(0, 10))
+        buckets = overview.daily
+         
+        def change_period(event=None):
+            nonlocal buckets
+            if period_var.get().startswith("Hourly"):
+                conn = database.connect(readonly=True)
+                buckets = rollups.volume(conn, 'hour', datetime.date.today().isoformat(), fx=self.fx)
+                conn.close()
+            else:
+                buckets = overview.daily
+            self.draw_volume_chart(volume_canvas, buckets)
+         
+        period_dropdown.bind("<<ComboboxSelected>>", change_period)
+        volume_canvas.bind("<Configure>", lambda event: self.draw_volume_chart(volume_canvas, buckets))
+     
+    def draw_volume_chart(self, canvas, buckets):
+        """Draw one bar per rollup bucket, labelled with its day of month or hour"""
+        canvas.delete("all")
+        if not buckets:
+            canvas.create_text(canvas.winfo_width() / 2, 75, text="No transactions in this period", font=("Helvetica", 10), fill=self.text_color)
+            return
+        width = max(canvas.winfo_width(), 300)
+        height = max(canvas.winfo_height(), 100)
+        left, right, top, bottom = 50, 15, 10, 20
+        base = height - bottom
+        largest = max(bucket.transactions for bucket in buckets) or 1
+        slot = (width - left - right) / len(buckets)
+        canvas.create_text(left - 5, top, text=str(largest), anchor=tk.E, font=("Helvetica", 8), fill=self.text_color)
+        canvas.create_line(left, base, width - right, base, fill="#dadce0")
+        for index, bucket in enumerate(buckets):
+            x = left + slot * index
+            canvas.create_rectangle(x + slot * 0.15, base - bucket.transactions / largest * (base - top), x + slot * 0.85, base, fill=self.accent_color, width=0)
+            # Both '2024-05-01' and '2024-05-01 13' end in the part worth showing
+            canvas.create_text(x + slot / 2, base + 10, text=bucket.bucket[-2:], font=("Helvetica", 7), fill=self.text_color)
+     
+    def draw_cash_flow_chart(self, canvas, report):
+        """Draw monthly inflow/outflow bars with the end-of-month balance line over them"""
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), 300)
+        height = max(canvas.winfo_height(), 120)
+        left, right, top, bottom = 60, 15, 15, 25
+        plot_width = width - left - right
+        plot_height = height - top - bottom
+        base = top + plot_height
+        months = len(report.months)
+        if not months:
+            return
+         
+        # Bars share one scale; the balance line gets its own so small balances still show a trend
+        largest = max(max(report.inflow), max(report.outflow)) or 1
+        slot = plot_width / months
+        bar = max(2, slot * 0.35)
+        canvas.create_line(left, base, left + plot_width, base, fill="#dadce0")
+        canvas.create_text(left - 5, top, text=f"${largest:,.0f}", anchor=tk.E, font=("Helvetica", 8), fill=self.text_color)
+        canvas.create_text(left - 5, base, text="$0", anchor=tk.E, font=("Helvetica", 8), fill=self.text_color)
+         
+        for index, month in enumerate(report.months):
+            center = left + slot * index + slot / 2
+            inflow = report.inflow[index] / largest * plot_height
+            outflow = report.outflow[index] / largest * plot_height
+            canvas.create_rectangle(center - bar, base - inflow, center, base, fill=self.success_color, width=0)
+            canvas.create_rectangle(center, base - outflow, center + bar, base, fill=self.error_color, width=0)
+            canvas.create_text(center, base + 12, text=month[2:], font=("Helvetica", 8), fill=self.text_color)
+         
+        low, high = min(report.balance), max(report.balance)
+        spread = (high - low) or 1
+        points = []
+        for index, value in enumerate(report.balance):
+            points.extend((left + slot * index + slot / 2, top + (high - value) / spread * plot_height))
+        if len(points) >= 4:
+            canvas.create_line(*points, fill=self.primary_color, width=2)
+         
+        # Legend
+        for offset, (label, color) in enumerate((("In", self.success_color), ("Out", self.error_color), ("Balance", self.primary_color))):
+            x = left + 10 + offset * 70
+            canvas.create_rectangle(x, 4, x + 10, 12, fill=color, width=0)
+            canvas.create_text(x + 14, 8, text=label, anchor=tk.W, font=("Helvetica", 8), fill=self.text_color)
+     
+    def draw_category_chart(self, canvas, categories):
+        """Draw horizontal bars of the totals per transaction category"""
+        canvas.delete("all")
+        shown = [(name, amount) for name, amount in categories.items() if amount]
+        if not shown:
+            canvas.create_text(120, 90, text="No transactions yet", font=("Helvetica", 10), fill=self.text_color)
+            return
+        largest = max(amount for _, amount in shown)
+        for index, (name, amount) in enumerate(shown):
+            y = 20 + index * 32
+            canvas.create_text(10, y, text=name, anchor=tk.W, font=("Helvetica", 9), fill=self.text_color)
+            canvas.create_rectangle(10, y + 8, 10 + amount / largest * 150, y + 18, fill=self.accent_color, width=0)
+            canvas.create_text(165, y + 13, text=f"${amount:,.0f}", anchor=tk.W, font=("Helvetica", 8), fill=self.text_color)
      
+    @metrics.timed("screen", "accounts")
     def load_accounts_content(self, parent):
         """Load accounts management content"""
         # Clear previous content
@@ -662,28 +1012,35 @@ class BankManagementSystem:
         tree.pack(fill=tk.BOTH, expand=True)
          
         # Fetch accounts
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
+        conn = database.connect(readonly=True)
+        cursor = database.model_cursor(conn, Account)
          
         cursor.execute('''
-        SELECT id, account_number, account_type, balance, opening_date, status 
+        SELECT * 
         FROM accounts 
         WHERE user_id = ?
-        ''', (self.current_user['id'],))
+        ''', (self.current_user.id,))
          
         accounts = cursor.fetchall()
         conn.close()
          
         # Populate the treeview with accounts
         for account in accounts:
-            account_id = account[0]
-            number = account[1]
-            account_type = account[2]
-            balance = account[3]
-            opening_date = account[4]
-            status = account[5]
-             
-            tree.insert("", tk.END, iid=account_id, values=(number, account_type, f"${balance:.2f}", status, opening_date))
+            tree.insert("", tk.END, iid=account.id, values=(account.account_number, account.account_type, format_money(account.balance, account.currency), account.status, timeutil.format_time(account.opening_time, default=account.opening_date)))
+         
+        # Update only the rows of the accounts a posting touched
+        known_ids = {account.id for account in accounts}
+         
+        def on_posting(result):
+            for account in self.changed_accounts(result, known_ids):
+                values = (account.account_number, account.account_type, format_money(account.balance, account.currency), account.status, timeutil.format_time(account.opening_time, default=account.opening_date))
+                if tree.exists(account.id):
+                    tree.item(account.id, values=values)
+                else:
+                    tree.insert("", tk.END, iid=account.id, values=values)
+                    known_ids.add(account.id)
+         
+        self.events.subscribe(POSTING, on_posting, alive=tree.winfo_exists)
          
         # Add right-click menu
         menu = tk.Menu(tree, tearoff=0)
@@ -699,6 +1056,7 @@ class BankManagementSystem:
         tree.bind("<Button-3>", show_menu)  # Right-click
         tree.bind("<Double-1>", lambda event: self.view_account_details(tree.focus()))  # Double-click
      
+    @metrics.timed("screen", "transactions")
     def load_transactions_content(self, parent):
         """Load transactions history content"""
         # Clear previous content
@@ -721,17 +1079,17 @@ class BankManagementSystem:
         account_var.set("All Accounts")
          
         # Fetch accounts for the dropdown
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
+        conn = database.connect(readonly=True)
+        cursor = database.model_cursor(conn, Account)
          
         cursor.execute('''
-        SELECT id, account_number, account_type 
+        SELECT * 
         FROM accounts 
         WHERE user_id = ?
-        ''', (self.current_user['id'],))
+        ''', (self.current_user.id,))
          
         accounts = cursor.fetchall()
-        account_options = ["All Accounts"] + [f"{account[1]} ({account[2]})" for account in accounts]
+        account_options = ["All Accounts"] + [f"{account.account_number} ({account.account_type})" for account in accounts]
          
         account_dropdown = ttk.Combobox(filter_frame, textvariable=account_var, values=account_options, state="readonly")
         account_dropdown.pack(side=tk.LEFT, padx=5)
@@ -779,34 +1137,55 @@ class BankManagementSystem:
          
         # Add a scrollbar
         scrollbar = ttk.Scrollbar(transactions_frame, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscroll=scrollbar.set)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         tree.pack(fill=tk.BOTH, expand=True)
          
-        # Fetch all transactions for the user
-        cursor.execute('''
-        SELECT t.*, a.account_number
-        FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE a.user_id = ?
-        ORDER BY t.transaction_date DESC
-        ''', (self.current_user['id'],))
-         
-        transactions = cursor.fetchall()
+        # Load the first page; older pages (from the archive too) load as the list is scrolled down
+        transactions = self.ledger.history(self.current_user.id, limit=HISTORY_PAGE, conn=conn)
         conn.close()
+        oldest = transactions.ids[-1] if len(transactions) else None
+        exhausted = len(transactions) < HISTORY_PAGE
          
-        # Populate the treeview with transactions
-        for transaction in transactions:
-            transaction_id = transaction[0]
-            account_number = transaction[8]
-            transaction_type = transaction[2]
-            amount = transaction[3]
-            description = transaction[4]
-            transaction_date = transaction[5]
-            reference = transaction[6]
-            status = transaction[7]
-             
-            tree.insert("", tk.END, iid=transaction_id, values=(transaction_date, account_number, transaction_type, f"${amount:.2f}", description, reference, status))
+        # Amounts are shown in the currency of their account
+        currencies = {account.account_number: account.currency for account in accounts}
+         
+        def add_rows(rows):
+            for transaction in rows:
+                tree.insert("", tk.END, iid=transaction.id, values=(timeutil.format_time(transaction.transaction_time, default=transaction.transaction_date), transaction.account_number, transaction.transaction_type, format_money(transaction.amount, currencies.get(transaction.account_number, BASE)), transaction.description, transaction.reference_number, transaction.status))
+         
+        def on_scroll(first, last):
+            nonlocal oldest, exhausted
+            scrollbar.set(first, last)
+            if exhausted or float(last) < 1.0:
+                return
+            # Set before loading: inserting rows calls back into on_scroll
+            exhausted = True
+            page = self.ledger.history(self.current_user.id, limit=HISTORY_PAGE, before_id=oldest)
+            if len(page):
+                oldest = page.ids[-1]
+            add_rows(page)
+            exhausted = len(page) < HISTORY_PAGE
+         
+        add_rows(transactions)
+        tree.configure(yscroll=on_scroll)
+         
+        # New transactions of the user's accounts are inserted at the top
+        known_ids = {account.id for account in accounts}
+        newest = max(transactions.ids, default=0)
+         
+        def on_posting(result):
+            nonlocal newest
+            changed = self.changed_accounts(result, known_ids)
+            if not changed:
+                return
+            known_ids.update(account.id for account in changed)
+            currencies.update((account.account_number, account.currency) for account in changed)
+            added = self.ledger.history(self.current_user.id, limit=100, after_id=newest)
+            for transaction in reversed(list(added)):
+                tree.insert("", 0, iid=transaction.id, values=(timeutil.format_time(transaction.transaction_time, default=transaction.transaction_date), transaction.account_number, transaction.transaction_type, format_money(transaction.amount, currencies.get(transaction.account_number, BASE)), transaction.description, transaction.reference_number, transaction.status))
+                newest = max(newest, transaction.id)
+         
+        self.events.subscribe(POSTING, on_posting, alive=tree.winfo_exists)
          
         # Add double-click to view details
         tree.bind("<Double-1>", lambda event: self.view_transaction_details(tree.focus()))
@@ -816,6 +1195,7 @@ class BankManagementSystem:
         # Reload the content with filters
         self.load_transactions_content(parent)  # This is a simplified version, in reality you'd modify the query
      
+    @metrics.timed("screen", "profile")
     def load_profile_content(self, parent):
         """Load user profile content"""
         # Clear previous content
@@ -837,7 +1217,7 @@ class BankManagementSystem:
         # Create a circular avatar
         canvas = tk.Canvas(pic_frame, width=120, height=120, bg=self.secondary_color, highlightthickness=0)
         canvas.create_oval(10, 10, 110, 110, fill=self.primary_color, outline="")
-        canvas.create_text(60, 60, text=self.current_user['full_name'][0].upper(), fill="white", font=("Helvetica", 36, "bold"))
+        canvas.create_text(60, 60, text=self.current_user.full_name[0].upper(), fill="white", font=("Helvetica", 36, "bold"))
         canvas.pack()
          
         # User info section
@@ -848,42 +1228,42 @@ class BankManagementSystem:
         name_label = ttk.Label(info_frame, text="Full Name:", font=("Helvetica", 10, "bold"), style='TLabel')
         name_label.grid(row=0, column=0, sticky=tk.W, pady=5)
          
-        name_value = ttk.Label(info_frame, text=self.current_user['full_name'], style='TLabel')
+        name_value = ttk.Label(info_frame, text=self.current_user.full_name, style='TLabel')
         name_value.grid(row=0, column=1, sticky=tk.W, pady=5)
          
         # Username
         username_label = ttk.Label(info_frame, text="Username:", font=("Helvetica", 10, "bold"), style='TLabel')
         username_label.grid(row=1, column=0, sticky=tk.W, pady=5)
          
-        username_value = ttk.Label(info_frame, text=self.current_user['username'], style='TLabel')
+        username_value = ttk.Label(info_frame, text=self.current_user.username, style='TLabel')
         username_value.grid(row=1, column=1, sticky=tk.W, pady=5)
          
         # Email
         email_label = ttk.Label(info_frame, text="Email:", font=("Helvetica", 10, "bold"), style='TLabel')
         email_label.grid(row=2, column=0, sticky=tk.W, pady=5)
          
-        email_value = ttk.Label(info_frame, text=self.current_user['email'], style='TLabel')
+        email_value = ttk.Label(info_frame, text=self.current_user.email, style='TLabel')
         email_value.grid(row=2, column=1, sticky=tk.W, pady=5)
          
         # Phone
         phone_label = ttk.Label(info_frame, text="Phone:", font=("Helvetica", 10, "bold"), style='TLabel')
         phone_label.grid(row=3, column=0, sticky=tk.W, pady=5)
          
-        phone_value = ttk.Label(info_frame, text=self.current_user['phone'] or "Not provided", style='TLabel')
+        phone_value = ttk.Label(info_frame, text=self.current_user.phone or "Not provided", style='TLabel')
         phone_value.grid(row=3, column=1, sticky=tk.W, pady=5)
          
         # Address
         address_label = ttk.Label(info_frame, text="Address:", font=("Helvetica", 10, "bold"), style='TLabel')
         address_label.grid(row=4, column=0, sticky=tk.W, pady=5)
          
-        address_value = ttk.Label(info_frame, text=self.current_user['address'] or "Not provided", style='TLabel')
+        address_value = ttk.Label(info_frame, text=self.current_user.address or "Not provided", style='TLabel')
         address_value.grid(row=4, column=1, sticky=tk.W, pady=5)
          
         # Registration Date
         reg_date_label = ttk.Label(info_frame, text="Registration Date:", font=("Helvetica", 10, "bold"), style='TLabel')
         reg_date_label.grid(row=5, column=0, sticky=tk.W, pady=5)
          
-        reg_date_value = ttk.Label(info_frame, text=self.current_user['registration_date'], style='TLabel')
+        reg_date_value = ttk.Label(info_frame, text=timeutil.format_time(self.current_user.registration_time, default=self.current_user.registration_date), style='TLabel')
         reg_date_value.grid(row=5, column=1, sticky=tk.W, pady=5)
          
         # Edit profile button
@@ -894,11 +1274,12 @@ class BankManagementSystem:
         change_pwd_button = ttk.Button(info_frame, text="Change Password", command=self.show_change_password_dialog)
         change_pwd_button.grid(row=6, column=1, sticky=tk.E, pady=20)
      
+    @metrics.timed("dialog", "new_account")
     def show_new_account_dialog(self):
         """Show dialog to create a new account"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Create New Account")
-        dialog.geometry("400x300")
+        dialog.geometry("400x340")
         dialog.resizable(False, False)
         dialog.transient(self.root)
         dialog.grab_set()
@@ -926,20 +1307,30 @@ class BankManagementSystem:
         deposit_entry.grid(row=1, column=1, sticky=tk.W, pady=10)
         deposit_entry.insert(0, "0.00")
          
+        # Currency: the base currency plus those with a loaded exchange rate
+        currency_label = ttk.Label(form_frame, text="Currency:")
+        currency_label.grid(row=2, column=0, sticky=tk.W, pady=10)
+         
+        currency_var = tk.StringVar()
+        currency_var.set(BASE)
+         
+        currency_dropdown = ttk.Combobox(form_frame, textvariable=currency_var, values=self.fx.currencies(), state="readonly")
+        currency_dropdown.grid(row=2, column=1, sticky=tk.W, pady=10)
+         
         # Description
         desc_label = ttk.Label(form_frame, text="Description (Optional):")
-        desc_label.grid(row=2, column=0, sticky=tk.W, pady=10)
+        desc_label.grid(row=3, column=0, sticky=tk.W, pady=10)
          
         desc_entry = ttk.Entry(form_frame)
-        desc_entry.grid(row=2, column=1, sticky=tk.W, pady=10)
+        desc_entry.grid(row=3, column=1, sticky=tk.W, pady=10)
          
         # Error message label
         error_label = ttk.Label(form_frame, text="", foreground=self.error_color)
-        error_label.grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=10)
+        error_label.grid(row=4, column=0, columnspan=2, sticky=tk.W, pady=10)
          
         # Buttons
         button_frame = ttk.Frame(form_frame)
-        button_frame.grid(row=4, column=0, columnspan=2, pady=20)
+        button_frame.grid(row=5, column=0, columnspan=2, pady=20)
          
         create_button = ttk.Button(
             button_frame, 
@@ -949,7 +1340,8 @@ class BankManagementSystem:
                 deposit_entry.get(),
                 desc_entry.get(),
                 error_label,
-                dialog
+                dialog,
+                currency_var.get()
             )
         )
         create_button.pack(side=tk.LEFT, padx=5)
@@ -957,69 +1349,31 @@ class BankManagementSystem:
         cancel_button = ttk.Button(button_frame, text="Cancel", command=dialog.destroy)
         cancel_button.pack(side=tk.LEFT, padx=5)
      
-    def create_new_account(self, account_type, initial_deposit, description, error_label, dialog):
+    def create_new_account(self, account_type, initial_deposit, description, error_label, dialog, currency=BASE):
         """Create a new bank account"""
         try:
             # Validate initial deposit
             initial_deposit = float(initial_deposit)
-            if initial_deposit < 0:
-                error_label.config(text="Initial deposit cannot be negative")
-                return
-             
-            # Generate account number
-            account_number = f"{random.randint(10000, 99999)}-{random.randint(10000, 99999)}"
-             
-            # Get current date
-            opening_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
              
             # Save to database
-            conn = sqlite3.connect('bank_management.db')
-            cursor = conn.cursor()
-             
-            cursor.execute('''
-            INSERT INTO accounts (user_id, account_number, account_type, balance, opening_date, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.current_user['id'], account_number, account_type, initial_deposit, opening_date, "active"))
-             
-            # Get the new account ID
-            account_id = cursor.lastrowid
-             
-            # If there's an initial deposit, create a transaction
-            if initial_deposit > 0:
-                reference_number = f"DEP-{random.randint(1000000, 9999999)}"
-                 
-                cursor.execute('''
-                INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (account_id, "Deposit", initial_deposit, "Initial deposit", opening_date, reference_number, "completed"))
-             
-            conn.commit()
-            conn.close()
+            self.post(self.ledger.open_account, self.current_user.id, account_type, initial_deposit, currency=currency)
              
             messagebox.showinfo("Success", f"New {account_type} account created successfully!")
             dialog.destroy()
-             
-            # Refresh the accounts view if it's open
-            if self.current_frame:
-                main_content = None
-                for widget in self.current_frame.winfo_children():
-                    if isinstance(widget, ttk.Frame) and widget.winfo_children():
-                        for child in widget.winfo_children():
-                            if isinstance(child, ttk.Frame) and child.winfo_width() > 200:
-                                main_content = child
-                                break
-                 
-                if main_content:
-                    self.load_accounts_content(main_content)
+        except LedgerError as e:
+            error_label.config(text=str(e))
         except ValueError:
             error_label.config(text="Please enter a valid amount for initial deposit")
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
+    @metrics.timed("dialog", "deposit")
     def show_deposit_dialog(self, account_id=None):
         """Show dialog to make a deposit"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Make a Deposit")
+        # One key per dialog, so a double-click cannot post twice
+        dialog.idempotency_key = uuid.uuid4().hex
         dialog.geometry("400x300")
         dialog.resizable(False, False)
         dialog.transient(self.root)
@@ -1033,25 +1387,16 @@ class BankManagementSystem:
         account_label = ttk.Label(form_frame, text="Select Account:")
         account_label.grid(row=0, column=0, sticky=tk.W, pady=10)
          
-        # Fetch accounts
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
-         
-        cursor.execute('''
-        SELECT id, account_number, account_type, balance 
-        FROM accounts 
-        WHERE user_id = ? AND status = 'active'
-        ''', (self.current_user['id'],))
-         
-        accounts = cursor.fetchall()
-        conn.close()
+        # Fetch accounts (served from the account cache for hot users)
+        accounts = self.get_active_accounts()
          
         account_var = tk.StringVar()
-        account_options = [f"{account[1]} ({account[2]}) - ${account[3]:.2f}" for account in accounts]
-        account_ids = [account[0] for account in accounts]
+        account_options = [account.option_label() for account in accounts]
+        account_ids = [account.id for account in accounts]
          
-        if account_id and account_id in account_ids:
-            index = account_ids.index(account_id)
+        # Treeview item ids arrive as strings
+        if account_id and int(account_id) in account_ids:
+            index = account_ids.index(int(account_id))
             account_var.set(account_options[index])
         elif account_options:
             account_var.set(account_options[0])
@@ -1091,7 +1436,8 @@ class BankManagementSystem:
                 error_label,
                 dialog,
                 account_ids,
-                account_options
+                account_options,
+                accounts
             )
         )
         deposit_button.pack(side=tk.LEFT, padx=5)
@@ -1099,7 +1445,7 @@ class BankManagementSystem:
         cancel_button = ttk.Button(button_frame, text="Cancel", command=dialog.destroy)
         cancel_button.pack(side=tk.LEFT, padx=5)
      
-    def make_deposit(self, account_option, amount, description, error_label, dialog, account_ids, account_options):
+    def make_deposit(self, account_option, amount, description, error_label, dialog, account_ids, account_options, accounts):
         """Process a deposit transaction"""
         try:
             # Validate amount
@@ -1112,71 +1458,26 @@ class BankManagementSystem:
             account_index = account_options.index(account_option)
             account_id = account_ids[account_index]
              
-            # Set default description if none provided
-            if not description:
-                description = "Deposit"
+            # Post the deposit
+            self.post(self.ledger.deposit, account_id, amount, description, user_id=self.current_user.id,
+                        idempotency_key=dialog.idempotency_key)
              
-            # Generate reference number
-            reference_number = f"DEP-{random.randint(1000000, 9999999)}"
-             
-            # Get current date
-            transaction_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-             
-            # Update database
-            conn = sqlite3.connect('bank_management.db')
-            cursor = conn.cursor()
-             
-            # Add transaction
-            cursor.execute('''
-            INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (account_id, "Deposit", amount, description, transaction_date, reference_number, "completed"))
-             
-            # Update account balance
-            cursor.execute('''
-            UPDATE accounts SET balance = balance + ? WHERE id = ?
-            ''', (amount, account_id))
-             
-            conn.commit()
-            conn.close()
-             
-            messagebox.showinfo("Success", f"Deposit of ${amount:.2f} completed successfully!")
+            messagebox.showinfo("Success", f"Deposit of {format_money(amount, accounts[account_index].currency)} completed successfully!")
             dialog.destroy()
-             
-            # Refresh the relevant view if it's open
-            if self.current_frame:
-                main_content = None
-                for widget in self.current_frame.winfo_children():
-                    if isinstance(widget, ttk.Frame) and widget.winfo_children():
-                        for child in widget.winfo_children():
-                            if isinstance(child, ttk.Frame) and child.winfo_width() > 200:
-                                main_content = child
-                                break
-                 
-                if main_content:
-                    # Try to determine which view is open and refresh it
-                    title_widget = None
-                    for widget in main_content.winfo_children():
-                        if isinstance(widget, ttk.Label) and widget.cget("text") in ["Dashboard Overview", "Accounts Management", "Transaction History"]:
-                            title_widget = widget
-                            break
-                     
-                    if title_widget:
-                        if title_widget.cget("text") == "Dashboard Overview":
-                            self.load_dashboard_content(main_content)
-                        elif title_widget.cget("text") == "Accounts Management":
-                            self.load_accounts_content(main_content)
-                        elif title_widget.cget("text") == "Transaction History":
-                            self.load_transactions_content(main_content)
+        except LedgerError as e:
+            error_label.config(text=str(e))
         except ValueError:
             error_label.config(text="Please enter a valid amount")
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
+    @metrics.timed("dialog", "withdraw")
     def show_withdraw_dialog(self, account_id=None):
         """Show dialog to make a withdrawal"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Make a Withdrawal")
+        # One key per dialog, so a double-click cannot post twice
+        dialog.idempotency_key = uuid.uuid4().hex
         dialog.geometry("400x300")
         dialog.resizable(False, False)
         dialog.transient(self.root)
@@ -1190,25 +1491,16 @@ class BankManagementSystem:
         account_label = ttk.Label(form_frame, text="Select Account:")
         account_label.grid(row=0, column=0, sticky=tk.W, pady=10)
          
-        # Fetch accounts
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
-         
-        cursor.execute('''
-        SELECT id, account_number, account_type, balance 
-        FROM accounts 
-        WHERE user_id = ? AND status = 'active'
-        ''', (self.current_user['id'],))
-         
-        accounts = cursor.fetchall()
-        conn.close()
+        # Fetch accounts (served from the account cache for hot users)
+        accounts = self.get_active_accounts()
          
         account_var = tk.StringVar()
-        account_options = [f"{account[1]} ({account[2]}) - ${account[3]:.2f}" for account in accounts]
-        account_ids = [account[0] for account in accounts]
+        account_options = [account.option_label() for account in accounts]
+        account_ids = [account.id for account in accounts]
          
-        if account_id and account_id in account_ids:
-            index = account_ids.index(account_id)
+        # Treeview item ids arrive as strings
+        if account_id and int(account_id) in account_ids:
+            index = account_ids.index(int(account_id))
             account_var.set(account_options[index])
         elif account_options:
             account_var.set(account_options[0])
@@ -1269,79 +1561,34 @@ class BankManagementSystem:
             # Get account ID and balance
             account_index = account_options.index(account_option)
             account_id = account_ids[account_index]
-            account_balance = accounts[account_index][3]
+            account_balance = accounts[account_index].balance
              
             # Check if sufficient balance
             if amount > account_balance:
                 error_label.config(text="Insufficient balance")
                 return
              
-            # Set default description if none provided
-            if not description:
-                description = "Withdrawal"
-             
-            # Generate reference number
-            reference_number = f"WDR-{random.randint(1000000, 9999999)}"
-             
-            # Get current date
-            transaction_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Post the withdrawal; the ledger re-checks the balance inside the transaction
+            self.post(self.ledger.withdraw, account_id, amount, description, user_id=self.current_user.id,
+                        idempotency_key=dialog.idempotency_key)
              
-            # Update database
-            conn = sqlite3.connect('bank_management.db')
-            cursor = conn.cursor()
-             
-            # Add transaction
-            cursor.execute('''
-            INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (account_id, "Withdrawal", amount, description, transaction_date, reference_number, "completed"))
-             
-            # Update account balance
-            cursor.execute('''
-            UPDATE accounts SET balance = balance - ? WHERE id = ?
-            ''', (amount, account_id))
-             
-            conn.commit()
-            conn.close()
-             
-            messagebox.showinfo("Success", f"Withdrawal of ${amount:.2f} completed successfully!")
+            messagebox.showinfo("Success", f"Withdrawal of {format_money(amount, accounts[account_index].currency)} completed successfully!")
             dialog.destroy()
-             
-            # Refresh the relevant view if it's open
-            if self.current_frame:
-                main_content = None
-                for widget in self.current_frame.winfo_children():
-                    if isinstance(widget, ttk.Frame) and widget.winfo_children():
-                        for child in widget.winfo_children():
-                            if isinstance(child, ttk.Frame) and child.winfo_width() > 200:
-                                main_content = child
-                                break
-                 
-                if main_content:
-                    # Try to determine which view is open and refresh it
-                    title_widget = None
-                    for widget in main_content.winfo_children():
-                        if isinstance(widget, ttk.Label) and widget.cget("text") in ["Dashboard Overview", "Accounts Management", "Transaction History"]:
-                            title_widget = widget
-                            break
-                     
-                    if title_widget:
-                        if title_widget.cget("text") == "Dashboard Overview":
-                            self.load_dashboard_content(main_content)
-                        elif title_widget.cget("text") == "Accounts Management":
-                            self.load_accounts_content(main_content)
-                        elif title_widget.cget("text") == "Transaction History":
-                            self.load_transactions_content(main_content)
+        except LedgerError as e:
+            error_label.config(text=str(e))
         except ValueError:
             error_label.config(text="Please enter a valid amount")
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
+    @metrics.timed("dialog", "transfer")
     def show_transfer_dialog(self):
         """Show dialog to make a transfer between accounts"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Transfer Funds")
-        dialog.geometry("400x350")
+        # One key per dialog, so a double-click cannot post twice
+        dialog.idempotency_key = uuid.uuid4().hex
+        dialog.geometry("400x400")
         dialog.resizable(False, False)
         dialog.transient(self.root)
         dialog.grab_set()
@@ -1350,21 +1597,11 @@ class BankManagementSystem:
         form_frame = ttk.Frame(dialog)
         form_frame.pack(padx=20, pady=20, fill=tk.BOTH, expand=True)
          
-        # Fetch accounts
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
+        # Fetch accounts (served from the account cache for hot users)
+        accounts = self.get_active_accounts()
          
-        cursor.execute('''
-        SELECT id, account_number, account_type, balance 
-        FROM accounts 
-        WHERE user_id = ? AND status = 'active'
-        ''', (self.current_user['id'],))
-         
-        accounts = cursor.fetchall()
-        conn.close()
-         
-        account_options = [f"{account[1]} ({account[2]}) - ${account[3]:.2f}" for account in accounts]
-        account_ids = [account[0] for account in accounts]
+        account_options = [account.option_label() for account in accounts]
+        account_ids = [account.id for account in accounts]
          
         # From Account
         from_label = ttk.Label(form_frame, text="From Account:")
@@ -1404,13 +1641,21 @@ class BankManagementSystem:
         desc_entry = ttk.Entry(form_frame)
         desc_entry.grid(row=3, column=1, sticky=tk.W, pady=10)
          
+        # Repeat as a standing order
+        repeat_label = ttk.Label(form_frame, text="Repeat:")
+        repeat_label.grid(row=4, column=0, sticky=tk.W, pady=10)
+         
+        repeat_var = tk.StringVar(value="Once")
+        repeat_dropdown = ttk.Combobox(form_frame, textvariable=repeat_var, values=["Once"] + [interval.capitalize() for interval in INTERVALS], state="readonly")
+        repeat_dropdown.grid(row=4, column=1, sticky=tk.W, pady=10)
+         
         # Error message label
         error_label = ttk.Label(form_frame, text="", foreground=self.error_color)
-        error_label.grid(row=4, column=0, columnspan=2, sticky=tk.W, pady=10)
+        error_label.grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=10)
          
         # Buttons
         button_frame = ttk.Frame(form_frame)
-        button_frame.grid(row=5, column=0, columnspan=2, pady=20)
+        button_frame.grid(row=6, column=0, columnspan=2, pady=20)
          
         transfer_button = ttk.Button(
             button_frame, 
@@ -1424,15 +1669,19 @@ class BankManagementSystem:
                 dialog,
                 account_ids,
                 account_options,
-                accounts
+                accounts,
+                repeat_var.get()
             )
         )
         transfer_button.pack(side=tk.LEFT, padx=5)
          
+        orders_button = ttk.Button(button_frame, text="Standing Orders", command=self.show_standing_orders)
+        orders_button.pack(side=tk.LEFT, padx=5)
+         
         cancel_button = ttk.Button(button_frame, text="Cancel", command=dialog.destroy)
         cancel_button.pack(side=tk.LEFT, padx=5)
      
-    def make_transfer(self, from_account, to_account, amount, description, error_label, dialog, account_ids, account_options, accounts):
+    def make_transfer(self, from_account, to_account, amount, description, error_label, dialog, account_ids, account_options, accounts, repeat="Once"):
         """Process a transfer between accounts"""
         try:
             # Validate amount
@@ -1444,7 +1693,7 @@ class BankManagementSystem:
             # Get account IDs and balances
             from_index = account_options.index(from_account)
             from_id = account_ids[from_index]
-            from_balance = accounts[from_index][3]
+            from_balance = accounts[from_index].balance
              
             to_index = account_options.index(to_account)
             to_id = account_ids[to_index]
@@ -1459,110 +1708,160 @@ class BankManagementSystem:
                 error_label.config(text="Insufficient balance")
                 return
              
-            # Set default description if none provided
-            if not description:
-                description = "Transfer between accounts"
-             
-            # Generate reference number
-            reference_number = f"TRF-{random.randint(1000000, 9999999)}"
-             
-            # Get current date
-            transaction_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-             
-            # Update database
-            conn = sqlite3.connect('bank_management.db')
-            cursor = conn.cursor()
-             
-            # Add withdrawal transaction
-            cursor.execute('''
-            INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (from_id, "Transfer (Out)", amount, description, transaction_date, reference_number, "completed"))
-             
-            # Add deposit transaction
-            cursor.execute('''
-            INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (to_id, "Transfer (In)", amount, description, transaction_date, reference_number, "completed"))
-             
-            # Update account balances
-            cursor.execute('''
-            UPDATE accounts SET balance = balance - ? WHERE id = ?
-            ''', (amount, from_id))
-             
-            cursor.execute('''
-            UPDATE accounts SET balance = balance + ? WHERE id = ?
-            ''', (amount, to_id))
+            if repeat != "Once":
+                # The scheduler makes the first transfer right away and the rest as they fall due
+                self.scheduler.create(self.current_user.id, from_id, to_id, amount, repeat.lower(), description or None)
+                messagebox.showinfo("Success", f"Standing order for {format_money(amount, accounts[from_index].currency)} ({repeat.lower()}) set up; the first transfer is made now.")
+                dialog.destroy()
+                return
              
-            conn.commit()
-            conn.close()
+            # Post both legs of the transfer in one transaction
+            self.post(self.ledger.transfer, from_id, to_id, amount, description, user_id=self.current_user.id,
+                        idempotency_key=dialog.idempotency_key)
              
-            messagebox.showinfo("Success", f"Transfer of ${amount:.2f} completed successfully!")
+            message = f"Transfer of {format_money(amount, accounts[from_index].currency)} completed successfully!"
+            if accounts[from_index].currency != accounts[to_index].currency:
+                message += f" The amount was converted to {accounts[to_index].currency} at the current rate."
+            messagebox.showinfo("Success", message)
             dialog.destroy()
-             
-            # Refresh the relevant view if it's open
-            if self.current_frame:
-                main_content = None
-                for widget in self.current_frame.winfo_children():
-                    if isinstance(widget, ttk.Frame) and widget.winfo_children():
-                        for child in widget.winfo_children():
-                            if isinstance(child, ttk.Frame) and child.winfo_width() > 200:
-                                main_content = child
-                                break
-                 
-                if main_content:
-                    # Try to determine which view is open and refresh it
-                    title_widget = None
-                    for widget in main_content.winfo_children():
-                        if isinstance(widget, ttk.Label) and widget.cget("text") in ["Dashboard Overview", "Accounts Management", "Transaction History"]:
-                            title_widget = widget
-                            break
-                     
-                    if title_widget:
-                        if title_widget.cget("text") == "Dashboard Overview":
-                            self.load_dashboard_content(main_content)
-                        elif title_widget.cget("text") == "Accounts Management":
-                            self.load_accounts_content(main_content)
-                        elif title_widget.cget("text") == "Transaction History":
-                            self.load_transactions_content(main_content)
+        except LedgerError as e:
+            error_label.config(text=str(e))
         except ValueError:
             error_label.config(text="Please enter a valid amount")
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
-    def view_account_details(self, account_id):
-        """Show detailed view of an account"""
-        if not account_id:
-            return
+    @metrics.timed("dialog", "standing_orders")
+    def show_standing_orders(self):
+        """List the user's standing orders, with a button to cancel the selected one"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Standing Orders")
+        dialog.geometry("700x300")
+        dialog.transient(self.root)
          
-        # Fetch account details
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
+        columns = ("from", "to", "amount", "interval", "next", "status", "last")
+        tree = ttk.Treeview(dialog, columns=columns, show="headings", height=8)
+        for column, heading, width in zip(columns, ("From", "To", "Amount", "Interval", "Next Run", "Status", "Last Result"),
+                                          (110, 110, 80, 70, 120, 70, 120)):
+            tree.heading(column, text=heading)
+            tree.column(column, width=width)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+         
+        accounts = self.get_active_accounts()
+        numbers = {account.id: account.account_number for account in accounts}
+        currencies = {account.id: account.currency for account in accounts}
+         
+        def refresh():
+            tree.delete(*tree.get_children())
+            conn = database.connect(readonly=True)
+            orders = list_orders(conn, self.current_user.id)
+            conn.close()
+            for order in orders:
+                tree.insert("", tk.END, iid=order.id, values=(
+                    numbers.get(order.from_account, f"#{order.from_account}"), numbers.get(order.to_account, f"#{order.to_account}"),
+                    format_money(order.amount, currencies.get(order.from_account, BASE)), order.interval,
+                    timeutil.format_time(order.next_run) if order.status == 'active' else "", order.status, order.last_result or ""))
+         
+        def cancel():
+            if tree.focus() and messagebox.askyesno("Cancel Order", "Stop this standing order?", parent=dialog):
+                self.writer.call(cancel_order, int(tree.focus()), self.current_user.id)
+                refresh()
+         
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(pady=(0, 10))
+        cancel_button = ttk.Button(button_frame, text="Cancel Order", command=cancel)
+        cancel_button.pack(side=tk.LEFT, padx=5)
+         
+        close_button = ttk.Button(button_frame, text="Close", command=dialog.destroy)
+        close_button.pack(side=tk.LEFT, padx=5)
+         
+        refresh()
+     
+    def post(self, func, *args, **kwargs):
+        """Run a ledger posting on the writer and apply its change events right away"""
+        result = self.writer.call(func, *args, **kwargs)
+        self.events.deliver()
+        return result
+     
+    def poll_events(self):
+        """Deliver change events published by background threads"""
+        self.events.deliver()
+        self.root.after(200, self.poll_events)
+     
+    def evict_cached_accounts(self, result):
+        """Drop the accounts of a posting, and the user's account list, from the account cache"""
+        account_ids = [account_id for account_id in (result.account_id, result.counterparty_id) if account_id is not None]
+        self.account_cache.invalidate(*account_ids, user_id=self.current_user.id if self.current_user else None)
+     
+    def changed_accounts(self, result, known_ids):
+        """Re-read the accounts of a posting that a view shows (or, for a new account, should show)"""
+        accounts = []
+        for account_id in (result.account_id, result.counterparty_id):
+            if account_id is None:
+                continue
+            if account_id in known_ids or result.transaction_type == "Open":
+                account = self.ledger.get_account(account_id, user_id=self.current_user.id)
+                if account is not None:
+                    accounts.append(account)
+        return accounts
+     
+    def load_user_accounts(self, user_id):
+        """Load every account row of a user for the account cache"""
+        conn = database.connect(readonly=True)
+        cursor = database.model_cursor(conn, Account)
+         
+        cursor.execute("SELECT * FROM accounts WHERE user_id = ?", (user_id,))
+         
+        accounts = cursor.fetchall()
+        conn.close()
+        return accounts
+     
+    def load_account_entry(self, account_id, limit):
+        """Load an account row and its most recent transactions for the account cache"""
+        conn = database.connect(readonly=True)
+        cursor = database.model_cursor(conn, Account)
          
         cursor.execute('''
         SELECT * FROM accounts WHERE id = ?
         ''', (account_id,))
          
         account = cursor.fetchone()
+        transactions = TransactionColumns()
          
-        if not account:
-            conn.close()
+        if account:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT * FROM transactions 
+            WHERE account_id = ? 
+            ORDER BY transaction_time DESC 
+            LIMIT ?
+            ''', (account_id, limit))
+             
+            transactions.extend(cursor)
+         
+        conn.close()
+        return account, transactions
+     
+    def get_active_accounts(self):
+        """Return the user's active accounts"""
+        accounts = self.account_cache.get_user_accounts(self.current_user.id, self.load_user_accounts)
+        return [account for account in accounts if account.status == 'active']
+     
+    @metrics.timed("dialog", "account_details")
+    def view_account_details(self, account_id):
+        """Show detailed view of an account"""
+        if not account_id:
             return
          
-        # Fetch recent transactions
-        cursor.execute('''
-        SELECT * FROM transactions 
-        WHERE account_id = ? 
-        ORDER BY transaction_date DESC 
-        LIMIT 10
-        ''', (account_id,))
+        # Fetch account details and recent transactions (cached per account)
+        account, transactions = self.account_cache.get_account(account_id, self.load_account_entry)
          
-        transactions = cursor.fetchall()
-        conn.close()
+        if not account:
+            return
          
         # Create dialog
         dialog = tk.Toplevel(self.root)
-        dialog.title(f"Account Details - {account[2]}")
+        dialog.title(f"Account Details - {account.account_number}")
         dialog.geometry("600x500")
         dialog.resizable(True, True)
         dialog.transient(self.root)
@@ -1575,35 +1874,35 @@ class BankManagementSystem:
         number_label = ttk.Label(details_frame, text="Account Number:", font=("Helvetica", 10, "bold"))
         number_label.grid(row=0, column=0, sticky=tk.W, pady=5)
          
-        number_value = ttk.Label(details_frame, text=account[2])
+        number_value = ttk.Label(details_frame, text=account.account_number)
         number_value.grid(row=0, column=1, sticky=tk.W, pady=5)
          
         # Account type
         type_label = ttk.Label(details_frame, text="Account Type:", font=("Helvetica", 10, "bold"))
         type_label.grid(row=1, column=0, sticky=tk.W, pady=5)
          
-        type_value = ttk.Label(details_frame, text=account[3])
+        type_value = ttk.Label(details_frame, text=account.account_type)
         type_value.grid(row=1, column=1, sticky=tk.W, pady=5)
          
         # Balance
         balance_label = ttk.Label(details_frame, text="Current Balance:", font=("Helvetica", 10, "bold"))
         balance_label.grid(row=2, column=0, sticky=tk.W, pady=5)
          
-        balance_value = ttk.Label(details_frame, text=f"${account[4]:.2f}")
+        balance_value = ttk.Label(details_frame, text=format_money(account.balance, account.currency))
         balance_value.grid(row=2, column=1, sticky=tk.W, pady=5)
          
         # Opening date
         opening_label = ttk.Label(details_frame, text="Opening Date:", font=("Helvetica", 10, "bold"))
         opening_label.grid(row=3, column=0, sticky=tk.W, pady=5)
          
-        opening_value = ttk.Label(details_frame, text=account[5])
+        opening_value = ttk.Label(details_frame, text=timeutil.format_time(account.opening_time, default=account.opening_date))
         opening_value.grid(row=3, column=1, sticky=tk.W, pady=5)
          
         # Status
         status_label = ttk.Label(details_frame, text="Status:", font=("Helvetica", 10, "bold"))
         status_label.grid(row=4, column=0, sticky=tk.W, pady=5)
          
-        status_value = ttk.Label(details_frame, text=account[6].capitalize())
+        status_value = ttk.Label(details_frame, text=account.status.capitalize())
         status_value.grid(row=4, column=1, sticky=tk.W, pady=5)
          
         # Buttons
@@ -1651,41 +1950,23 @@ class BankManagementSystem:
          
         # Populate the treeview with transactions
         for transaction in transactions:
-            transaction_id = transaction[0]
-            transaction_type = transaction[2]
-            amount = transaction[3]
-            description = transaction[4]
-            transaction_date = transaction[5]
-            reference = transaction[6]
-            status = transaction[7]
-             
-            tree.insert("", tk.END, iid=transaction_id, values=(transaction_date, transaction_type, f"${amount:.2f}", description, reference, status))
+            tree.insert("", tk.END, iid=transaction.id, values=(timeutil.format_time(transaction.transaction_time, default=transaction.transaction_date), transaction.transaction_type, format_money(transaction.amount, account.currency), transaction.description, transaction.reference_number, transaction.status))
      
+    @metrics.timed("dialog", "transaction_details")
     def view_transaction_details(self, transaction_id):
         """Show detailed view of a transaction"""
         if not transaction_id:
             return
          
-        # Fetch transaction details
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
-         
-        cursor.execute('''
-        SELECT t.*, a.account_number, a.account_type 
-        FROM transactions t
-        JOIN accounts a ON t.account_id = a.id
-        WHERE t.id = ?
-        ''', (transaction_id,))
-         
-        transaction = cursor.fetchone()
-        conn.close()
+        # Fetch transaction details (archived transactions are looked up in their month file)
+        transaction = self.ledger.get_transaction(int(transaction_id), self.current_user.id)
          
         if not transaction:
             return
          
         # Create dialog
         dialog = tk.Toplevel(self.root)
-        dialog.title(f"Transaction Details - {transaction[6]}")
+        dialog.title(f"Transaction Details - {transaction.reference_number}")
         dialog.geometry("400x350")
         dialog.resizable(False, False)
         dialog.transient(self.root)
@@ -1698,49 +1979,49 @@ class BankManagementSystem:
         ref_label = ttk.Label(details_frame, text="Reference Number:", font=("Helvetica", 10, "bold"))
         ref_label.grid(row=0, column=0, sticky=tk.W, pady=5)
          
-        ref_value = ttk.Label(details_frame, text=transaction[6])
+        ref_value = ttk.Label(details_frame, text=transaction.reference_number)
         ref_value.grid(row=0, column=1, sticky=tk.W, pady=5)
          
         # Account
         account_label = ttk.Label(details_frame, text="Account:", font=("Helvetica", 10, "bold"))
         account_label.grid(row=1, column=0, sticky=tk.W, pady=5)
          
-        account_value = ttk.Label(details_frame, text=f"{transaction[8]} ({transaction[9]})")
+        account_value = ttk.Label(details_frame, text=f"{transaction.account_number} ({transaction.account_type})")
         account_value.grid(row=1, column=1, sticky=tk.W, pady=5)
          
         # Type
         type_label = ttk.Label(details_frame, text="Transaction Type:", font=("Helvetica", 10, "bold"))
         type_label.grid(row=2, column=0, sticky=tk.W, pady=5)
          
-        type_value = ttk.Label(details_frame, text=transaction[2])
+        type_value = ttk.Label(details_frame, text=transaction.transaction_type)
         type_value.grid(row=2, column=1, sticky=tk.W, pady=5)
          
         # Amount
         amount_label = ttk.Label(details_frame, text="Amount:", font=("Helvetica", 10, "bold"))
         amount_label.grid(row=3, column=0, sticky=tk.W, pady=5)
          
-        amount_value = ttk.Label(details_frame, text=f"${transaction[3]:.2f}")
+        amount_value = ttk.Label(details_frame, text=format_money(transaction.amount, transaction.currency or BASE))
         amount_value.grid(row=3, column=1, sticky=tk.W, pady=5)
          
         # Description
         desc_label = ttk.Label(details_frame, text="Description:", font=("Helvetica", 10, "bold"))
         desc_label.grid(row=4, column=0, sticky=tk.W, pady=5)
          
-        desc_value = ttk.Label(details_frame, text=transaction[4] or "N/A")
+        desc_value = ttk.Label(details_frame, text=transaction.description or "N/A")
         desc_value.grid(row=4, column=1, sticky=tk.W, pady=5)
          
         # Date
         date_label = ttk.Label(details_frame, text="Date:", font=("Helvetica", 10, "bold"))
         date_label.grid(row=5, column=0, sticky=tk.W, pady=5)
          
-        date_value = ttk.Label(details_frame, text=transaction[5])
+        date_value = ttk.Label(details_frame, text=timeutil.format_time(transaction.transaction_time, timeutil.TEXT_FORMAT, transaction.transaction_date))
         date_value.grid(row=5, column=1, sticky=tk.W, pady=5)
          
         # Status
         status_label = ttk.Label(details_frame, text="Status:", font=("Helvetica", 10, "bold"))
         status_label.grid(row=6, column=0, sticky=tk.W, pady=5)
          
-        status_value = ttk.Label(details_frame, text=transaction[7].capitalize())
+        status_value = ttk.Label(details_frame, text=transaction.status.capitalize())
         status_value.grid(row=6, column=1, sticky=tk.W, pady=5)
          
         # Close button
@@ -1751,50 +2032,31 @@ class BankManagementSystem:
         """Close an account"""
         if not account_id:
             return
+        # The Treeview hands over its iid as text; the views and the account cache key accounts by int
+        account_id = int(account_id)
          
         # Ask for confirmation
         if not messagebox.askyesno("Confirm", "Are you sure you want to close this account? This cannot be undone."):
             return
          
         # Check if account has balance
-        conn = sqlite3.connect('bank_management.db')
-        cursor = conn.cursor()
-         
-        cursor.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,))
-        balance = cursor.fetchone()[0]
+        account = self.ledger.get_account(account_id)
+        balance = account.balance
          
         if balance > 0:
-            if not messagebox.askyesno("Warning", f"This account has a balance of ${balance:.2f}. Do you want to proceed?"):
-                conn.close()
+            if not messagebox.askyesno("Warning", f"This account has a balance of {format_money(balance, account.currency)}. Do you want to proceed?"):
                 return
          
         # Update account status
-        cursor.execute("UPDATE accounts SET status = 'closed' WHERE id = ?", (account_id,))
-        conn.commit()
-        conn.close()
+        try:
+            self.post(self.ledger.close_account, account_id, user_id=self.current_user.id)
+        except LedgerError as e:
+            messagebox.showerror("Error", str(e))
+            return
          
         messagebox.showinfo("Success", "Account closed successfully")
-         
-        # Refresh the accounts view if it's open
-        if self.current_frame:
-            main_content = None
-            for widget in self.current_frame.winfo_children():
-                if isinstance(widget, ttk.Frame) and widget.winfo_children():
-                    for child in widget.winfo_children():
-                        if isinstance(child, ttk.Frame) and child.winfo_width() > 200:
-                            main_content = child
-                            break
-             
-            if main_content:
-                title_widget = None
-                for widget in main_content.winfo_children():
-                    if isinstance(widget, ttk.Label) and widget.cget("text") == "Accounts Management":
-                        title_widget = widget
-                        break
-                 
-                if title_widget:
-                    self.load_accounts_content(main_content)
      
+    @metrics.timed("dialog", "edit_profile")
     def show_edit_profile_dialog(self):
         """Show dialog to edit user profile"""
         dialog = tk.Toplevel(self.root)
@@ -1814,7 +2076,7 @@ class BankManagementSystem:
          
         name_entry = ttk.Entry(form_frame, width=30)
         name_entry.grid(row=0, column=1, sticky=tk.W, pady=10)
-        name_entry.insert(0, self.current_user['full_name'])
+        name_entry.insert(0, self.current_user.full_name)
          
         # Email
         email_label = ttk.Label(form_frame, text="Email:")
@@ -1822,7 +2084,7 @@ class BankManagementSystem:
          
         email_entry = ttk.Entry(form_frame, width=30)
         email_entry.grid(row=1, column=1, sticky=tk.W, pady=10)
-        email_entry.insert(0, self.current_user['email'])
+        email_entry.insert(0, self.current_user.email)
          
         # Phone
         phone_label = ttk.Label(form_frame, text="Phone:")
@@ -1830,7 +2092,7 @@ class BankManagementSystem:
          
         phone_entry = ttk.Entry(form_frame, width=30)
         phone_entry.grid(row=2, column=1, sticky=tk.W, pady=10)
-        phone_entry.insert(0, self.current_user['phone'] or "")
+        phone_entry.insert(0, self.current_user.phone or "")
          
         # Address
         address_label = ttk.Label(form_frame, text="Address:")
@@ -1838,7 +2100,7 @@ class BankManagementSystem:
          
         address_entry = ttk.Entry(form_frame, width=30)
         address_entry.grid(row=3, column=1, sticky=tk.W, pady=10)
-        address_entry.insert(0, self.current_user['address'] or "")
+        address_entry.insert(0, self.current_user.address or "")
          
         # Error message label
         error_label = ttk.Label(form_frame, text="", foreground=self.error_color)
@@ -1874,22 +2136,20 @@ class BankManagementSystem:
                 return
              
             # Update database
-            conn = sqlite3.connect('bank_management.db')
+            conn = database.connect()
             cursor = conn.cursor()
              
             cursor.execute('''
             UPDATE users SET full_name = ?, email = ?, phone = ?, address = ?
             WHERE id = ?
-            ''', (full_name, email, phone, address, self.current_user['id']))
+            ''', (full_name, email, phone, address, self.current_user.id))
              
             conn.commit()
             conn.close()
              
             # Update current user information
-            self.current_user['full_name'] = full_name
-            self.current_user['email'] = email
-            self.current_user['phone'] = phone
-            self.current_user['address'] = address
+            self.user_cache.pop(self.current_user.username)
+            self.current_user = self.current_user._replace(full_name=full_name, email=email, phone=phone, address=address)
              
             messagebox.showinfo("Success", "Profile updated successfully")
             dialog.destroy()
@@ -1916,6 +2176,7 @@ class BankManagementSystem:
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
+    @metrics.timed("dialog", "change_password")
     def show_change_password_dialog(self):
         """Show dialog to change password"""
         dialog = tk.Toplevel(self.root)
@@ -1990,34 +2251,113 @@ class BankManagementSystem:
                 error_label.config(text="Password must be at least 6 characters")
                 return
              
-            # Hash passwords
-            current_hashed = hashlib.sha256(current_password.encode()).hexdigest()
-            new_hashed = hashlib.sha256(new_password.encode()).hexdigest()
-             
-            # Verify current password
-            conn = sqlite3.connect('bank_management.db')
+            # Fetch the stored hash
+            conn = database.connect(readonly=True)
             cursor = conn.cursor()
              
-            cursor.execute("SELECT password FROM users WHERE id = ?", (self.current_user['id'],))
+            cursor.execute("SELECT password FROM users WHERE id = ?", (self.current_user.id,))
             stored_password = cursor.fetchone()[0]
+            conn.close()
              
-            if current_hashed != stored_password:
+            # Verify the current password and hash the new one off the Tk thread
+            def check_and_hash():
+                valid, _ = security.verify_password(current_password, stored_password)
+                return valid, security.hash_password(new_password) if valid else None
+             
+            error_label.config(text="Verifying...")
+            self.run_in_background(
+                check_and_hash,
+                lambda result: self.save_new_password(result, error_label, dialog),
+                lambda e: error_label.config(text=f"Error: {str(e)}")
+            )
+        except Exception as e:
+            error_label.config(text=f"Error: {str(e)}")
+     
+    def save_new_password(self, result, error_label, dialog):
+        """Store the new password hash once the current password has been verified"""
+        try:
+            valid, new_hashed = result
+            if not valid:
                 error_label.config(text="Current password is incorrect")
-                conn.close()
                 return
              
             # Update password
-            cursor.execute("UPDATE users SET password = ? WHERE id = ?", (new_hashed, self.current_user['id']))
+            conn = database.connect()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET password = ? WHERE id = ?", (new_hashed, self.current_user.id))
             conn.commit()
             conn.close()
+            self.user_cache.pop(self.current_user.username)
              
             messagebox.showinfo("Success", "Password changed successfully")
             dialog.destroy()
         except Exception as e:
             error_label.config(text=f"Error: {str(e)}")
      
+    def show_query_profile(self):
+        """Show per-statement timings collected by the query profiler"""
+        if profiler.PROFILER is None:
+            messagebox.showinfo("Query Profile", "Profiling is off. Start the app with BANK_PROFILE=1 to collect timings.")
+            return
+         
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Query Profile")
+        dialog.geometry("900x400")
+        dialog.transient(self.root)
+         
+        frame = ttk.Frame(dialog, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+         
+        columns = ("count", "total", "mean", "p95", "max", "query")
+        tree = ttk.Treeview(frame, columns=columns, show="headings")
+        for column, text, width in (("count", "Calls", 60), ("total", "Total ms", 80), ("mean", "Mean ms", 70),
+                                    ("p95", "p95 ms", 70), ("max", "Max ms", 70), ("query", "Statement", 520)):
+            tree.heading(column, text=text)
+            tree.column(column, width=width, anchor=tk.W if column == "query" else tk.E)
+         
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscroll=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+         
+        def refresh():
+            tree.delete(*tree.get_children())
+            for row in profiler.PROFILER.report():
+                tree.insert("", tk.END, values=(row["count"], row["total_ms"], row["mean_ms"], row["p95_ms"],
+                                                row["max_ms"], row["fingerprint"]))
+         
+        def dump():
+            messagebox.showinfo("Query Profile", f"Profile written to {profiler.dump()}", parent=dialog)
+         
+        button_frame = ttk.Frame(dialog, padding=(10, 0, 10, 10))
+        button_frame.pack(fill=tk.X)
+        ttk.Button(button_frame, text="Refresh", command=refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Save Report", command=dump).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Reset", command=lambda: (profiler.PROFILER.reset(), refresh())).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT, padx=5)
+        refresh()
+     
+    def on_close(self):
+        """Write the final metrics export and close the window"""
+        self.lag_monitor.stop()
+        if self.backups:
+            self.backups.stop()
+        if self.replica:
+            self.replica.stop()
+        self.scheduler.stop()
+        self.writer.stop()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        self.root.destroy()
+     
     def logout(self):
         """Log out current user and return to login screen"""
+        if self.session_token:
+            self.sessions.revoke(self.session_token)
+            self.session_token = None
+        if self.session_check_job:
+            self.root.after_cancel(self.session_check_job)
+            self.session_check_job = None
         self.current_user = None
         self.show_login()
  
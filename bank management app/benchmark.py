@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+ 
+import database
+import profiler
+import security
+from ledger import Ledger, LedgerError
+from writer import PostingWriter
+ 
+# Every synthetic user shares this password (hashed once, see populate)
+PASSWORD = "benchmark-password"
+ACCOUNT_TYPES = ("Savings", "Checking", "Fixed Deposit", "Loan")
+SCENARIOS = ("login", "dashboard", "history_page", "deposit", "transfer", "batch_posting")
+ 
+ 
+def populate(path, users, accounts_per_user=2, transactions=10000, seed=0, chunk=50000):
+    """Fill a database with synthetic users, accounts and transactions
+     
+    Rows are generated lazily and inserted in chunks, so ten million
+    transactions do not need to fit in memory. Returns the row counts.
+    """
+    rng = random.Random(seed)
+    conn = database.connect(path)
+    database.create_schema(conn)
+    conn.execute("PRAGMA synchronous=OFF")
+    cursor = conn.cursor()
+     
+    # Hashing is slow on purpose, so every user gets the same hash
+    password = security.hash_password(PASSWORD)
+    cursor.executemany(
+        "INSERT INTO users (username, password, full_name, email, registration_date) VALUES (?, ?, ?, ?, ?)",
+        ((f"user{i}", password, f"User {i}", f"user{i}@example.com", "2024-01-01 09:00:00") for i in range(users)))
+    first_user = cursor.execute("SELECT MIN(id) FROM users WHERE username LIKE 'user%'").fetchone()[0]
+     
+    # Large balances so withdrawals and transfers never run dry mid-run
+    cursor.executemany(
+        "INSERT INTO accounts (user_id, account_number, account_type, balance, opening_date, status) VALUES (?, ?, ?, ?, ?, ?)",
+        ((first_user + i // accounts_per_user, f"B{i:09d}", ACCOUNT_TYPES[i % len(ACCOUNT_TYPES)], 1e9,
+          "2024-01-01 09:00:00", "active") for i in range(users * accounts_per_user)))
+    conn.commit()
+    first_account, last_account = cursor.execute("SELECT MIN(id), MAX(id) FROM accounts WHERE account_number LIKE 'B%'").fetchone()
+     
+    def rows(start, count):
+        for i in range(start, start + count):
+            kind = "Deposit" if rng.random() < 0.6 else "Withdrawal"
+            seconds = i % 86400
+            yield (rng.randint(first_account, last_account), kind, round(rng.uniform(1, 500), 2), kind,
+                   f"2024-{1 + i // 2678400 % 12:02d}-{1 + i // 86400 % 28:02d} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}",
+                   f"SYN-{i:09d}", "completed")
+     
+    for start in range(0, transactions, chunk):
+        cursor.executemany(
+            "INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows(start, min(chunk, transactions - start)))
+        conn.commit()
+     
+    # Fill the epoch-microsecond time columns from the generated date text
+    database.migrate_times(conn, chunk=max(chunk, 100000), pause=0)
+    conn.execute("ANALYZE")
+    conn.close()
+    return {"users": users, "accounts": users * accounts_per_user, "transactions": transactions}
+ 
+ 
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+ 
+ 
+class Workload:
+    """The operations being measured, each picking random users and accounts"""
+     
+    def __init__(self, path, writer):
+        self.path = path
+        self.ledger = Ledger(path)
+        self.writer = writer
+        self.local = threading.local()
+        conn = database.connect(path)
+        self.accounts = conn.execute("SELECT id, user_id FROM accounts WHERE status = 'active'").fetchall()
+        self.users = conn.execute("SELECT id, username FROM users").fetchall()
+        self.max_transaction = conn.execute("SELECT MAX(id) FROM transactions").fetchone()[0] or 1
+        conn.close()
+     
+    def connection(self):
+        """Per-thread connection, the way each terminal or API worker has its own"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = database.connect(self.path)
+            conn.execute("PRAGMA busy_timeout = 30000")
+        return conn
+     
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+     
+    def login(self, rng):
+        username = rng.choice(self.users)[1]
+        self.ledger.authenticate(username, PASSWORD, conn=self.connection())
+     
+    def dashboard(self, rng):
+        user_id = rng.choice(self.users)[0]
+        self.ledger.get_accounts(user_id, conn=self.connection())
+        self.ledger.history(user_id, limit=5, conn=self.connection())
+     
+    def history_page(self, rng):
+        user_id = rng.choice(self.users)[0]
+        self.ledger.history(user_id, limit=50, before_id=rng.randint(1, self.max_transaction), conn=self.connection())
+     
+    def deposit(self, rng):
+        account_id, user_id = rng.choice(self.accounts)
+        self.ledger.deposit(account_id, 1.0, "Benchmark", user_id=user_id, conn=self.connection())
+     
+    def transfer(self, rng):
+        (from_id, user_id), (to_id, _) = rng.sample(self.accounts, 2)
+        self.ledger.transfer(from_id, to_id, 1.0, "Benchmark", user_id=user_id, conn=self.connection())
+     
+    def batch_posting(self, rng):
+        account_id, user_id = rng.choice(self.accounts)
+        self.writer.call(self.ledger.deposit, account_id, 1.0, "Benchmark", user_id=user_id)
+ 
+ 
+def run_scenario(workload, name, workers, operations, seed=0):
+    """Run one operation ``operations`` times spread over ``workers`` threads"""
+    operation = getattr(workload, name)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_worker = max(1, operations // workers)
+     
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        timings = []
+        try:
+            for _ in range(per_worker):
+                start = time.perf_counter()
+                try:
+                    operation(rng)
+                except (LedgerError, sqlite3.Error) as e:
+                    errors.append(str(e))
+                    continue
+                timings.append(time.perf_counter() - start)
+        finally:
+            workload.close()
+        with lock:
+            latencies.extend(timings)
+     
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+     
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "scenario": name,
+        "workers": workers,
+        "operations": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+ 
+ 
+def compare(baseline, report):
+    """Yield (scenario, workers, metric, old, new, change) for the p95 and throughput of each run"""
+    old_runs = {(run["scenario"], run["workers"]): run for run in baseline["results"]}
+    for run in report["results"]:
+        old = old_runs.get((run["scenario"], run["workers"]))
+        if old is None:
+            continue
+        for metric in ("p95_ms", "throughput"):
+            if old[metric] and run[metric] is not None:
+                yield run["scenario"], run["workers"], metric, old[metric], run[metric], run[metric] / old[metric] - 1
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ledger hot paths on synthetic data")
+    parser.add_argument("--db", default="benchmark.db", help="Database to populate and measure (never the live one by default)")
+    parser.add_argument("--transactions", type=int, default=100000, help="Synthetic transaction rows (1k to 10M)")
+    parser.add_argument("--users", type=int, default=None, help="Synthetic users (default: one per 100 transactions)")
+    parser.add_argument("--reuse", action="store_true", help="Measure the existing data in --db instead of regenerating it")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--workers", default="1,8", help="Comma-separated worker counts to run each scenario with")
+    parser.add_argument("--operations", type=int, default=500, help="Operations per scenario run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare p95 latency and throughput against")
+    parser.add_argument("--profile", action="store_true", help="Include per-statement timings from the query profiler in the report")
+    args = parser.parse_args()
+     
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenario: " + ", ".join(sorted(unknown)))
+     
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+    }
+    if args.reuse:
+        conn = database.connect(args.db)
+        report["data"] = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                          for table in ("users", "accounts", "transactions")}
+        conn.close()
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        users = args.users or max(10, args.transactions // 100)
+        started = time.perf_counter()
+        report["data"] = populate(args.db, users, transactions=args.transactions, seed=args.seed)
+        report["data"]["populate_seconds"] = round(time.perf_counter() - started, 2)
+     
+    if args.profile:
+        profiler.enable(log_path=os.path.splitext(args.db)[0] + "_slow_queries.log", dump_on_exit=False)
+    writer = PostingWriter(args.db).start()
+    workload = Workload(args.db, writer)
+    report["results"] = []
+    try:
+        for name in scenarios:
+            for workers in (int(count) for count in args.workers.split(",")):
+                result = run_scenario(workload, name, workers, args.operations, args.seed)
+                report["results"].append(result)
+                print(f"{name:<14} x{workers:<3} {result['throughput']:>9} ops/s  p50 {result['p50_ms']} ms  "
+                      f"p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms", file=sys.stderr)
+    finally:
+        writer.stop()
+     
+    if profiler.PROFILER is not None:
+        report["queries"] = profiler.PROFILER.report()
+     
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, workers, metric, old, new, change in compare(baseline, report):
+            print(f"{name:<14} x{workers:<3} {metric:<10} {old:>10} -> {new:<10} {change:+.1%}", file=sys.stderr)
+     
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+ 
+# Default for get() callers that need to cache None as a real value
+MISSING = object()
+ 
+ 
+class LRUCache:
+    """Size-bounded mapping that evicts the least recently used entry
+     
+    With a ``ttl`` (seconds) entries also expire, which keeps values that
+    other terminals may change from going stale indefinitely.
+    """
+     
+    def __init__(self, maxsize=128, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+     
+    def get(self, key, default=None):
+        """Return the cached value and mark it as recently used"""
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            value, expires = self.data[key]
+            if expires is not None and expires <= self.clock():
+                del self.data[key]
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+     
+    def put(self, key, value):
+        """Store a value, evicting the oldest entry if the cache is full"""
+        expires = self.clock() + self.ttl if self.ttl else None
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+     
+    def pop(self, key, default=None):
+        """Remove and return an entry (used for invalidation)"""
+        with self.lock:
+            if key not in self.data:
+                return default
+            return self.data.pop(key)[0]
+     
+    def clear(self):
+        """Drop every entry but keep the counters"""
+        with self.lock:
+            self.data.clear()
+     
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+     
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+     
+    def __len__(self):
+        with self.lock:
+            return len(self.data)
+ 
+ 
+class AccountCache:
+    """Read cache for account details, recent transactions and per-user account lists
+     
+    Entries are keyed by account id (and user id for the account lists) and
+    must be invalidated by every path that posts to or changes an account.
+    A short TTL bounds staleness when other terminals write to the same
+    database.
+    """
+     
+    def __init__(self, maxsize=256, recent_limit=10, ttl=30):
+        self.recent_limit = recent_limit
+        self.accounts = LRUCache(maxsize, ttl=ttl)
+        self.user_accounts = LRUCache(maxsize, ttl=ttl)
+     
+    def get_account(self, account_id, loader):
+        """Return (account, recent_transactions), calling loader(account_id, limit) on a miss"""
+        account_id = int(account_id)
+        entry = self.accounts.get(account_id)
+        if entry is None:
+            entry = loader(account_id, self.recent_limit)
+            if entry[0] is not None:
+                self.accounts.put(account_id, entry)
+        return entry
+     
+    def get_user_accounts(self, user_id, loader):
+        """Return the account rows of a user, calling loader(user_id) on a miss"""
+        rows = self.user_accounts.get(user_id)
+        if rows is None:
+            rows = loader(user_id)
+            self.user_accounts.put(user_id, rows)
+        return rows
+     
+    def invalidate(self, *account_ids, user_id=None):
+        """Drop cached entries after a posting or account change"""
+        for account_id in account_ids:
+            self.accounts.pop(int(account_id))
+        if user_id is not None:
+            self.user_accounts.pop(user_id)
+     
+    def stats(self):
+        """Return hit/miss counters for both caches"""
+        return {
+            'accounts': self.accounts.stats(),
+            'user_accounts': self.user_accounts.stats(),
+        }
@@ -0,0 +1,236 @@
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+ 
+import database
+import timeutil
+from rollups import split_script
+ 
+# Changes handed out per poll
+BATCH = 1000
+# How often a following consumer looks for new changes, in seconds
+POLL_INTERVAL = 0.5
+ 
+ChangeEvent = namedtuple('ChangeEvent', 'seq table_name op row_id data changed_at')
+ 
+# Captured tables: columns copied into each change, and the columns whose updates are changes.
+# Backfills of other columns (such as the *_time migration) stay out of the log.
+CAPTURED = {
+    'accounts': (('id', 'user_id', 'account_number', 'account_type', 'balance', 'status', 'currency'),
+                 ('account_type', 'balance', 'status')),
+    'transactions': (('id', 'account_id', 'transaction_type', 'amount', 'description', 'transaction_date',
+                      'reference_number', 'status', 'transaction_time'),
+                     ('amount', 'status')),
+}
+ 
+CDC_TABLES = '''
+CREATE TABLE IF NOT EXISTS cdc_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    changed_at INTEGER NOT NULL
+);
+ 
+CREATE TABLE IF NOT EXISTS cdc_consumers (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    updated_at INTEGER
+);
+'''
+ 
+# Epoch microseconds (to the millisecond) inside a trigger
+NOW_MICROS = "CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)"
+ 
+ 
+def capture_triggers():
+    """Insert and update triggers appending every change of the captured tables to cdc_log"""
+    script = ""
+    for table, (columns, watched) in CAPTURED.items():
+        data = "json_object(" + ", ".join(f"'{column}', NEW.{column}" for column in columns) + ")"
+        script += f'''
+DROP TRIGGER IF EXISTS cdc_{table}_insert;
+CREATE TRIGGER cdc_{table}_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO cdc_log (table_name, op, row_id, data, changed_at) VALUES ('{table}', 'insert', NEW.id, {data}, {NOW_MICROS});
+END;
+ 
+DROP TRIGGER IF EXISTS cdc_{table}_update;
+CREATE TRIGGER cdc_{table}_update AFTER UPDATE OF {', '.join(watched)} ON {table} BEGIN
+    INSERT INTO cdc_log (table_name, op, row_id, data, changed_at) VALUES ('{table}', 'update', NEW.id, {data}, {NOW_MICROS});
+END;
+'''
+    return script
+ 
+ 
+def create_tables(conn):
+    for statement in split_script(CDC_TABLES):
+        conn.execute(statement)
+    conn.commit()
+ 
+ 
+def enable(conn):
+    """Start capturing changes; returns the sequence number the feed continues after
+     
+    The triggers write the log inside each posting's own transaction, and
+    SQLite commits one writer at a time, so sequence numbers become
+    visible in order: a consumer that has read up to N never misses a
+    change below N that commits later. Deleting transactions (the
+    archive move) is not a change and isn't captured.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in split_script(CDC_TABLES + capture_triggers()):
+            conn.execute(statement)
+        start = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cdc_log").fetchone()[0]
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return start
+ 
+ 
+def disable(conn):
+    """Stop capturing; the log and consumer positions are kept"""
+    for table in CAPTURED:
+        conn.execute(f"DROP TRIGGER IF EXISTS cdc_{table}_insert")
+        conn.execute(f"DROP TRIGGER IF EXISTS cdc_{table}_update")
+    conn.commit()
+ 
+ 
+def enabled(conn):
+    return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'cdc\\_%' ESCAPE '\\'").fetchone()[0] > 0
+ 
+ 
+def prune(conn):
+    """Delete the changes every registered consumer has committed; returns how many"""
+    row = conn.execute("SELECT MIN(position) FROM cdc_consumers").fetchone()
+    if row[0] is None:
+        return 0
+    deleted = conn.execute("DELETE FROM cdc_log WHERE seq <= ?", (row[0],)).rowcount
+    conn.commit()
+    return deleted
+ 
+ 
+class Consumer:
+    """A named reader of the change log that keeps a checkpoint
+     
+    The log is keyed by its sequence number, so every batch is one range
+    scan of the primary key and catching up reads the table in order.
+    poll() hands out the next batch without moving the checkpoint;
+    commit() stores it. A consumer that stops before committing gets the
+    same changes again, so delivery is at least once. A new consumer
+    starts at the beginning of the log, or wherever seek() puts it.
+    """
+     
+    def __init__(self, name, path=None, batch=BATCH):
+        self.name = name
+        self.batch = batch
+        self.conn = database.connect(path)
+        create_tables(self.conn)
+        row = self.conn.execute("SELECT position FROM cdc_consumers WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO cdc_consumers (name, position, updated_at) VALUES (?, 0, ?)", (name, timeutil.now()))
+            self.conn.commit()
+        self.position = self.committed = row[0] if row else 0
+     
+    def poll(self, limit=None):
+        """The next changes after the current position (up to ``batch``); moves the position, not the checkpoint"""
+        rows = self.conn.execute("SELECT seq, table_name, op, row_id, data, changed_at FROM cdc_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                                 (self.position, limit or self.batch)).fetchall()
+        if rows:
+            self.position = rows[-1][0]
+        return [ChangeEvent(seq, table_name, op, row_id, json.loads(data), changed_at)
+                for seq, table_name, op, row_id, data, changed_at in rows]
+     
+    def commit(self):
+        """Store the current position as the checkpoint"""
+        if self.position != self.committed:
+            self.conn.execute("UPDATE cdc_consumers SET position = ?, updated_at = ? WHERE name = ?",
+                              (self.position, timeutil.now(), self.name))
+            self.conn.commit()
+            self.committed = self.position
+     
+    def seek(self, seq):
+        """Continue after ``seq`` (0 for the start of the log); takes effect for the checkpoint on commit()"""
+        self.position = seq
+     
+    def batches(self, follow=False, interval=POLL_INTERVAL, commit=True):
+        """Yield batches of changes, committing each one once the loop body has handled it
+         
+        Without ``follow`` it stops when the log is caught up; with it, it
+        waits ``interval`` seconds between empty polls.
+        """
+        while True:
+            events = self.poll()
+            if events:
+                yield events
+                if commit:
+                    self.commit()
+            elif follow:
+                time.sleep(interval)
+            else:
+                return
+     
+    def lag(self):
+        """Changes in the log after the current position"""
+        return self.conn.execute("SELECT COUNT(*) FROM cdc_log WHERE seq > ?", (self.position,)).fetchone()[0]
+     
+    def close(self):
+        self.conn.close()
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Change log of accounts and transactions for downstream consumers")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("enable", help="Start capturing changes")
+    commands.add_parser("disable", help="Stop capturing changes (the log is kept)")
+    commands.add_parser("status", help="Log size and the position and lag of every consumer")
+    tail = commands.add_parser("tail", help="Print changes as JSON lines for a named consumer and checkpoint them")
+    tail.add_argument("consumer")
+    tail.add_argument("--follow", action="store_true", help="Keep waiting for new changes")
+    tail.add_argument("--from", dest="start", type=int, default=None, help="Start after this sequence number")
+    tail.add_argument("--no-commit", action="store_true", help="Don't move the consumer's checkpoint")
+    commands.add_parser("prune", help="Delete changes every consumer has committed")
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    create_tables(conn)
+    if args.command == "enable":
+        print(f"Capturing changes after sequence number {enable(conn)}")
+    elif args.command == "disable":
+        disable(conn)
+        print("Capture stopped")
+    elif args.command == "status":
+        count, first, last = conn.execute("SELECT COUNT(*), MIN(seq), MAX(seq) FROM cdc_log").fetchone()
+        print(f"Capture {'on' if enabled(conn) else 'off'}; {count} changes in the log" + (f" ({first} to {last})" if count else ""))
+        for name, position, updated_at in conn.execute("SELECT * FROM cdc_consumers ORDER BY name"):
+            print(f"  {name:<20} at {position:<10} {max((last or 0) - position, 0):>10} behind, {timeutil.format_time(updated_at)}")
+    elif args.command == "prune":
+        print(f"{prune(conn)} changes deleted")
+    else:
+        consumer = Consumer(args.consumer, args.db)
+        if args.start is not None:
+            consumer.seek(args.start)
+        start = time.perf_counter()
+        count = 0
+        try:
+            for events in consumer.batches(args.follow, commit=not args.no_commit):
+                sys.stdout.write("".join(json.dumps(event._asdict()) + "\n" for event in events))
+                sys.stdout.flush()
+                count += len(events)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        finally:
+            consumer.close()
+        elapsed = time.perf_counter() - start
+        print(f"{count} changes in {elapsed:.2f}s ({count / elapsed if elapsed else 0:,.0f}/s)", file=sys.stderr)
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
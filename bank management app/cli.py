@@ -0,0 +1,321 @@
+import argparse
+import json
+import sys
+ 
+# Only the standard library is imported up front; every command imports the
+# modules it needs, so startup stays fast and nothing loads tkinter or PIL
+ 
+ACCOUNT_TYPES = ("Savings", "Checking", "Fixed Deposit", "Loan")
+# Rows fetched and written per step when streaming history and exports
+PAGE = 1000
+# Postings of an import in flight on the writer at once
+IMPORT_WINDOW = 1000
+# Columns of an import file; to_account only for transfers, the last two optional
+IMPORT_COLUMNS = ("operation", "account", "amount", "to_account", "description", "idempotency_key")
+ 
+ 
+def open_ledger(args, rules=False):
+    """Ledger on --db with the schema in place; ``rules`` adds the fraud rules for money going out"""
+    import database
+    from fx import FXRates
+    from ledger import Ledger
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    fx = FXRates(args.db).load(conn)
+    fraud_rules = None
+    if rules:
+        from fraud import FraudRules
+        fraud_rules = FraudRules(args.db, fx).load(conn)
+    conn.close()
+    return Ledger(args.db, rules=fraud_rules, fx=fx)
+ 
+ 
+def row_writer(output, fields, fmt):
+    """Function writing a list of rows to ``output`` as CSV (with a header) or JSON lines"""
+    if fmt == "jsonl":
+        return lambda rows: output.write("".join(json.dumps(dict(zip(fields, row))) + "\n" for row in rows))
+    import csv
+    out = csv.writer(output, lineterminator="\n")
+    out.writerow(fields)
+    return out.writerows
+ 
+ 
+def show(args, result):
+    if args.json:
+        print(json.dumps(result._asdict()))
+    else:
+        reference = f" {result.reference_number}" if result.reference_number else ""
+        print(f"{result.transaction_type}{reference}: account {result.account_id} amount {result.amount:.2f} balance {result.balance:.2f}")
+ 
+ 
+def create_user(args):
+    import getpass
+    import security
+    password = sys.stdin.readline().rstrip("\n") if args.password_stdin else getpass.getpass("Password: ")
+    if not password:
+        raise SystemExit("error: the password cannot be empty")
+    ledger = open_ledger(args)
+    user_id = ledger.register_user(args.username, security.hash_password(password), args.full_name, args.email, args.phone, args.address)
+    print(json.dumps({"user_id": user_id}) if args.json else user_id)
+ 
+ 
+def open_account(args):
+    ledger = open_ledger(args)
+    show(args, ledger.open_account(args.user, args.type, args.deposit, idempotency_key=args.idempotency_key, currency=args.currency))
+ 
+ 
+def deposit(args):
+    ledger = open_ledger(args)
+    show(args, ledger.deposit(args.account, args.amount, args.description, user_id=args.user, idempotency_key=args.idempotency_key))
+ 
+ 
+def withdraw(args):
+    ledger = open_ledger(args, rules=True)
+    show(args, ledger.withdraw(args.account, args.amount, args.description, user_id=args.user, idempotency_key=args.idempotency_key))
+ 
+ 
+def transfer(args):
+    ledger = open_ledger(args, rules=True)
+    show(args, ledger.transfer(args.from_account, args.to_account, args.amount, args.description, user_id=args.user,
+                               idempotency_key=args.idempotency_key))
+ 
+ 
+def history(args):
+    """Stream a user's transactions, newest first, a page at a time (archived months included)"""
+    import database
+    import timeutil
+    from ledger import Ledger
+    from models import AccountTransaction
+     
+    since, until = timeutil.local_range(args.since, args.until)
+    ledger = Ledger(args.db)
+    conn = database.connect(args.db, readonly=True)
+    write = row_writer(sys.stdout, AccountTransaction._fields, args.format)
+    before_id = None
+    try:
+        while True:
+            page = ledger.history(args.user, args.account, limit=PAGE, before_id=before_id, conn=conn, since=since, until=until)
+            write(page)
+            sys.stdout.flush()
+            if len(page) < PAGE:
+                break
+            before_id = page.ids[-1]
+    finally:
+        conn.close()
+ 
+ 
+def export(args):
+    """Write a table to a file (or stdout) with a forward-only cursor, PAGE rows at a time"""
+    import database
+    import timeutil
+     
+    conn = database.connect(args.db, readonly=True)
+    if args.table == "accounts":
+        cursor = conn.execute("SELECT * FROM accounts WHERE ? IS NULL OR user_id = ? ORDER BY id", (args.user, args.user))
+    else:
+        since, until = timeutil.local_range(args.since, args.until)
+        cursor = conn.execute('''
+        SELECT t.*, a.account_number FROM transactions t JOIN accounts a ON a.id = t.account_id
+        WHERE (? IS NULL OR a.user_id = ?) AND (? IS NULL OR t.transaction_time >= ?) AND (? IS NULL OR t.transaction_time < ?)
+        ORDER BY t.id
+        ''', (args.user, args.user, since, since, until, until))
+    output = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    count = 0
+    try:
+        write = row_writer(output, [column[0] for column in cursor.description], args.format)
+        while True:
+            rows = cursor.fetchmany(PAGE)
+            if not rows:
+                break
+            write(rows)
+            count += len(rows)
+    finally:
+        conn.close()
+        if args.out:
+            output.close()
+    print(f"{count} rows exported", file=sys.stderr)
+ 
+ 
+def import_postings(args):
+    """Post every row of a CSV file through the group-committing writer; refused rows are reported, not fatal"""
+    import csv
+    from collections import deque
+    from ledger import LedgerError
+    from writer import PostingWriter
+     
+    ledger = open_ledger(args, rules=True)
+     
+    def parse(row):
+        operation = (row.get("operation") or "").strip().lower()
+        account, amount = int(row["account"]), float(row["amount"])
+        kwargs = {"idempotency_key": row.get("idempotency_key") or None}
+        description = row.get("description") or None
+        if operation == "deposit":
+            return ledger.deposit, (account, amount, description), kwargs
+        if operation == "withdraw":
+            return ledger.withdraw, (account, amount, description), kwargs
+        if operation == "transfer":
+            return ledger.transfer, (account, int(row["to_account"]), amount, description), kwargs
+        raise ValueError(f"unknown operation {operation!r}")
+     
+    posted = refused = 0
+    pending = deque()
+     
+    def settle():
+        nonlocal posted, refused
+        line, future = pending.popleft()
+        try:
+            future.result()
+            posted += 1
+        except LedgerError as e:
+            refused += 1
+            print(f"line {line}: {e}", file=sys.stderr)
+     
+    writer = PostingWriter(args.db).start()
+    try:
+        with open(args.file, newline="", encoding="utf-8") as source:
+            for line, row in enumerate(csv.DictReader(source), start=2):
+                try:
+                    func, func_args, kwargs = parse(row)
+                except (KeyError, TypeError, ValueError) as e:
+                    refused += 1
+                    print(f"line {line}: {e}", file=sys.stderr)
+                    continue
+                pending.append((line, writer.submit(func, *func_args, **kwargs)))
+                if len(pending) >= IMPORT_WINDOW:
+                    settle()
+        while pending:
+            settle()
+    finally:
+        writer.stop()
+    print(json.dumps({"posted": posted, "refused": refused}) if args.json else f"{posted} posted, {refused} refused")
+    return 1 if refused else 0
+ 
+ 
+def reconcile(args):
+    """Check every balance against its transactions (hot rows plus archived month totals)"""
+    import database
+     
+    conn = database.connect(args.db, readonly=True)
+    try:
+        # Pending outgoing transfers are already taken off the balance; pending incoming ones not yet added
+        movements = dict(conn.execute('''
+        SELECT account_id, SUM(CASE
+            WHEN transaction_type IN ('Deposit', 'Transfer (In)') THEN CASE WHEN COALESCE(status, 'completed') = 'completed' THEN amount ELSE 0 END
+            ELSE CASE WHEN COALESCE(status, 'completed') != 'failed' THEN -amount ELSE 0 END
+        END) FROM transactions GROUP BY account_id
+        '''))
+        for account_id, net in conn.execute("SELECT account_id, SUM(credits - debits) FROM transaction_summaries GROUP BY account_id"):
+            movements[account_id] = movements.get(account_id, 0.0) + net
+        checked = mismatched = 0
+        for account_id, account_number, balance in conn.execute("SELECT id, account_number, balance FROM accounts ORDER BY id"):
+            checked += 1
+            expected = movements.get(account_id, 0.0)
+            # Written so that a NaN balance or total counts as a mismatch
+            if not abs(expected - balance) < 0.005:
+                mismatched += 1
+                print(f"{account_id:>8} {account_number:<14} balance {balance:,.2f} transactions {expected:,.2f} "
+                      f"difference {balance - expected:,.2f}")
+    finally:
+        conn.close()
+    print(f"{checked} accounts checked, {mismatched} out of balance", file=sys.stderr)
+    return 1 if mismatched else 0
+ 
+ 
+def benchmark(args):
+    import benchmark
+    sys.argv = ["bank benchmark"] + args.options
+    benchmark.main()
+ 
+ 
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bank", description="Bank operations from the command line, for scripts and batch jobs")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+     
+    command = commands.add_parser("create-user", help="Register a user (the password is prompted for)")
+    command.add_argument("username")
+    command.add_argument("--full-name", required=True)
+    command.add_argument("--email", required=True)
+    command.add_argument("--phone")
+    command.add_argument("--address")
+    command.add_argument("--password-stdin", action="store_true", help="Read the password from the first line of stdin")
+    command.set_defaults(func=create_user)
+     
+    command = commands.add_parser("open-account", help="Open an account for a user")
+    command.add_argument("user", type=int)
+    command.add_argument("type", choices=ACCOUNT_TYPES)
+    command.add_argument("--deposit", type=float, default=0.0, help="Initial deposit")
+    command.add_argument("--currency", default="USD")
+    command.add_argument("--idempotency-key")
+    command.set_defaults(func=open_account)
+     
+    for name, func, help_text in (("deposit", deposit, "Credit an account"), ("withdraw", withdraw, "Debit an account")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("account", type=int)
+        command.add_argument("amount", type=float)
+        command.add_argument("--description")
+        command.add_argument("--user", type=int, help="Only if the account belongs to this user")
+        command.add_argument("--idempotency-key")
+        command.set_defaults(func=func)
+     
+    command = commands.add_parser("transfer", help="Move money between two accounts")
+    command.add_argument("from_account", type=int)
+    command.add_argument("to_account", type=int)
+    command.add_argument("amount", type=float)
+    command.add_argument("--description")
+    command.add_argument("--user", type=int, help="Only if the source account belongs to this user")
+    command.add_argument("--idempotency-key")
+    command.set_defaults(func=transfer)
+     
+    command = commands.add_parser("history", help="Stream a user's transactions to stdout, newest first")
+    command.add_argument("user", type=int)
+    command.add_argument("--account", type=int)
+    command.add_argument("--since", help="From this local date, e.g. 2024-05-01")
+    command.add_argument("--until", help="Up to and including this local date")
+    command.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    command.set_defaults(func=history)
+     
+    command = commands.add_parser("export", help="Export accounts or transactions (archived months stay in their archive files)")
+    command.add_argument("table", choices=("accounts", "transactions"))
+    command.add_argument("--user", type=int)
+    command.add_argument("--since", help="Transactions from this local date")
+    command.add_argument("--until", help="Transactions up to and including this local date")
+    command.add_argument("--out", help="Output file (default: stdout)")
+    command.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    command.set_defaults(func=export)
+     
+    command = commands.add_parser("import", help=f"Post deposits, withdrawals and transfers from a CSV file with columns: {', '.join(IMPORT_COLUMNS)}")
+    command.add_argument("file")
+    command.set_defaults(func=import_postings)
+     
+    command = commands.add_parser("reconcile", help="Check every balance against its transactions; exits 1 on a mismatch")
+    command.set_defaults(func=reconcile)
+     
+    # Its options are benchmark.py's own, passed through unparsed
+    command = commands.add_parser("benchmark", help="Run benchmark.py with the options that follow", add_help=False)
+    command.set_defaults(func=benchmark)
+    return parser
+ 
+ 
+def main(argv=None):
+    parser = build_parser()
+    args, args.options = parser.parse_known_args(argv)
+    if args.options and args.command != "benchmark":
+        parser.error(f"unrecognized arguments: {' '.join(args.options)}")
+    from ledger import LedgerError
+    try:
+        return args.func(args) or 0
+    except LedgerError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # The reader (e.g. `head`) went away
+        sys.stderr.close()
+        return 0
+ 
+ 
+if __name__ == "__main__":
+    sys.exit(main())
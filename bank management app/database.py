@@ -0,0 +1,335 @@
+import argparse
+import os
+import sqlite3
+import time
+ 
+import archive
+import fx
+import profiler
+import rollups
+import timeutil
+ 
+# Location of the database file; BANK_DB_PATH points tools and tests elsewhere
+DB_PATH = os.environ.get('BANK_DB_PATH', 'bank_management.db')
+ 
+# Journal directory for point-in-time restore (BANK_JOURNAL_DIR) and the database it covers; see enable_journal()
+JOURNAL_DIR = os.environ.get('BANK_JOURNAL_DIR')
+JOURNAL_DB = os.path.abspath(DB_PATH)
+ 
+# Epoch-microsecond column added next to each local date text column: table -> (text column, time column)
+TIME_COLUMNS = {
+    'users': ('registration_date', 'registration_time'),
+    'accounts': ('opening_date', 'opening_time'),
+    'transactions': ('transaction_date', 'transaction_time'),
+}
+ 
+# Filling the time columns of an older database: rows per step, minimum pause between
+# steps, and the most rows create_schema() converts inline before leaving it to migrate-times
+MIGRATE_CHUNK = 10000
+MIGRATE_PAUSE = 0.05
+MIGRATE_INLINE = 100000
+ 
+ 
+def connect(path=None, readonly=False, check_same_thread=True, factory=None):
+    """Open a connection to the bank database
+     
+    Read-only connections open the file with ``mode=ro`` so they can never
+    take the write lock, which makes them safe to share between readers.
+    They also set ``query_only``, so a stray write fails at once instead
+    of queueing behind the posting writer. While the journal is on,
+    writable connections to the journaled database log every commit (see
+    backup.Journal). ``factory`` overrides the connection class.
+    """
+    path = path or DB_PATH
+    if JOURNAL_DIR and not readonly and factory is None and os.path.abspath(path) == JOURNAL_DB:
+        import backup
+        return backup.open_journal(JOURNAL_DIR).connect(path, check_same_thread)
+    factory = factory or profiler.connection_factory()
+    if readonly:
+        uri = 'file:' + os.path.abspath(path).replace('?', '%3f') + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread, factory=factory)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+    return sqlite3.connect(path, check_same_thread=check_same_thread, factory=factory)
+ 
+ 
+def enable_journal(directory, path=None):
+    """Log every commit to ``path`` (default: DB_PATH) made through connect() in this process to ``directory``"""
+    global JOURNAL_DIR, JOURNAL_DB
+    JOURNAL_DIR = directory
+    JOURNAL_DB = os.path.abspath(path or DB_PATH)
+ 
+ 
+def create_schema(conn):
+    """Create tables and indexes if they don't exist"""
+    cursor = conn.cursor()
+     
+    # Create Users table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        full_name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        phone TEXT,
+        address TEXT,
+        registration_date TEXT,
+        profile_pic BLOB,
+        role TEXT NOT NULL DEFAULT 'customer',
+        registration_time INTEGER
+    )
+    ''')
+    # Databases from before roles existed get the column added
+    if 'role' not in [column[1] for column in cursor.execute("PRAGMA table_info(users)")]:
+        cursor.execute("ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT 'customer'")
+     
+    # Create Accounts table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        account_number TEXT UNIQUE NOT NULL,
+        account_type TEXT NOT NULL,
+        balance REAL DEFAULT 0.0,
+        opening_date TEXT,
+        status TEXT DEFAULT 'active',
+        opening_time INTEGER,
+        currency TEXT NOT NULL DEFAULT 'USD',
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''')
+     
+    # Create Transactions table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER,
+        transaction_type TEXT NOT NULL,
+        amount REAL NOT NULL,
+        description TEXT,
+        transaction_date TEXT,
+        reference_number TEXT,
+        status TEXT DEFAULT 'completed',
+        transaction_time INTEGER,
+        FOREIGN KEY (account_id) REFERENCES accounts(id)
+    )
+    ''')
+     
+    # Databases from before the time columns existed get them added (and filled below)
+    for table, (text_column, time_column) in TIME_COLUMNS.items():
+        if time_column not in [column[1] for column in cursor.execute(f"PRAGMA table_info({table})")]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {time_column} INTEGER")
+ 
+    # Accounts from before multi-currency support are in US dollars
+    if 'currency' not in [column[1] for column in cursor.execute("PRAGMA table_info(accounts)")]:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN currency TEXT NOT NULL DEFAULT 'USD'")
+     
+    # Results of postings made with a client-supplied idempotency key, so a
+    # retried request returns the original result instead of posting twice
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INTEGER NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        result TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (user_id, idempotency_key)
+    ) WITHOUT ROWID
+    ''')
+     
+    # Catalog of the monthly archive files (see archive.py) and the per-account
+    # monthly totals left behind for the transactions moved into them
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_months (
+        month TEXT PRIMARY KEY,
+        file TEXT NOT NULL,
+        min_id INTEGER,
+        max_id INTEGER,
+        rows INTEGER NOT NULL,
+        archived_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transaction_summaries (
+        account_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        credits REAL NOT NULL,
+        debits REAL NOT NULL,
+        first_id INTEGER,
+        last_id INTEGER,
+        PRIMARY KEY (account_id, month)
+    ) WITHOUT ROWID
+    ''')
+     
+    # Sequence number of the last commit written to the journal (see backup.Journal)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS journal_position (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        seq INTEGER NOT NULL
+    )
+    ''')
+     
+    # Recurring transfers (see scheduler.py); occurrences counts the runs made or skipped so far
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS standing_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        from_account INTEGER NOT NULL,
+        to_account INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        description TEXT,
+        interval TEXT NOT NULL,
+        first_run INTEGER NOT NULL,
+        next_run INTEGER NOT NULL,
+        occurrences INTEGER NOT NULL DEFAULT 0,
+        end_time INTEGER,
+        status TEXT NOT NULL DEFAULT 'active',
+        failures INTEGER NOT NULL DEFAULT 0,
+        last_run INTEGER,
+        last_result TEXT,
+        created_at INTEGER NOT NULL
+    )
+    ''')
+     
+    # Postings flagged by the fraud rules (see fraud.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS fraud_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        rule TEXT NOT NULL,
+        amount REAL NOT NULL,
+        reference_number TEXT,
+        created_at INTEGER NOT NULL,
+        details TEXT
+    )
+    ''')
+     
+    # Notifications of postings, written in the posting's commit and drained by outbox.py
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        topic TEXT NOT NULL,
+        account_id INTEGER,
+        payload TEXT NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+    ''')
+    # How far each notification sink has got through the outbox
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS outbox_offsets (
+        sink TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        delivered INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER,
+        last_error TEXT
+    )
+    ''')
+     
+    # Indexes for the per-user and per-account lookups every screen does
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_user ON accounts (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions (account_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)")
+    # Top accounts for the admin overview walk this index, per currency, instead of sorting every account
+    cursor.execute("DROP INDEX IF EXISTS idx_accounts_balance")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_currency_balance ON accounts (currency, balance)")
+    # Date-range scans and time-ordered listings, bank-wide and per account
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_time ON transactions (transaction_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account_time ON transactions (account_id, transaction_time)")
+    # Due standing orders, soonest first; finished and cancelled ones stay out of the index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_standing_orders_due ON standing_orders (next_run) WHERE status = 'active'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_standing_orders_user ON standing_orders (user_id)")
+     
+    # WAL lets readers carry on while the posting writer holds the write lock
+    cursor.execute("PRAGMA journal_mode=WAL")
+     
+    conn.commit()
+    # Finish the PRAGMA's result row so no statement is left running on the connection
+    cursor.close()
+     
+    # Small databases are converted right away; big ones with `python database.py migrate-times`
+    if times_remaining(conn) <= MIGRATE_INLINE:
+        migrate_times(conn, pause=0)
+    archive.upgrade_archives(conn)
+     
+    # Aggregates for the admin screens, kept current by triggers
+    rollups.create_rollups(conn)
+ 
+    # Exchange rates for multi-currency accounts
+    fx.create_tables(conn)
+ 
+ 
+def times_remaining(conn):
+    """Rows whose time column hasn't been filled from their date text yet"""
+    remaining = 0
+    for table, (text_column, time_column) in TIME_COLUMNS.items():
+        remaining += conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {time_column} IS NULL AND {text_column} IS NOT NULL").fetchone()[0]
+    return remaining
+ 
+ 
+def migrate_times(conn, chunk=MIGRATE_CHUNK, pause=MIGRATE_PAUSE, progress=None):
+    """Fill the time columns of rows written before they existed; returns the number of rows filled
+     
+    Works through each table in id ranges, one short write transaction
+    per range, sleeping at least as long as the step took in between so
+    postings keep getting the lock. Only rows still missing a time are
+    touched, so an interrupted run just starts again.
+    """
+    filled = 0
+    for table, (text_column, time_column) in TIME_COLUMNS.items():
+        missing = f"{time_column} IS NULL AND {text_column} IS NOT NULL"
+        start, last = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table} WHERE {missing}").fetchone()
+        convert = timeutil.TEXT_TO_MICROS.format(column=text_column)
+        while start is not None and start <= last:
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                filled += conn.execute(f"UPDATE {table} SET {time_column} = {convert} WHERE id >= ? AND id < ? AND {missing}",
+                                       (start, start + chunk)).rowcount
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            start += chunk
+            if progress:
+                progress(table, min(start, last + 1), last + 1)
+            if pause:
+                time.sleep(max(pause, time.perf_counter() - started))
+    return filled
+ 
+ 
+def row_factory(model):
+    """Return a sqlite3 row factory that builds instances of a row model"""
+    make = model._make
+    return lambda cursor, row: make(row)
+ 
+ 
+def model_cursor(conn, model):
+    """Return a cursor whose rows come back as instances of model"""
+    cursor = conn.cursor()
+    cursor.row_factory = row_factory(model)
+    return cursor
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate-times", help="Fill the epoch-microsecond time columns of older rows")
+    migrate.add_argument("--chunk", type=int, default=MIGRATE_CHUNK, help="Rows per step")
+    migrate.add_argument("--pause", type=float, default=MIGRATE_PAUSE, help="Minimum seconds between steps, so postings get the lock")
+    args = parser.parse_args()
+     
+    conn = connect(args.db)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    create_schema(conn)
+    start = time.perf_counter()
+    filled = migrate_times(conn, args.chunk, args.pause,
+                           progress=lambda table, position, end: print(f"\r{table}: {position}/{end}", end="", flush=True))
+    print(f"\n{filled} rows converted in {time.perf_counter() - start:.2f}s")
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
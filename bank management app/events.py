@@ -0,0 +1,64 @@
+import queue
+import threading
+ 
+# Topic published by PostingWriter after each committed posting; payload is the PostingResult
+POSTING = "posting"
+ 
+ 
+class EventBus:
+    """Change notifications from the data layer to open views
+     
+    Subscribers run on the thread that created the bus (the Tk thread in
+    the desktop app). Events published from any other thread, such as the
+    posting writer, are queued and delivered by the next deliver() call.
+    """
+     
+    def __init__(self):
+        self.owner = threading.get_ident()
+        self.subscribers = {}
+        self.pending = queue.SimpleQueue()
+     
+    def subscribe(self, topic, callback, alive=None):
+        """Call callback(payload) for every event on topic
+         
+        ``alive`` is an optional predicate (e.g. a widget's ``winfo_exists``);
+        once it returns false the subscription is dropped, so views that
+        were destroyed don't need to unsubscribe explicitly.
+        """
+        entry = (callback, alive)
+        self.subscribers.setdefault(topic, []).append(entry)
+        return topic, entry
+     
+    def unsubscribe(self, token):
+        topic, entry = token
+        entries = self.subscribers.get(topic, [])
+        if entry in entries:
+            entries.remove(entry)
+     
+    def publish(self, topic, payload=None):
+        if threading.get_ident() != self.owner:
+            self.pending.put((topic, payload))
+            return
+        self._dispatch(topic, payload)
+     
+    def deliver(self):
+        """Dispatch the events queued by other threads; returns how many there were"""
+        count = 0
+        while True:
+            try:
+                topic, payload = self.pending.get_nowait()
+            except queue.Empty:
+                return count
+            self._dispatch(topic, payload)
+            count += 1
+     
+    def _dispatch(self, topic, payload):
+        entries = self.subscribers.get(topic)
+        if not entries:
+            return
+        for entry in list(entries):
+            callback, alive = entry
+            if alive is not None and not alive():
+                entries.remove(entry)
+                continue
+            callback(payload)
@@ -0,0 +1,205 @@
+import argparse
+import threading
+import time
+from collections import deque, namedtuple
+ 
+import database
+import timeutil
+from fx import BASE, FXRates
+from ledger import LedgerError
+ 
+# Velocity limits over a rolling day, per account, for money going out; all
+# limits and amounts are in the base currency (fx.BASE)
+DAY = 24 * 3600 * timeutil.MICROS
+MAX_DEBITS_PER_DAY = 20
+MAX_DEBIT_AMOUNT_PER_DAY = 10000.0
+ 
+# Postings of at least this much are flagged for review
+LARGE_AMOUNT = 5000.0
+ 
+# Money that leaves within RAPID_WINDOW of arriving (RAPID_SHARE of it or more) is flagged
+RAPID_WINDOW = 10 * 60 * timeutil.MICROS
+RAPID_SHARE = 0.9
+RAPID_MIN_AMOUNT = 1000.0
+# Recent credits remembered per account for that rule
+CREDIT_RING = 32
+ 
+CREDIT_TYPES = ('Deposit', 'Transfer (In)')
+ 
+Alert = namedtuple('Alert', 'id account_id rule amount reference_number created_at details')
+ 
+ 
+class Activity:
+    """Recent postings of one account: a sliding window of debits and a ring of credits"""
+     
+    __slots__ = ('debits', 'debit_total', 'credits')
+     
+    def __init__(self):
+        self.debits = deque()
+        self.debit_total = 0.0
+        self.credits = deque(maxlen=CREDIT_RING)
+     
+    def trim(self, now):
+        """Drop debits that slid out of the day"""
+        debits = self.debits
+        while debits and debits[0][0] <= now - DAY:
+            self.debit_total -= debits.popleft()[1]
+        if not debits:
+            # Recover from the drift of many float subtractions
+            self.debit_total = 0.0
+     
+    def recent_credits(self, now):
+        total = 0.0
+        for posted, amount in reversed(self.credits):
+            if posted < now - RAPID_WINDOW:
+                break
+            total += amount
+        return total
+ 
+ 
+class FraudRules:
+    """Velocity limits, large-amount and rapid in/out flags, checked as postings happen
+     
+    All state lives in memory: per account, the debits of the last day in
+    a deque with their running total, and the last few credits in a ring
+    buffer. load() rebuilds it from the last day of the ledger at startup;
+    after that, checking a posting never queries the transactions table.
+     
+    The ledger calls check_debit() inside the posting transaction. A
+    broken limit raises LedgerError, so the posting is refused; a flag is
+    written to fraud_alerts in the same transaction and the posting goes
+    through. record() is called once the posting succeeded. Inside a
+    writer batch that is before the batch commits, so a batch that then
+    fails to commit leaves its postings counted until they slide out of
+    the window, which only makes the limits stricter.
+     
+    Amounts are given in their account's currency and converted to the
+    base currency with ``fx`` (fx.FXRates, by default a cache of the
+    rates in ``path``) before they are counted, so the limits hold the
+    same whatever currency an account is in.
+    """
+     
+    def __init__(self, path=None, fx=None):
+        self.path = path
+        self.fx = fx or FXRates(path)
+        self.accounts = {}
+        self.lock = threading.Lock()
+        self.last_trim = 0
+     
+    def load(self, conn=None):
+        """Rebuild the windows from the transactions of the last day"""
+        own = conn is None
+        if own:
+            conn = database.connect(self.path, readonly=True)
+        try:
+            rows = conn.execute('''
+            SELECT t.account_id, t.transaction_type, t.amount, t.transaction_time, COALESCE(a.currency, ?)
+            FROM transactions t LEFT JOIN accounts a ON a.id = t.account_id
+            WHERE t.transaction_time >= ? AND t.status != 'failed'
+            ORDER BY t.transaction_time
+            ''', (BASE, timeutil.now() - DAY)).fetchall()
+            if self.fx.checked is None:
+                self.fx.load(conn)
+        finally:
+            if own:
+                conn.close()
+        with self.lock:
+            self.accounts = {}
+            for account_id, transaction_type, amount, posted, currency in rows:
+                amount = self.fx.to_base(amount, currency)
+                if transaction_type in CREDIT_TYPES:
+                    self._credit(account_id, amount, posted)
+                else:
+                    self._debit(account_id, amount, posted)
+        return self
+     
+    def check_debit(self, cursor, account_id, amount, reference_number, now, currency=BASE):
+        """Refuse a withdrawal or outgoing transfer over the velocity limits; flag suspicious ones
+         
+        Alerts record the amount in the base currency.
+        """
+        amount = self.fx.to_base(amount, currency)
+        flags = []
+        with self.lock:
+            activity = self.accounts.get(account_id)
+            if activity is not None:
+                activity.trim(now)
+                if len(activity.debits) >= MAX_DEBITS_PER_DAY:
+                    raise LedgerError(f"Daily limit of {MAX_DEBITS_PER_DAY} withdrawals and transfers reached")
+                if activity.debit_total + amount > MAX_DEBIT_AMOUNT_PER_DAY:
+                    raise LedgerError(f"Daily limit of ${MAX_DEBIT_AMOUNT_PER_DAY:,.2f} for withdrawals and transfers exceeded")
+                if amount >= RAPID_MIN_AMOUNT:
+                    received = activity.recent_credits(now)
+                    if received >= amount * RAPID_SHARE:
+                        flags.append(("rapid_in_out", f"${received:,.2f} received in the last {RAPID_WINDOW // (60 * timeutil.MICROS)} minutes"))
+            elif amount > MAX_DEBIT_AMOUNT_PER_DAY:
+                raise LedgerError(f"Daily limit of ${MAX_DEBIT_AMOUNT_PER_DAY:,.2f} for withdrawals and transfers exceeded")
+        if amount >= LARGE_AMOUNT:
+            flags.append(("large_amount", None))
+        for rule, details in flags:
+            cursor.execute('''
+            INSERT INTO fraud_alerts (account_id, rule, amount, reference_number, created_at, details)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (account_id, rule, amount, reference_number, now, details))
+        return [rule for rule, _ in flags]
+     
+    def record(self, debits=(), credits=(), now=None):
+        """Count a committed posting: (account_id, amount, currency) going out and coming in"""
+        now = now or timeutil.now()
+        debits = [(account_id, self.fx.to_base(amount, currency)) for account_id, amount, currency in debits]
+        credits = [(account_id, self.fx.to_base(amount, currency)) for account_id, amount, currency in credits]
+        with self.lock:
+            for account_id, amount in debits:
+                self._debit(account_id, amount, now)
+            for account_id, amount in credits:
+                self._credit(account_id, amount, now)
+            # Forget idle accounts now and then, so memory follows the active ones
+            if now - self.last_trim > DAY // 24:
+                self.last_trim = now
+                for account_id in [account_id for account_id, activity in self.accounts.items()
+                                   if not activity.debits and (not activity.credits or activity.credits[-1][0] < now - RAPID_WINDOW)]:
+                    del self.accounts[account_id]
+     
+    def _activity(self, account_id):
+        activity = self.accounts.get(account_id)
+        if activity is None:
+            activity = self.accounts[account_id] = Activity()
+        return activity
+     
+    def _debit(self, account_id, amount, posted):
+        activity = self._activity(account_id)
+        activity.trim(posted)
+        activity.debits.append((posted, amount))
+        activity.debit_total += amount
+     
+    def _credit(self, account_id, amount, posted):
+        self._activity(account_id).credits.append((posted, amount))
+ 
+ 
+def alerts(conn, since=None, limit=100):
+    """Newest fraud alerts first, optionally only those raised since an epoch-microsecond time"""
+    cursor = database.model_cursor(conn, Alert)
+    cursor.execute("SELECT * FROM fraud_alerts WHERE created_at >= ? ORDER BY id DESC LIMIT ?", (since or 0, limit))
+    return cursor.fetchall()
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Fraud rules: rebuild timing and the alert list")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    parser.add_argument("--since", default=None, help="Only alerts from this local date on, e.g. 2024-05-01")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    start = time.perf_counter()
+    rules = FraudRules(args.db).load(conn)
+    print(f"Rules loaded for {len(rules.accounts)} active accounts in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for alert in alerts(conn, timeutil.local_range(args.since)[0], args.limit):
+        print(f"{timeutil.format_time(alert.created_at)} {alert.rule:<14} account {alert.account_id:<8} "
+              f"${alert.amount:>12,.2f} {alert.reference_number or ''} {alert.details or ''}")
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
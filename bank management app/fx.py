@@ -0,0 +1,238 @@
+import argparse
+import csv
+import threading
+import time
+from array import array
+from collections import namedtuple
+ 
+import database
+import timeutil
+ 
+try:
+    import numpy as np
+except ImportError:
+    # Portfolio conversion falls back to a loop over the array of rates
+    np = None
+ 
+# Rates are the value of one unit of a currency in the base currency
+BASE = 'USD'
+# How often the cache looks for a newer rate version, in seconds
+REFRESH_INTERVAL = 60
+ 
+RateVersion = namedtuple('RateVersion', 'version source loaded_at currencies')
+ 
+ 
+class Snapshot(namedtuple('Snapshot', 'version index rates')):
+    """The rates of one version: currency -> position, and the rates in that order"""
+    __slots__ = ()
+     
+    def position(self, currency):
+        try:
+            return self.index[currency]
+        except KeyError:
+            raise ValueError(f"No exchange rate for {currency}") from None
+     
+    def rate(self, currency):
+        return float(self.rates[self.position(currency)])
+ 
+ 
+def create_tables(conn):
+    """Create the rate tables; each loaded rate file becomes a new version"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fx_versions (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT,
+        loaded_at INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fx_rates (
+        version INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        rate REAL NOT NULL,
+        PRIMARY KEY (version, currency)
+    )
+    ''')
+    conn.commit()
+ 
+ 
+def empty_snapshot():
+    return Snapshot(0, {BASE: 0}, np.ones(1) if np is not None else array('d', [1.0]))
+ 
+ 
+def parse_rates(lines):
+    """(currency, rate) pairs from 'CODE,rate' lines; blank lines, '#' comments and a header are skipped"""
+    rates = {}
+    for row in csv.reader(lines):
+        if not row or not row[0].strip() or row[0].strip().startswith('#'):
+            continue
+        currency = row[0].strip().upper()
+        try:
+            rate = float(row[1])
+        except (IndexError, ValueError):
+            if not rates:
+                # A header line
+                continue
+            raise ValueError(f"Bad rate line: {','.join(row)}")
+        if len(currency) != 3 or not currency.isalpha() or rate <= 0:
+            raise ValueError(f"Bad rate line: {','.join(row)}")
+        rates[currency] = rate
+    rates[BASE] = 1.0
+    return rates
+ 
+ 
+def load_file(conn, path):
+    """Store the rates of a local file as a new version; returns the version number"""
+    with open(path, newline='') as rate_file:
+        rates = parse_rates(rate_file)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO fx_versions (source, loaded_at) VALUES (?, ?)", (path, timeutil.now()))
+    version = cursor.lastrowid
+    cursor.executemany("INSERT INTO fx_rates (version, currency, rate) VALUES (?, ?, ?)",
+                       [(version, currency, rate) for currency, rate in rates.items()])
+    conn.commit()
+    return version
+ 
+ 
+def versions(conn, limit=10):
+    """Newest rate versions first"""
+    return [RateVersion._make(row) for row in conn.execute('''
+    SELECT v.version, v.source, v.loaded_at, COUNT(r.currency) FROM fx_versions v
+    LEFT JOIN fx_rates r ON r.version = v.version
+    GROUP BY v.version ORDER BY v.version DESC LIMIT ?
+    ''', (limit,))]
+ 
+ 
+class FXRates:
+    """Exchange rates of the newest loaded version, cached in memory
+     
+    The rates sit in one array with a currency -> position dict, so a
+    conversion is two dict lookups and a multiply, and a whole portfolio
+    is converted in one vector operation (numpy when installed) with no
+    query per row. The cache looks for a newer version in fx_versions at
+    most every ``ttl`` seconds and swaps the new snapshot in whole, so a
+    conversion never mixes the rates of two versions. Only the base
+    currency is known until rates are loaded with `python fx.py load`.
+    """
+     
+    def __init__(self, path=None, ttl=REFRESH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.snapshot = empty_snapshot()
+        self.checked = None
+        self.lock = threading.Lock()
+     
+    def load(self, conn=None):
+        """Read the newest version now"""
+        own = conn is None
+        if own:
+            conn = database.connect(self.path, readonly=True)
+        try:
+            version = conn.execute("SELECT MAX(version) FROM fx_versions").fetchone()[0]
+            if version is not None and version != self.snapshot.version:
+                rows = conn.execute("SELECT currency, rate FROM fx_rates WHERE version = ? ORDER BY currency", (version,)).fetchall()
+                index = {currency: position for position, (currency, _) in enumerate(rows)}
+                rates = [rate for _, rate in rows]
+                self.snapshot = Snapshot(version, index, np.array(rates, dtype=np.float64) if np is not None else array('d', rates))
+        finally:
+            if own:
+                conn.close()
+        self.checked = time.monotonic()
+        return self
+     
+    def current(self):
+        """The cached snapshot, reloaded first if it is older than ``ttl``"""
+        if self.checked is None or time.monotonic() - self.checked >= self.ttl:
+            with self.lock:
+                if self.checked is None or time.monotonic() - self.checked >= self.ttl:
+                    self.load()
+        return self.snapshot
+     
+    @property
+    def version(self):
+        return self.current().version
+     
+    def currencies(self):
+        return sorted(self.current().index)
+     
+    def knows(self, currency):
+        return currency in self.current().index
+     
+    def rate(self, source, target=BASE):
+        """Units of ``target`` one unit of ``source`` is worth"""
+        snapshot = self.current()
+        return snapshot.rate(source) / snapshot.rate(target)
+     
+    def convert(self, amount, source, target=BASE):
+        if source == target:
+            return amount
+        return amount * self.rate(source, target)
+     
+    def to_base(self, amount, currency):
+        """``amount`` in ``currency`` expressed in the base currency; unconverted if there is no rate for it"""
+        snapshot = self.current()
+        if currency == BASE or currency not in snapshot.index:
+            return amount
+        return amount * snapshot.rate(currency)
+     
+    def convert_many(self, amounts, currencies, target=BASE):
+        """Convert a batch of amounts, each in its own currency, to ``target``; returns a list"""
+        snapshot = self.current()
+        positions = [snapshot.position(currency) for currency in currencies]
+        divisor = snapshot.rate(target)
+        if np is not None:
+            return (np.asarray(amounts, dtype=np.float64) * snapshot.rates[positions] / divisor).tolist()
+        rates = snapshot.rates
+        return [amount * rates[position] / divisor for amount, position in zip(amounts, positions)]
+     
+    def total(self, amounts, currencies, target=BASE):
+        """Sum of a batch of amounts converted to ``target``"""
+        snapshot = self.current()
+        positions = [snapshot.position(currency) for currency in currencies]
+        if np is not None:
+            total = float(np.dot(np.asarray(amounts, dtype=np.float64), snapshot.rates[positions])) if positions else 0.0
+        else:
+            rates = snapshot.rates
+            total = sum(amount * rates[position] for amount, position in zip(amounts, positions))
+        return total / snapshot.rate(target)
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Exchange rates: load a rate file, list versions, convert")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help=f"Load 'CODE,rate' lines (value of one unit in {BASE}) as a new version")
+    load.add_argument("file")
+    commands.add_parser("show", help="Print the current rates and the recent versions")
+    convert = commands.add_parser("convert", help="Convert an amount with the current rates")
+    convert.add_argument("amount", type=float)
+    convert.add_argument("source")
+    convert.add_argument("target", nargs="?", default=BASE)
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    if args.command == "load":
+        try:
+            version = load_file(conn, args.file)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        print(f"Loaded {args.file} as version {version}")
+    rates = FXRates(args.db).load(conn)
+    if args.command == "show":
+        print(f"Version {rates.version}, base {BASE}")
+        for currency in rates.currencies():
+            print(f"  {currency} {rates.rate(currency):.6f}")
+        for version in versions(conn):
+            print(f"{version.version:>6} {timeutil.format_time(version.loaded_at)} {version.currencies:>4} rates from {version.source}")
+    elif args.command == "convert":
+        try:
+            amount = rates.convert(args.amount, args.source.upper(), args.target.upper())
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"{args.amount:,.2f} {args.source.upper()} = {amount:,.2f} {args.target.upper()} (version {rates.version})")
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+import hashlib
+import json
+import math
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+ 
+import archive
+import database
+import security
+import timeutil
+from fx import BASE
+from models import User, Account, AccountTransaction, TransactionDetail, TransactionColumns
+ 
+INSERT_TRANSACTION = '''
+INSERT INTO transactions (account_id, transaction_type, amount, description, transaction_date, reference_number, status, transaction_time)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+ 
+# Notification of a posting, queued in the same commit (see outbox.py)
+INSERT_OUTBOX = '''
+INSERT INTO outbox (topic, account_id, payload, created_at)
+VALUES (?, ?, ?, ?)
+'''
+ 
+# How long a client can safely retry a posting with the same idempotency key
+IDEMPOTENCY_TTL = 24 * 3600
+ 
+ 
+class LedgerError(Exception):
+    """A posting was refused; the message is safe to show to the user"""
+ 
+ 
+class PostingResult(namedtuple('PostingResult', 'reference_number transaction_type amount account_id counterparty_id balance transaction_date')):
+    """Outcome of a deposit, withdrawal, transfer or account opening"""
+    __slots__ = ()
+ 
+ 
+def timestamp(micros=None):
+    """Local text stored in the date columns for an epoch-microsecond time (default: now)"""
+    return timeutil.local_text(timeutil.now() if micros is None else micros)
+ 
+ 
+def new_reference(prefix):
+    """Generate a reference number such as DEP-1234567"""
+    return f"{prefix}-{random.randint(1000000, 9999999)}"
+ 
+ 
+def request_hash(operation, *args):
+    """Fingerprint of a posting request, stored next to its idempotency key"""
+    return hashlib.sha256(json.dumps([operation, *args]).encode()).hexdigest()
+ 
+ 
+def verify_login(user, password):
+    """Check a password against a user row (or None); returns (user, replacement_hash) or (None, None)
+     
+    Verification is slow on purpose (see security.py), so call this off
+    the UI/event-loop thread and without holding a pooled connection.
+    """
+    if user is None:
+        security.verify_unknown_user(password)
+        return None, None
+    valid, replacement = security.verify_password(password, user.password)
+    if not valid:
+        return None, None
+    return user, replacement
+ 
+ 
+def check_amount(amount):
+    """Reject non-positive and non-finite (inf, NaN) amounts"""
+    if not math.isfinite(amount):
+        raise LedgerError("Amount must be a finite number")
+    if amount <= 0:
+        raise LedgerError("Amount must be positive")
+ 
+ 
+class Ledger:
+    """Account queries and postings, shared by the desktop app and the API server
+     
+    Every method accepts an optional open connection. Without one the
+    method opens (and closes) its own connection to ``path``, read-only
+    for the queries so they can never block the posting writer. Postings
+    take an optional ``idempotency_key``: repeating a posting with the same
+    key returns the first result without touching any balance. Account
+    ids may also be given as text (from the CLI, a JSON body or a
+    Treeview); postings convert them to int. With ``rules``
+    (fraud.FraudRules), withdrawals and outgoing transfers are also
+    checked against the velocity limits and flagged when suspicious, in
+    the base currency whatever the account's. With ``fx`` (fx.FXRates),
+    transfers between accounts in different currencies are converted at
+    the cached rates; without it they are refused. Once a notification sink is registered in the database (see
+    outbox.py), every posting also queues its result in the outbox table,
+    whichever process makes it.
+    """
+     
+    def __init__(self, path=None, rules=None, fx=None):
+        self.path = path
+        self.rules = rules
+        self.fx = fx
+     
+    @contextmanager
+    def connection(self, conn=None, readonly=False):
+        """Yield conn, or a fresh connection (read-only if asked) that is closed afterwards"""
+        if conn is not None:
+            yield conn
+            return
+        conn = database.connect(self.path, readonly=readonly)
+        try:
+            yield conn
+        finally:
+            conn.close()
+     
+    @contextmanager
+    def transaction(self, conn=None):
+        """Run a block as one write transaction, taking the write lock up front
+         
+        Inside a transaction that is already open (a PostingWriter batch)
+        the block runs in a savepoint instead, so a refused posting is
+        undone without touching the rest of the batch.
+        """
+        with self.connection(conn) as conn:
+            if conn.in_transaction:
+                conn.execute("SAVEPOINT posting")
+                try:
+                    yield conn.cursor()
+                except BaseException:
+                    conn.execute("ROLLBACK TO posting")
+                    conn.execute("RELEASE posting")
+                    raise
+                conn.execute("RELEASE posting")
+                return
+             
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+     
+    # Queries
+     
+    def get_user(self, username, conn=None):
+        """Return the user row (with its password hash) for a username, or None"""
+        with self.connection(conn, readonly=True) as conn:
+            cursor = database.model_cursor(conn, User)
+            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+            return cursor.fetchone()
+     
+    def authenticate(self, username, password, conn=None):
+        """Check credentials; returns (user, replacement_hash) or (None, None)
+         
+        ``replacement_hash`` is set when the stored hash is legacy or outdated
+        and should be saved with rehash_password(). The connection is only
+        used for the lookup; see verify_login() for the slow part.
+        """
+        return verify_login(self.get_user(username, conn), password)
+     
+    def rehash_password(self, user, replacement, conn=None):
+        """Store an upgraded hash unless the password changed in the meantime"""
+        with self.transaction(conn) as cursor:
+            cursor.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?", (replacement, user.id, user.password))
+     
+    def register_user(self, username, password, full_name, email, phone=None, address=None, registration_date=None, conn=None):
+        """Store a new user; ``password`` is already hashed (security.hash_password). Returns the id"""
+        registered = timeutil.from_local_text(registration_date) if registration_date else timeutil.now()
+        with self.transaction(conn) as cursor:
+            try:
+                cursor.execute('''
+                INSERT INTO users (username, password, full_name, email, phone, address, registration_date, registration_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (username, password, full_name, email, phone, address, registration_date or timestamp(registered), registered))
+            except sqlite3.IntegrityError:
+                raise LedgerError("Username or email already exists")
+            return cursor.lastrowid
+     
+    def get_account(self, account_id, user_id=None, conn=None):
+        """Return an account, optionally only if it belongs to user_id"""
+        with self.connection(conn, readonly=True) as conn:
+            cursor = database.model_cursor(conn, Account)
+            cursor.execute("SELECT * FROM accounts WHERE id = ?", (account_id,))
+            account = cursor.fetchone()
+        if account is None or (user_id is not None and account.user_id != user_id):
+            return None
+        return account
+     
+    def get_accounts(self, user_id, conn=None):
+        """Return every account of a user"""
+        with self.connection(conn, readonly=True) as conn:
+            cursor = database.model_cursor(conn, Account)
+            cursor.execute("SELECT * FROM accounts WHERE user_id = ? ORDER BY id", (user_id,))
+            return cursor.fetchall()
+     
+    def history(self, user_id, account_id=None, limit=50, before_id=None, after_id=None, conn=None, since=None, until=None):
+        """Return one page of a user's transactions, newest first
+         
+        Pages are keyed on the transaction id (pass the last id of the
+        previous page as ``before_id``), so deep pages cost the same as the
+        first one instead of growing with an OFFSET. ``after_id`` returns
+        only transactions newer than the given one. ``since``/``until`` are
+        half-open epoch-microsecond bounds (see timeutil.local_range).
+        """
+        query = '''
+        SELECT t.*, a.account_number
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.id
+        WHERE a.user_id = ?
+        '''
+        params = [user_id]
+        if account_id is not None:
+            query += " AND t.account_id = ?"
+            params.append(account_id)
+        if before_id is not None:
+            query += " AND t.id < ?"
+            params.append(before_id)
+        if after_id is not None:
+            query += " AND t.id > ?"
+            params.append(after_id)
+        if since is not None:
+            query += " AND t.transaction_time >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND t.transaction_time < ?"
+            params.append(until)
+        query += " ORDER BY t.id DESC LIMIT ?"
+        params.append(limit)
+         
+        with self.connection(conn, readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            page = TransactionColumns(cursor, model=AccountTransaction)
+            # Past the hot window, keep paging into the monthly archives
+            if len(page) < limit and after_id is None:
+                archive.extend_history(page, conn, self.path, user_id, account_id, limit, before_id, since, until)
+            return page
+     
+    def get_transaction(self, transaction_id, user_id=None, conn=None):
+        """Return a transaction with its account number, type and currency, optionally only for user_id"""
+        with self.connection(conn, readonly=True) as conn:
+            cursor = database.model_cursor(conn, TransactionDetail)
+            cursor.execute('''
+            SELECT t.*, a.account_number, a.account_type, a.currency
+            FROM transactions t
+            JOIN accounts a ON t.account_id = a.id
+            WHERE t.id = ? AND (? IS NULL OR a.user_id = ?)
+            ''', (transaction_id, user_id, user_id))
+            row = cursor.fetchone()
+            if row is None:
+                row = archive.find_transaction(conn, self.path, transaction_id, user_id)
+            return row
+     
+    def archived_summaries(self, account_id, conn=None):
+        """Per-month (month, count, credits, debits) totals of an account's archived transactions"""
+        with self.connection(conn, readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT month, count, credits, debits FROM transaction_summaries
+            WHERE account_id = ? ORDER BY month DESC
+            ''', (account_id,))
+            return cursor.fetchall()
+     
+    # Postings
+     
+    def _active_account(self, cursor, account_id, user_id=None):
+        cursor.execute("SELECT user_id, balance, status FROM accounts WHERE id = ?", (account_id,))
+        row = cursor.fetchone()
+        if row is None or (user_id is not None and row[0] != user_id):
+            raise LedgerError("Account not found")
+        if row[2] != 'active':
+            raise LedgerError("Account is not active")
+        return row[1]
+     
+    def _currencies(self, cursor, *account_ids):
+        cursor.execute(f"SELECT id, currency FROM accounts WHERE id IN ({', '.join('?' * len(account_ids))})", account_ids)
+        return dict(cursor.fetchall())
+     
+    def _converted(self, amount, source, target):
+        """``amount`` in ``source`` expressed in ``target``, rounded to cents"""
+        if source == target:
+            return amount
+        if self.fx is None:
+            raise LedgerError("Transfers between currencies are not available")
+        try:
+            return round(self.fx.convert(amount, source, target), 2)
+        except ValueError as e:
+            raise LedgerError(str(e))
+     
+    def _replay(self, cursor, key, user_id, fingerprint):
+        """Return the stored result for an idempotency key, or None on first use
+         
+        A single primary-key probe inside the posting transaction, so two
+        retries racing each other cannot both post.
+        """
+        if key is None:
+            return None
+        cursor.execute("SELECT request_hash, result, created_at FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?",
+                       (user_id or 0, key))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        if row[2] < time.time() - IDEMPOTENCY_TTL:
+            # Expired but not purged yet; treat the key as new
+            cursor.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?", (user_id or 0, key))
+            return None
+        if row[0] != fingerprint:
+            raise LedgerError("Idempotency key was already used for a different request")
+        return PostingResult(*json.loads(row[1]))
+     
+    def _announce(self, cursor, result, posted):
+        """Queue the notification of a posting; it commits (or rolls back) with the posting"""
+        if cursor.execute("SELECT EXISTS (SELECT 1 FROM outbox_offsets)").fetchone()[0]:
+            cursor.execute(INSERT_OUTBOX, (result.transaction_type, result.account_id, json.dumps(result._asdict()), posted))
+     
+    def _remember(self, cursor, key, user_id, fingerprint, result):
+        if key is not None:
+            cursor.execute("INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                           (user_id or 0, key, fingerprint, json.dumps(result), time.time()))
+        return result
+     
+    def purge_idempotency_keys(self, max_age=IDEMPOTENCY_TTL, conn=None):
+        """Delete idempotency keys older than max_age seconds; returns the number removed"""
+        with self.transaction(conn) as cursor:
+            cursor.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (time.time() - max_age,))
+            return cursor.rowcount
+     
+    def open_account(self, user_id, account_type, initial_deposit, idempotency_key=None, account_id=None, conn=None, currency=BASE):
+        """Create an account, recording the initial deposit as a transaction
+         
+        ``account_id`` is only given by the sharded ledger, which allocates
+        ids that are unique across all shards. Accounts other than the base
+        currency need a loaded exchange rate.
+        """
+        if not math.isfinite(initial_deposit):
+            raise LedgerError("Amount must be a finite number")
+        if initial_deposit < 0:
+            raise LedgerError("Initial deposit cannot be negative")
+        currency = (currency or BASE).upper()
+        if currency != BASE and (self.fx is None or not self.fx.knows(currency)):
+            raise LedgerError(f"Accounts in {currency} are not available")
+         
+        opened = timeutil.now()
+        opening_date = timestamp(opened)
+        fingerprint = request_hash("open_account", account_type, initial_deposit, currency)
+        with self.transaction(conn) as cursor:
+            previous = self._replay(cursor, idempotency_key, user_id, fingerprint)
+            if previous:
+                return previous
+             
+            # Retry the rare collision on the random account number
+            for _ in range(5):
+                account_number = f"{random.randint(10000, 99999)}-{random.randint(10000, 99999)}"
+                try:
+                    cursor.execute('''
+                    INSERT INTO accounts (id, user_id, account_number, account_type, balance, opening_date, status, opening_time, currency)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (account_id, user_id, account_number, account_type, initial_deposit, opening_date, "active", opened, currency))
+                    break
+                except sqlite3.IntegrityError:
+                    continue
+            else:
+                raise LedgerError("Could not allocate an account number")
+             
+            account_id = cursor.lastrowid
+            reference_number = None
+             
+            # If there's an initial deposit, create a transaction
+            if initial_deposit > 0:
+                reference_number = new_reference("DEP")
+                cursor.execute(INSERT_TRANSACTION, (account_id, "Deposit", initial_deposit, "Initial deposit", opening_date, reference_number, "completed", opened))
+             
+            result = PostingResult(reference_number, "Open", initial_deposit, account_id, None, initial_deposit, opening_date)
+            self._announce(cursor, result, opened)
+            return self._remember(cursor, idempotency_key, user_id, fingerprint, result)
+     
+    def deposit(self, account_id, amount, description=None, user_id=None, idempotency_key=None, conn=None):
+        """Credit an account"""
+        check_amount(amount)
+        account_id = int(account_id)
+        reference_number = new_reference("DEP")
+        posted = timeutil.now()
+        transaction_date = timestamp(posted)
+         
+        fingerprint = request_hash("deposit", account_id, amount, description)
+         
+        with self.transaction(conn) as cursor:
+            previous = self._replay(cursor, idempotency_key, user_id, fingerprint)
+            if previous:
+                return previous
+            balance = self._active_account(cursor, account_id, user_id)
+            currency = self._currencies(cursor, account_id)[account_id] if self.rules else BASE
+            cursor.execute(INSERT_TRANSACTION, (account_id, "Deposit", amount, description or "Deposit", transaction_date, reference_number, "completed", posted))
+            cursor.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount, account_id))
+            result = PostingResult(reference_number, "Deposit", amount, account_id, None, balance + amount, transaction_date)
+            self._announce(cursor, result, posted)
+            result = self._remember(cursor, idempotency_key, user_id, fingerprint, result)
+        if self.rules:
+            self.rules.record(credits=[(account_id, amount, currency)], now=posted)
+        return result
+     
+    def withdraw(self, account_id, amount, description=None, user_id=None, idempotency_key=None, conn=None):
+        """Debit an account; the balance is checked inside the write transaction"""
+        check_amount(amount)
+        account_id = int(account_id)
+        reference_number = new_reference("WDR")
+        posted = timeutil.now()
+        transaction_date = timestamp(posted)
+         
+        fingerprint = request_hash("withdraw", account_id, amount, description)
+         
+        with self.transaction(conn) as cursor:
+            previous = self._replay(cursor, idempotency_key, user_id, fingerprint)
+            if previous:
+                return previous
+            balance = self._active_account(cursor, account_id, user_id)
+            if amount > balance:
+                raise LedgerError("Insufficient balance")
+            currency = BASE
+            if self.rules:
+                currency = self._currencies(cursor, account_id)[account_id]
+                self.rules.check_debit(cursor, account_id, amount, reference_number, posted, currency)
+            cursor.execute(INSERT_TRANSACTION, (account_id, "Withdrawal", amount, description or "Withdrawal", transaction_date, reference_number, "completed", posted))
+            cursor.execute("UPDATE accounts SET balance = balance - ? WHERE id = ?", (amount, account_id))
+            result = PostingResult(reference_number, "Withdrawal", amount, account_id, None, balance - amount, transaction_date)
+            self._announce(cursor, result, posted)
+            result = self._remember(cursor, idempotency_key, user_id, fingerprint, result)
+        if self.rules:
+            self.rules.record(debits=[(account_id, amount, currency)], now=posted)
+        return result
+     
+    def transfer(self, from_id, to_id, amount, description=None, user_id=None, idempotency_key=None, conn=None):
+        """Move money between two accounts in a single transaction
+         
+        ``user_id`` must own the source account; the destination only has
+        to exist and be active. ``amount`` is in the source account's
+        currency; a destination in another currency is credited the
+        converted amount, and both rows note the conversion.
+        """
+        check_amount(amount)
+        from_id, to_id = int(from_id), int(to_id)
+        if from_id == to_id:
+            raise LedgerError("Cannot transfer to the same account")
+         
+        description = description or "Transfer between accounts"
+        reference_number = new_reference("TRF")
+        posted = timeutil.now()
+        transaction_date = timestamp(posted)
+        fingerprint = request_hash("transfer", from_id, to_id, amount, description)
+         
+        with self.transaction(conn) as cursor:
+            previous = self._replay(cursor, idempotency_key, user_id, fingerprint)
+            if previous:
+                return previous
+            balance = self._active_account(cursor, from_id, user_id)
+            self._active_account(cursor, to_id)
+            if amount > balance:
+                raise LedgerError("Insufficient balance")
+            currencies = self._currencies(cursor, from_id, to_id)
+            credited = self._converted(amount, currencies[from_id], currencies[to_id])
+            noted = description
+            if currencies[from_id] != currencies[to_id]:
+                noted = f"{description} ({amount:.2f} {currencies[from_id]} = {credited:.2f} {currencies[to_id]})"
+            if self.rules:
+                self.rules.check_debit(cursor, from_id, amount, reference_number, posted, currencies[from_id])
+             
+            cursor.execute(INSERT_TRANSACTION, (from_id, "Transfer (Out)", amount, noted, transaction_date, reference_number, "completed", posted))
+            cursor.execute(INSERT_TRANSACTION, (to_id, "Transfer (In)", credited, noted, transaction_date, reference_number, "completed", posted))
+            cursor.execute("UPDATE accounts SET balance = balance - ? WHERE id = ?", (amount, from_id))
+            cursor.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (credited, to_id))
+            result = PostingResult(reference_number, "Transfer", amount, from_id, to_id, balance - amount, transaction_date)
+            self._announce(cursor, result, posted)
+            result = self._remember(cursor, idempotency_key, user_id, fingerprint, result)
+        if self.rules:
+            self.rules.record(debits=[(from_id, amount, currencies[from_id])], credits=[(to_id, credited, currencies[to_id])], now=posted)
+        return result
+     
+    def close_account(self, account_id, user_id=None, conn=None):
+        """Mark an account as closed"""
+        account_id = int(account_id)
+        closed = timeutil.now()
+        with self.transaction(conn) as cursor:
+            balance = self._active_account(cursor, account_id, user_id)
+            cursor.execute("UPDATE accounts SET status = 'closed' WHERE id = ?", (account_id,))
+            result = PostingResult(None, "Close", 0.0, account_id, None, balance, timestamp(closed))
+            self._announce(cursor, result, closed)
+        return result
+     
+    # Two-phase transfer steps, used by sharding.ShardedLedger when the two
+    # accounts live in different database files. Phase one leaves 'pending'
+    # rows keyed by the transfer's reference number; phase two settles or
+    # cancels them and is safe to repeat during recovery.
+     
+    def reserve_debit(self, reference_number, account_id, amount, description, transaction_date, user_id=None, conn=None, posted=None):
+        """Phase one on the source: take the money and record a pending Transfer (Out)"""
+        check_amount(amount)
+        account_id = int(account_id)
+        posted = posted or timeutil.from_local_text(transaction_date)
+        with self.transaction(conn) as cursor:
+            balance = self._active_account(cursor, account_id, user_id)
+            if amount > balance:
+                raise LedgerError("Insufficient balance")
+            currency = BASE
+            if self.rules:
+                currency = self._currencies(cursor, account_id)[account_id]
+                self.rules.check_debit(cursor, account_id, amount, reference_number, posted, currency)
+            cursor.execute(INSERT_TRANSACTION, (account_id, "Transfer (Out)", amount, description, transaction_date, reference_number, "pending", posted))
+            cursor.execute("UPDATE accounts SET balance = balance - ? WHERE id = ?", (amount, account_id))
+        if self.rules:
+            self.rules.record(debits=[(account_id, amount, currency)], now=posted)
+        return balance - amount
+     
+    def reserve_credit(self, reference_number, account_id, amount, description, transaction_date, conn=None, posted=None, currency=None):
+        """Phase one on the destination: check the account and record a pending Transfer (In)
+         
+        ``currency`` is the source account's; the pending row holds the
+        amount converted to the destination's currency, which is what
+        settling credits.
+        """
+        account_id = int(account_id)
+        posted = posted or timeutil.from_local_text(transaction_date)
+        with self.transaction(conn) as cursor:
+            self._active_account(cursor, account_id)
+            target = self._currencies(cursor, account_id)[account_id]
+            if currency is not None and currency != target:
+                credited = self._converted(amount, currency, target)
+                description = f"{description} ({amount:.2f} {currency} = {credited:.2f} {target})"
+                amount = credited
+            cursor.execute(INSERT_TRANSACTION, (account_id, "Transfer (In)", amount, description, transaction_date, reference_number, "pending", posted))
+        if self.rules:
+            self.rules.record(credits=[(account_id, amount, target)], now=posted)
+     
+    def settle_transfer(self, reference_number, account_id, conn=None):
+        """Phase two after a commit decision: complete the pending rows, crediting incoming ones"""
+        account_id = int(account_id)
+        with self.transaction(conn) as cursor:
+            cursor.execute("SELECT id, transaction_type, amount FROM transactions WHERE account_id = ? AND reference_number = ? AND status = 'pending'",
+                           (account_id, reference_number))
+            for transaction_id, transaction_type, amount in cursor.fetchall():
+                if transaction_type == "Transfer (In)":
+                    cursor.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount, account_id))
+                cursor.execute("UPDATE transactions SET status = 'completed' WHERE id = ?", (transaction_id,))
+     
+    def cancel_transfer(self, reference_number, account_id, conn=None):
+        """Phase two after an abort decision: refund outgoing pending rows and mark them failed"""
+        account_id = int(account_id)
+        with self.transaction(conn) as cursor:
+            cursor.execute("SELECT id, transaction_type, amount FROM transactions WHERE account_id = ? AND reference_number = ? AND status = 'pending'",
+                           (account_id, reference_number))
+            for transaction_id, transaction_type, amount in cursor.fetchall():
+                if transaction_type == "Transfer (Out)":
+                    cursor.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount, account_id))
+                cursor.execute("UPDATE transactions SET status = 'failed' WHERE id = ?", (transaction_id,))
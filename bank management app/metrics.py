@@ -0,0 +1,209 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+ 
+# Histogram bucket upper bounds in seconds; frame-time budgets sit around 16-100 ms
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.016, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+ 
+# Time budgets in seconds; observations above them count in bank_ui_over_budget_total
+BUDGETS = {
+    "bank_ui_event_loop_lag_seconds": 0.05,
+    "bank_ui_screen_seconds": 0.1,
+    "bank_ui_screen_ready_seconds": 0.25,
+    "bank_ui_dialog_seconds": 0.05,
+    "bank_ui_dialog_ready_seconds": 0.15,
+}
+ 
+ 
+class Histogram:
+    """Bucketed distribution of observed durations"""
+     
+    __slots__ = ('counts', 'count', 'sum', 'max')
+     
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+     
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+     
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations (capped at the max)"""
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return 0.0
+ 
+ 
+class Registry:
+    """Named histograms and counters, each keyed by a set of labels"""
+     
+    def __init__(self, budgets=None):
+        self.histograms = {}
+        self.counters = {}
+        self.budgets = dict(BUDGETS if budgets is None else budgets)
+        self.lock = threading.Lock()
+     
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+        budget = self.budgets.get(name)
+        if budget is not None and seconds > budget:
+            self.increment("bank_ui_over_budget_total", metric=name, **labels)
+     
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+     
+    def to_prometheus(self):
+        """Render everything in the Prometheus text exposition format"""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        declared = set()
+        for (name, labels), histogram in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+     
+    def to_json(self):
+        """Summaries in milliseconds, easier to read than raw buckets"""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        return {
+            "histograms": [{
+                "name": name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "mean_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else None,
+                "p50_ms": histogram.quantile(0.50) * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+                "max_ms": round(histogram.max * 1000, 3),
+                "budget_ms": self.budgets[name] * 1000 if name in self.budgets else None,
+            } for (name, labels), histogram in histograms],
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters],
+        }
+     
+    def export(self, path):
+        """Write metrics to path: JSON for ``.json`` files, Prometheus text otherwise"""
+        text = json.dumps(self.to_json(), indent=2) if path.endswith(".json") else self.to_prometheus()
+        # Write then rename, so a scraper never reads a half-written file
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(text)
+        os.replace(temporary, path)
+ 
+ 
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+ 
+ 
+REGISTRY = Registry()
+ 
+ 
+@contextmanager
+def span(name, **labels):
+    """Time a block into the named histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - start, **labels)
+ 
+ 
+def timed(kind, name):
+    """Decorator for Tk screen and dialog methods
+     
+    Records how long the method itself takes (``bank_ui_<kind>_seconds``)
+    and how long until Tk is idle again, i.e. geometry and redraw of the
+    new widgets are done too (``bank_ui_<kind>_ready_seconds``).
+    """
+    metric = f"bank_ui_{kind}_seconds"
+    ready_metric = f"bank_ui_{kind}_ready_seconds"
+     
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                REGISTRY.observe(metric, time.perf_counter() - start, **{kind: name})
+                # Idle callbacks run in order, so this one runs after the pending redraws
+                self.root.after_idle(lambda: REGISTRY.observe(ready_metric, time.perf_counter() - start, **{kind: name}))
+        return wrapper
+    return decorate
+ 
+ 
+class LagMonitor:
+    """Samples Tk event-loop lag from the drift of a periodic ``after`` timer
+     
+    A callback scheduled ``interval`` ms ahead should run on time; any extra
+    delay is time the loop spent blocked in a handler. Optionally exports
+    the registry to ``export_path`` every ``export_every`` seconds.
+    """
+     
+    def __init__(self, root, interval=50, export_path=None, export_every=30):
+        self.root = root
+        self.interval = interval
+        self.export_path = export_path
+        self.export_every = export_every
+        self.expected = None
+        self.last_export = time.monotonic()
+        self.job = None
+     
+    def start(self):
+        self.expected = time.perf_counter() + self.interval / 1000
+        self.job = self.root.after(self.interval, self.sample)
+        return self
+     
+    def stop(self):
+        if self.job is not None:
+            self.root.after_cancel(self.job)
+            self.job = None
+        if self.export_path:
+            REGISTRY.export(self.export_path)
+     
+    def sample(self):
+        now = time.perf_counter()
+        REGISTRY.observe("bank_ui_event_loop_lag_seconds", max(0.0, now - self.expected))
+        if self.export_path and time.monotonic() - self.last_export >= self.export_every:
+            self.last_export = time.monotonic()
+            REGISTRY.export(self.export_path)
+        self.expected = time.perf_counter() + self.interval / 1000
+        self.job = self.root.after(self.interval, self.sample)
@@ -0,0 +1,159 @@
+from array import array
+from collections import namedtuple
+ 
+# Row models. These are tuple subclasses with empty __slots__, so they cost
+# no more than the plain tuples sqlite3 returns but are read by field name.
+ 
+# Stands for a missing (NULL) time in the array-backed columns
+NO_TIME = -2 ** 63
+ 
+# Symbols shown before amounts; other currencies are shown with their code
+CURRENCY_SYMBOLS = {'USD': '$', 'EUR': '\u20ac', 'GBP': '\u00a3', 'JPY': '\u00a5', 'INR': '\u20b9'}
+ 
+ 
+def format_money(amount, currency='USD', grouping=False):
+    """An amount with its currency symbol (or code), two decimals"""
+    text = f"{amount:,.2f}" if grouping else f"{amount:.2f}"
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    return f"{symbol}{text}" if symbol else f"{currency} {text}"
+ 
+ 
+class User(namedtuple('User', 'id username password full_name email phone address registration_date profile_pic role registration_time')):
+    """A row of the users table"""
+    __slots__ = ()
+     
+    def profile(self):
+        """Return the logged-in view of this user (without the password hash)"""
+        return UserProfile(self.id, self.username, self.full_name, self.email,
+                           self.phone, self.address, self.registration_date, self.role, self.registration_time)
+ 
+ 
+class UserProfile(namedtuple('UserProfile', 'id username full_name email phone address registration_date role registration_time')):
+    """The current user as shown by the profile screens"""
+    __slots__ = ()
+ 
+ 
+class Account(namedtuple('Account', 'id user_id account_number account_type balance opening_date status opening_time currency')):
+    """A row of the accounts table"""
+    __slots__ = ()
+     
+    def option_label(self):
+        """Text used for the account in dropdowns"""
+        return f"{self.account_number} ({self.account_type}) - {format_money(self.balance, self.currency)}"
+ 
+ 
+class Transaction(namedtuple('Transaction', 'id account_id transaction_type amount description transaction_date reference_number status transaction_time')):
+    """A row of the transactions table"""
+    __slots__ = ()
+ 
+ 
+class AccountTransaction(namedtuple('AccountTransaction', Transaction._fields + ('account_number',))):
+    """A transaction joined with the number of its account (``SELECT t.*, a.account_number``)"""
+    __slots__ = ()
+ 
+ 
+class TransactionDetail(namedtuple('TransactionDetail', Transaction._fields + ('account_number', 'account_type', 'currency'))):
+    """A transaction joined with its account number, type and currency"""
+    __slots__ = ()
+ 
+ 
+class StandingOrder(namedtuple('StandingOrder', 'id user_id from_account to_account amount description interval first_run '
+                                               'next_run occurrences end_time status failures last_run last_result created_at')):
+    """A row of the standing_orders table; times are epoch microseconds"""
+    __slots__ = ()
+ 
+ 
+class TransactionColumns:
+    """Column-oriented, array-backed store for long transaction lists
+     
+    Numbers live in typed arrays, repeated strings (type, status, account
+    number) are dictionary-encoded into small integer codes, and dates in
+    the ``YYYY-MM-DD HH:MM:SS`` format are packed into one 64-bit integer
+    next to the epoch-microsecond time. Rows are rebuilt as model instances only when they are read.
+    """
+     
+    __slots__ = ('model', 'ids', 'account_ids', 'amounts', 'dates', 'odd_dates', 'times',
+                 'descriptions', 'references', 'types', 'statuses', 'numbers', 'dictionary', 'lookup')
+     
+    def __init__(self, rows=(), model=Transaction):
+        self.model = model
+        self.ids = array('q')
+        self.account_ids = array('q')
+        self.amounts = array('d')
+        self.dates = array('q')
+        self.odd_dates = {}
+        self.times = array('q')
+        self.descriptions = []
+        self.references = []
+        self.types = array('H')
+        self.statuses = array('H')
+        self.numbers = array('H')
+        self.dictionary = []
+        self.lookup = {}
+        self.extend(rows)
+     
+    def _encode(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+     
+    def _pack_date(self, index, value):
+        try:
+            if len(value) == 19:
+                return int(value[0:4] + value[5:7] + value[8:10] + value[11:13] + value[14:16] + value[17:19])
+        except (TypeError, ValueError):
+            pass
+        self.odd_dates[index] = value
+        return -1
+     
+    def _unpack_date(self, index):
+        packed = self.dates[index]
+        if packed < 0:
+            return self.odd_dates[index]
+        digits = f"{packed:014d}"
+        return f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} {digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+     
+    def append(self, row):
+        """Add one transaction row (a model instance or a plain tuple)"""
+        index = len(self.ids)
+        self.ids.append(row[0])
+        self.account_ids.append(row[1] or 0)
+        self.types.append(self._encode(row[2]))
+        self.amounts.append(row[3])
+        self.descriptions.append(row[4])
+        self.dates.append(self._pack_date(index, row[5]))
+        self.references.append(row[6])
+        self.statuses.append(self._encode(row[7]))
+        self.times.append(NO_TIME if row[8] is None else row[8])
+        if self.model is AccountTransaction:
+            self.numbers.append(self._encode(row[9]))
+     
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+     
+    def __len__(self):
+        return len(self.ids)
+     
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError("transaction index out of range")
+        dictionary = self.dictionary
+        values = (self.ids[index], self.account_ids[index], dictionary[self.types[index]], self.amounts[index],
+                  self.descriptions[index], self._unpack_date(index), self.references[index],
+                  dictionary[self.statuses[index]], None if self.times[index] == NO_TIME else self.times[index])
+        if self.model is AccountTransaction:
+            values += (dictionary[self.numbers[index]],)
+        return self.model._make(values)
+     
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield self[index]
+     
+    def total(self):
+        """Sum of all amounts, computed straight from the amounts column"""
+        return sum(self.amounts)
@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from email.message import EmailMessage
+ 
+import database
+import timeutil
+from models import format_money
+ 
+# Events handed to a sink per delivery
+BATCH = 200
+# How often the dispatcher looks for new events when nothing wakes it, in seconds
+POLL_INTERVAL = 0.5
+# Retry delay after a failed delivery: doubles per failure from RETRY_BASE up to RETRY_MAX seconds
+RETRY_BASE = 1.0
+RETRY_MAX = 300.0
+ 
+OutboxEvent = namedtuple('OutboxEvent', 'id topic account_id payload created_at')
+ 
+ 
+def write_atomically(path, text):
+    """Write a whole file under a temporary name first, so readers never see half of it"""
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as out:
+        out.write(text)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temporary, path)
+ 
+ 
+class FileSink:
+    """Appends every event as a JSON line to a local file"""
+     
+    def __init__(self, path, name="file"):
+        self.path = path
+        self.name = name
+     
+    def deliver(self, events, conn):
+        lines = "".join(json.dumps({"id": event.id, "topic": event.topic, "created_at": event.created_at, **event.payload}) + "\n"
+                        for event in events)
+        with open(self.path, "a", encoding="utf-8") as out:
+            out.write(lines)
+            out.flush()
+            os.fsync(out.fileno())
+ 
+ 
+class WebhookSink:
+    """Stand-in for a webhook: writes the JSON body each batch would be POSTed with, one file per batch
+     
+    Files are named after the ids they hold, so a batch that is retried
+    replaces its earlier copy instead of adding a second one.
+    """
+     
+    def __init__(self, directory, url=None, name="webhook"):
+        self.directory = directory
+        self.url = url
+        self.name = name
+     
+    def deliver(self, events, conn):
+        os.makedirs(self.directory, exist_ok=True)
+        body = {"url": self.url, "events": [{"id": event.id, "topic": event.topic, "created_at": event.created_at,
+                                              "data": event.payload} for event in events]}
+        write_atomically(os.path.join(self.directory, f"{events[0].id:012d}-{events[-1].id:012d}.json"), json.dumps(body))
+ 
+ 
+class EmailSink:
+    """Writes a notification e-mail to the account holder per event into a spool directory for a mail relay"""
+     
+    def __init__(self, directory, sender="noreply@bank.local", name="email"):
+        self.directory = directory
+        self.sender = sender
+        self.name = name
+     
+    def deliver(self, events, conn):
+        os.makedirs(self.directory, exist_ok=True)
+        # Account holders of the whole batch in one query
+        account_ids = sorted({event.account_id for event in events if event.account_id is not None})
+        owners = {}
+        if account_ids:
+            owners = {row[0]: row[1:] for row in conn.execute(f'''
+            SELECT a.id, a.account_number, a.currency, u.full_name, u.email
+            FROM accounts a JOIN users u ON u.id = a.user_id
+            WHERE a.id IN ({', '.join('?' * len(account_ids))})
+            ''', account_ids)}
+        for event in events:
+            owner = owners.get(event.account_id)
+            if owner is None:
+                continue
+            account_number, currency, full_name, email = owner
+            data = event.payload
+            message = EmailMessage()
+            message["From"] = self.sender
+            message["To"] = email
+            message["Subject"] = f"{data['transaction_type']} on account {account_number}"
+            lines = [f"Dear {full_name},", ""]
+            if data["transaction_type"] == "Close":
+                lines.append(f"Your account {account_number} has been closed.")
+            else:
+                lines.append(f"{data['transaction_type']} of {format_money(data['amount'], currency)} on account {account_number}"
+                             + (f" (reference {data['reference_number']})." if data.get("reference_number") else "."))
+                lines.append(f"Balance: {format_money(data['balance'], currency)}")
+            lines += ["", f"Time: {data['transaction_date']}"]
+            message.set_content("\n".join(lines))
+            write_atomically(os.path.join(self.directory, f"{event.id:012d}.eml"), message.as_string())
+ 
+ 
+def sinks_from_env():
+    """Sinks configured by BANK_OUTBOX_FILE, BANK_WEBHOOK_DIR (with BANK_WEBHOOK_URL) and BANK_MAIL_SPOOL"""
+    sinks = []
+    if os.environ.get('BANK_OUTBOX_FILE'):
+        sinks.append(FileSink(os.environ['BANK_OUTBOX_FILE']))
+    if os.environ.get('BANK_WEBHOOK_DIR'):
+        sinks.append(WebhookSink(os.environ['BANK_WEBHOOK_DIR'], os.environ.get('BANK_WEBHOOK_URL')))
+    if os.environ.get('BANK_MAIL_SPOOL'):
+        sinks.append(EmailSink(os.environ['BANK_MAIL_SPOOL']))
+    return sinks
+ 
+ 
+class OutboxDispatcher:
+    """Delivers the notifications the ledger queued in the outbox table
+     
+    Postings only insert their outbox row, in their own commit; every
+    process does so once any sink is registered in outbox_offsets (see
+    start()). Delivery happens on this thread and never holds a posting
+    up. Every sink has its own offset in outbox_offsets and receives the
+    events after it, in order, ``batch`` at a time. A failed delivery is
+    retried after RETRY_BASE seconds, doubling per failure up to
+    RETRY_MAX, and only delays that sink. Delivery is at least once: a
+    crash between a delivery and its offset update repeats the batch.
+    Events every registered sink has taken are deleted, whichever process
+    delivers to it; `python outbox.py forget` unregisters a retired sink.
+    """
+     
+    def __init__(self, sinks, path=None, batch=BATCH, interval=POLL_INTERVAL):
+        self.sinks = list(sinks)
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.conn = None
+        # Per sink: (failures in a row, monotonic time of the next attempt)
+        self.backoff = {sink.name: (0, 0.0) for sink in self.sinks}
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = {'delivered': 0, 'failures': 0}
+     
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            # Register the sinks first, so every posting from now on is queued for them
+            conn = database.connect(self.path)
+            try:
+                self.offsets(conn)
+            finally:
+                conn.close()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self.thread.start()
+        return self
+     
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.stopped.set()
+            self.wakeup.set()
+            self.thread.join(timeout)
+            self.thread = None
+     
+    def wake(self, *args):
+        """Look for new events now rather than at the next poll (usable as an event bus callback)"""
+        self.wakeup.set()
+     
+    def offsets(self, conn):
+        known = dict(conn.execute("SELECT sink, last_id FROM outbox_offsets"))
+        missing = [sink.name for sink in self.sinks if sink.name not in known]
+        if missing:
+            # A new sink starts with the events still in the outbox
+            conn.executemany("INSERT OR IGNORE INTO outbox_offsets (sink, last_id, updated_at) VALUES (?, 0, ?)",
+                             [(name, timeutil.now()) for name in missing])
+            conn.commit()
+            known.update((name, 0) for name in missing)
+        return known
+     
+    def drain(self, conn=None):
+        """Deliver every pending event to every sink that isn't backing off; returns events delivered"""
+        conn = conn or self._connection()
+        offsets = self.offsets(conn)
+        delivered = 0
+        for sink in self.sinks:
+            while not self.stopped.is_set():
+                failures, next_attempt = self.backoff[sink.name]
+                if time.monotonic() < next_attempt:
+                    break
+                rows = conn.execute("SELECT id, topic, account_id, payload, created_at FROM outbox WHERE id > ? ORDER BY id LIMIT ?",
+                                    (offsets[sink.name], self.batch)).fetchall()
+                if not rows:
+                    break
+                events = [OutboxEvent(row[0], row[1], row[2], json.loads(row[3]), row[4]) for row in rows]
+                try:
+                    sink.deliver(events, conn)
+                except Exception as e:
+                    failures += 1
+                    self.backoff[sink.name] = (failures, time.monotonic() + min(RETRY_BASE * 2 ** (failures - 1), RETRY_MAX))
+                    self.stats['failures'] += 1
+                    conn.execute("UPDATE outbox_offsets SET last_error = ?, updated_at = ? WHERE sink = ?",
+                                 (f"{type(e).__name__}: {e}", timeutil.now(), sink.name))
+                    conn.commit()
+                    break
+                self.backoff[sink.name] = (0, 0.0)
+                offsets[sink.name] = events[-1].id
+                conn.execute("UPDATE outbox_offsets SET last_id = ?, delivered = delivered + ?, updated_at = ?, last_error = NULL WHERE sink = ?",
+                             (events[-1].id, len(events), timeutil.now(), sink.name))
+                conn.commit()
+                delivered += len(events)
+                if len(events) < self.batch:
+                    break
+        if self.sinks and delivered:
+            # Only what every registered sink has taken, including the sinks of other processes
+            conn.execute("DELETE FROM outbox WHERE id <= (SELECT MIN(last_id) FROM outbox_offsets)")
+            conn.commit()
+        self.stats['delivered'] += delivered
+        return delivered
+     
+    def _connection(self):
+        if self.conn is None:
+            self.conn = database.connect(self.path)
+        return self.conn
+     
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.drain()
+            except sqlite3.Error as e:
+                print(f"Outbox: {e}", file=sys.stderr)
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Notification outbox: show its state, or deliver what is pending and exit")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Pending events and the offset of each sink")
+    forget = commands.add_parser("forget", help="Unregister a sink that is gone, so its pending events can be deleted")
+    forget.add_argument("sink")
+    drain = commands.add_parser("drain", help="Deliver pending events to the sinks set in the environment (or given here)")
+    drain.add_argument("--file", default=None, help="Append events as JSON lines to this file")
+    drain.add_argument("--webhook-dir", default=None, help="Write webhook request bodies to this directory")
+    drain.add_argument("--mail-spool", default=None, help="Write notification e-mails to this directory")
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    if args.command == "status":
+        count, oldest = conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+        print(f"{count} events in the outbox" + (f", oldest from {timeutil.format_time(oldest)}" if oldest else ""))
+        for sink, last_id, delivered, updated_at, last_error in conn.execute("SELECT * FROM outbox_offsets ORDER BY sink"):
+            print(f"  {sink:<10} at {last_id:<10} {delivered:>10} delivered, {timeutil.format_time(updated_at)} {last_error or ''}")
+    elif args.command == "forget":
+        if not conn.execute("DELETE FROM outbox_offsets WHERE sink = ?", (args.sink,)).rowcount:
+            parser.error(f"No sink named {args.sink}")
+        conn.execute("DELETE FROM outbox WHERE id <= (SELECT COALESCE(MIN(last_id), (SELECT MAX(id) FROM outbox)) FROM outbox_offsets)")
+        conn.commit()
+        print(f"Sink {args.sink} forgotten")
+    else:
+        sinks = sinks_from_env()
+        if args.file:
+            sinks.append(FileSink(args.file))
+        if args.webhook_dir:
+            sinks.append(WebhookSink(args.webhook_dir))
+        if args.mail_spool:
+            sinks.append(EmailSink(args.mail_spool))
+        if not sinks:
+            parser.error("No sinks: set BANK_OUTBOX_FILE, BANK_WEBHOOK_DIR or BANK_MAIL_SPOOL, or pass one")
+        start = time.perf_counter()
+        dispatcher = OutboxDispatcher(sinks, args.db)
+        delivered = dispatcher.drain(conn)
+        print(f"{delivered} events delivered in {time.perf_counter() - start:.2f}s, {dispatcher.stats['failures']} failed deliveries")
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import atexit
+import bisect
+import json
+import os
+import re
+import signal
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+ 
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+ 
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_SPACE = re.compile(r"\s+")
+ 
+# The active profiler, or None; database.connect only pays for profiling when set
+PROFILER = None
+ 
+ 
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalize a statement so calls that differ only in literals group together"""
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?+)", sql)
+    return _SPACE.sub(" ", sql).strip().rstrip(";")
+ 
+ 
+class QueryStats:
+    """Call count, total/max time and a latency histogram for one fingerprint"""
+     
+    __slots__ = ('count', 'total', 'max', 'buckets', 'plan')
+     
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.plan = None
+     
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+     
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls"""
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.max
+        return 0.0
+ 
+ 
+class Profiler:
+    """Collects per-fingerprint timings and writes a slow-query log
+     
+    Statements slower than ``slow_ms`` are appended to ``log_path`` as JSON
+    lines together with their EXPLAIN QUERY PLAN, which is computed once
+    per fingerprint.
+    """
+     
+    def __init__(self, slow_ms=50, log_path="slow_queries.log"):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+     
+    def record(self, conn, sql, ms):
+        key = fingerprint(sql)
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = QueryStats()
+            stats.add(ms)
+            explain = ms >= self.slow_ms and stats.plan is None
+            if explain:
+                stats.plan = []
+        if ms >= self.slow_ms:
+            if explain:
+                stats.plan = self.explain(conn, sql)
+            self.log_slow(key, sql, ms, stats.plan)
+     
+    def explain(self, conn, sql):
+        """Return the query plan lines, or [] for statements that can't be explained"""
+        words = sql.split(None, 1)
+        if not words or words[0].upper() not in ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT"):
+            return []
+        try:
+            # Call the base class so the EXPLAIN itself isn't profiled; placeholders may be NULL
+            cursor = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?"))
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error:
+            return []
+     
+    def log_slow(self, key, sql, ms, plan):
+        entry = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "ms": round(ms, 3),
+                 "fingerprint": key, "sql": _SPACE.sub(" ", sql).strip(), "plan": plan}
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            with open(self.log_path, "a") as f:
+                f.write(line)
+     
+    def report(self):
+        """Per-fingerprint summaries, most total time first"""
+        with self.lock:
+            items = list(self.stats.items())
+        rows = [{
+            "fingerprint": key,
+            "count": stats.count,
+            "total_ms": round(stats.total, 3),
+            "mean_ms": round(stats.total / stats.count, 3),
+            "p95_ms": stats.percentile(0.95),
+            "max_ms": round(stats.max, 3),
+            "histogram": dict(zip([f"le_{bound}" for bound in BUCKETS_MS] + ["inf"], stats.buckets)),
+            "plan": stats.plan,
+        } for key, stats in items]
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows
+     
+    def dump(self, path=None):
+        """Write the report as JSON (to ``<log_path>.json`` by default) and return the path"""
+        path = path or os.path.splitext(self.log_path)[0] + ".json"
+        with open(path, "w") as f:
+            json.dump({"since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                       "queries": self.report()}, f, indent=2)
+        return path
+     
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+ 
+ 
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor that times execute/executemany on the profiler"""
+     
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if PROFILER is not None:
+                PROFILER.record(self.connection, sql, (time.perf_counter() - start) * 1000)
+     
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            if PROFILER is not None:
+                PROFILER.record(self.connection, sql, (time.perf_counter() - start) * 1000)
+ 
+ 
+class ProfilingConnection(sqlite3.Connection):
+    """Connection whose cursors, and execute shortcuts, are profiled"""
+     
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+     
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+     
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+ 
+ 
+def connection_factory():
+    """Connection class for database.connect: profiled only while a profiler is enabled"""
+    return sqlite3.Connection if PROFILER is None else ProfilingConnection
+ 
+ 
+def enable(slow_ms=50, log_path="slow_queries.log", dump_on_exit=True):
+    """Start profiling connections opened from now on
+     
+    The report is dumped at exit and, on POSIX, whenever the process gets
+    SIGUSR1 (``kill -USR1 <pid>``).
+    """
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = Profiler(slow_ms, log_path)
+        if dump_on_exit:
+            atexit.register(dump)
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: dump())
+    return PROFILER
+ 
+ 
+def dump(path=None):
+    """Write the active profiler's report; returns the path, or None when profiling is off"""
+    if PROFILER is not None:
+        return PROFILER.dump(path)
+ 
+ 
+def disable():
+    global PROFILER
+    PROFILER = None
+ 
+ 
+# BANK_PROFILE=1 turns profiling on for any entry point (GUI, API server, benchmark)
+if os.environ.get("BANK_PROFILE"):
+    enable(float(os.environ.get("BANK_SLOW_MS", 50)), os.environ.get("BANK_SLOW_LOG", "slow_queries.log"))
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a slow-query log")
+    parser.add_argument("log", nargs="?", default="slow_queries.log")
+    parser.add_argument("--top", type=int, default=20, help="Fingerprints to show")
+    args = parser.parse_args()
+     
+    stats = {}
+    with open(args.log) as f:
+        for line in f:
+            entry = json.loads(line)
+            count, total, worst, plan = stats.get(entry["fingerprint"], (0, 0.0, 0.0, entry["plan"]))
+            stats[entry["fingerprint"]] = (count + 1, total + entry["ms"], max(worst, entry["ms"]), plan or entry["plan"])
+     
+    ranked = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for key, (count, total, worst, plan) in ranked:
+        print(f"{count:>6} slow  {total:>10.1f} ms total  {worst:>8.1f} ms max  {key}")
+        for step in plan or ():
+            print(f"{'':>8}{step}")
+ 
+ 
+if __name__ == "__main__":
+    main()
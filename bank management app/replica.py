@@ -0,0 +1,116 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+ 
+import database
+from backup import online_backup
+ 
+# How often the snapshot is refreshed, in seconds
+REFRESH_INTERVAL = 300
+# A snapshot older than this many intervals (refreshes failing or stopped) is skipped for the live file
+MAX_AGE_INTERVALS = 3
+ 
+ 
+class Replica:
+    """Read-only snapshot copy of the database for heavy reports
+     
+    Reports opened through connect() read a copy of the database taken
+    with the SQLite backup API every ``interval`` seconds, so a long scan
+    never shares pages, locks or the WAL with the posting writer, and
+    teller postings keep their latency while it runs. A new snapshot is
+    built under a temporary name, switched out of WAL mode (readers of a
+    read-only file then need no -wal/-shm next to it) and swapped in
+    whole; connections still open on the old one keep reading it.
+    Figures are up to ``interval`` seconds behind. Without a recent
+    snapshot, connect() falls back to a read-only connection to the live
+    file.
+    """
+     
+    def __init__(self, path=None, replica_path=None, interval=REFRESH_INTERVAL):
+        self.path = path or database.DB_PATH
+        self.replica_path = replica_path or os.path.splitext(self.path)[0] + "_replica.db"
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+     
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name="replica", daemon=True)
+            self.thread.start()
+        return self
+     
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join(timeout)
+            self.thread = None
+     
+    def refresh(self):
+        """Take a new snapshot now; returns its path"""
+        fresh = online_backup(self.path, self.replica_path + ".new")
+        conn = sqlite3.connect(fresh)
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE").fetchone()
+        finally:
+            conn.close()
+        os.replace(fresh, self.replica_path)
+        return self.replica_path
+     
+    def age(self):
+        """Seconds since the current snapshot was taken, or None without one"""
+        try:
+            return max(time.time() - os.path.getmtime(self.replica_path), 0.0)
+        except OSError:
+            return None
+     
+    def connect(self, check_same_thread=True):
+        """Read-only connection to the snapshot, or to the live file if there is no recent one"""
+        age = self.age()
+        if age is not None and age <= self.interval * MAX_AGE_INTERVALS:
+            return database.connect(self.replica_path, readonly=True, check_same_thread=check_same_thread)
+        return database.connect(self.path, readonly=True, check_same_thread=check_same_thread)
+     
+    def _run(self):
+        # Start with a snapshot unless the one on disk is still current
+        age = self.age()
+        wait = 0 if age is None else max(self.interval - age, 0)
+        while not self.stopped.wait(wait):
+            try:
+                self.refresh()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Replica refresh failed: {e}", file=sys.stderr)
+            wait = self.interval
+ 
+ 
+def replica_from_env(path=None):
+    """Replica configured by BANK_REPLICA_PATH (with BANK_REPLICA_INTERVAL seconds), or None"""
+    if not os.environ.get('BANK_REPLICA_PATH'):
+        return None
+    return Replica(path, os.environ['BANK_REPLICA_PATH'], float(os.environ.get('BANK_REPLICA_INTERVAL', REFRESH_INTERVAL)))
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot copy of the database that heavy reports read instead of the live file")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    parser.add_argument("--replica", default=os.environ.get('BANK_REPLICA_PATH'), help="Snapshot file (default: BANK_REPLICA_PATH or <db>_replica.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("refresh", help="Take a new snapshot now (e.g. from cron)")
+    commands.add_parser("status", help="Print the age of the current snapshot")
+    args = parser.parse_args()
+     
+    replica = Replica(args.db, args.replica)
+    if args.command == "refresh":
+        start = time.perf_counter()
+        replica.refresh()
+        print(f"Snapshot {replica.replica_path} taken in {time.perf_counter() - start:.2f}s")
+    else:
+        age = replica.age()
+        print(f"No snapshot at {replica.replica_path}" if age is None else f"Snapshot {replica.replica_path} is {age:.0f}s old")
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import sqlite3
+import time
+from collections import namedtuple
+ 
+import database
+from fx import BASE, FXRates
+ 
+# Transaction-volume rollups: table -> (bucket column, length of the transaction_date prefix naming a bucket).
+# Every rollup is kept per currency, in the currency of the accounts; readers convert to fx.BASE
+BUCKETS = {
+    'rollup_daily': ('day', 10),
+    'rollup_hourly': ('hour', 13),
+}
+ 
+# Ids per backfill step; each step is one short write transaction, followed by a
+# pause at least as long (and no shorter than BACKFILL_PAUSE) so postings waiting
+# in SQLite's busy handler get the lock in between
+BACKFILL_CHUNK = 10000
+BACKFILL_PAUSE = 0.05
+ 
+# create_schema backfills new rollups itself when there are at most this many ids to go through
+BACKFILL_INLINE = 100000
+ 
+CREDIT_TYPES = "('Deposit', 'Transfer (In)')"
+ 
+# Amounts in the base currency (fx.BASE)
+VolumeBucket = namedtuple('VolumeBucket', 'bucket account_type transactions credits debits')
+ 
+ROLLUP_TABLES = '''
+CREATE TABLE IF NOT EXISTS rollup_accounts (
+    account_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    accounts INTEGER NOT NULL,
+    balance REAL NOT NULL,
+    PRIMARY KEY (account_type, status, currency)
+) WITHOUT ROWID;
+ 
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    day TEXT NOT NULL,
+    account_type TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    transactions INTEGER NOT NULL,
+    credits REAL NOT NULL,
+    debits REAL NOT NULL,
+    PRIMARY KEY (day, account_type, currency)
+) WITHOUT ROWID;
+ 
+CREATE TABLE IF NOT EXISTS rollup_hourly (
+    hour TEXT NOT NULL,
+    account_type TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    transactions INTEGER NOT NULL,
+    credits REAL NOT NULL,
+    debits REAL NOT NULL,
+    PRIMARY KEY (hour, account_type, currency)
+) WITHOUT ROWID;
+ 
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    boundary_id INTEGER NOT NULL,
+    position_id INTEGER NOT NULL
+);
+'''
+ 
+# Adds one completed transaction (NEW) to every volume rollup
+COUNT_TRANSACTION = ''.join(f'''
+    INSERT INTO {table} ({key}, account_type, currency, transactions, credits, debits)
+    SELECT substr(NEW.transaction_date, 1, {length}), COALESCE(a.account_type, ''), COALESCE(a.currency, '{BASE}'), 1,
+           CASE WHEN NEW.transaction_type IN {CREDIT_TYPES} THEN NEW.amount ELSE 0 END,
+           CASE WHEN NEW.transaction_type IN {CREDIT_TYPES} THEN 0 ELSE NEW.amount END
+    FROM (SELECT 1) LEFT JOIN accounts a ON a.id = NEW.account_id
+    WHERE true
+    ON CONFLICT DO UPDATE SET transactions = transactions + 1,
+        credits = credits + excluded.credits, debits = debits + excluded.debits;
+''' for table, (key, length) in BUCKETS.items())
+ 
+# Triggers keep the rollups current inside the posting's own transaction, so they
+# are never stale and cost one small upsert per changed row. They are recreated on
+# every start so existing databases pick up changes to them.
+ROLLUP_TRIGGERS = f'''
+DROP TRIGGER IF EXISTS rollup_account_insert;
+CREATE TRIGGER rollup_account_insert AFTER INSERT ON accounts BEGIN
+    INSERT INTO rollup_accounts (account_type, status, currency, accounts, balance)
+    VALUES (NEW.account_type, COALESCE(NEW.status, 'active'), NEW.currency, 1, COALESCE(NEW.balance, 0))
+    ON CONFLICT (account_type, status, currency) DO UPDATE SET accounts = accounts + 1, balance = balance + excluded.balance;
+END;
+ 
+DROP TRIGGER IF EXISTS rollup_account_update;
+CREATE TRIGGER rollup_account_update AFTER UPDATE OF account_type, status, balance, currency ON accounts BEGIN
+    UPDATE rollup_accounts SET accounts = accounts - 1, balance = balance - COALESCE(OLD.balance, 0)
+    WHERE account_type = OLD.account_type AND status = COALESCE(OLD.status, 'active') AND currency = OLD.currency;
+    INSERT INTO rollup_accounts (account_type, status, currency, accounts, balance)
+    VALUES (NEW.account_type, COALESCE(NEW.status, 'active'), NEW.currency, 1, COALESCE(NEW.balance, 0))
+    ON CONFLICT (account_type, status, currency) DO UPDATE SET accounts = accounts + 1, balance = balance + excluded.balance;
+END;
+ 
+DROP TRIGGER IF EXISTS rollup_account_delete;
+CREATE TRIGGER rollup_account_delete AFTER DELETE ON accounts BEGIN
+    UPDATE rollup_accounts SET accounts = accounts - 1, balance = balance - COALESCE(OLD.balance, 0)
+    WHERE account_type = OLD.account_type AND status = COALESCE(OLD.status, 'active') AND currency = OLD.currency;
+END;
+ 
+DROP TRIGGER IF EXISTS rollup_transaction_insert;
+CREATE TRIGGER rollup_transaction_insert AFTER INSERT ON transactions
+WHEN COALESCE(NEW.status, 'completed') = 'completed' BEGIN
+{COUNT_TRANSACTION}
+END;
+ 
+DROP TRIGGER IF EXISTS rollup_transaction_settle;
+CREATE TRIGGER rollup_transaction_settle AFTER UPDATE OF status ON transactions
+WHEN NEW.status = 'completed' AND COALESCE(OLD.status, '') != 'completed' BEGIN
+{COUNT_TRANSACTION}
+END;
+'''
+ 
+ 
+def split_script(script):
+    """Split SQL into statements, keeping trigger bodies whole"""
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    return statements
+ 
+ 
+def create_rollups(conn):
+    """Create the rollup tables and triggers
+     
+    A volume rollup that is new to an existing database counts new
+    postings from the start; the transactions already there (ids up to
+    its boundary in rollup_state) are left to backfill(), which runs here
+    directly when there are only a few of them.
+     
+    Rollups from before multi-currency accounts, which added up all
+    currencies together, are dropped and counted again per currency. The
+    buckets of archived months are carried over in the base currency,
+    since their transactions are no longer here to recount.
+    """
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'rollup_%'")}
+    # Triggers and boundary in one transaction, so no posting falls between them
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        archived = {}
+        for table in ('rollup_accounts', *BUCKETS):
+            if table in existing and 'currency' not in [column[1] for column in conn.execute(f"PRAGMA table_info({table})")]:
+                if table in BUCKETS:
+                    key = BUCKETS[table][0]
+                    archived[table] = conn.execute(f'''
+                    SELECT {key}, account_type, transactions, credits, debits FROM {table}
+                    WHERE substr({key}, 1, 7) IN (SELECT month FROM archive_months)
+                    ''').fetchall()
+                conn.execute(f"DROP TABLE {table}")
+                existing.discard(table)
+        for statement in split_script(ROLLUP_TABLES + ROLLUP_TRIGGERS):
+            conn.execute(statement)
+        for table, rows in archived.items():
+            conn.executemany(f"INSERT INTO {table} ({BUCKETS[table][0]}, account_type, currency, transactions, credits, debits) VALUES (?, ?, '{BASE}', ?, ?, ?)", rows)
+        if 'rollup_accounts' not in existing:
+            rebuild_accounts(conn)
+        boundary = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+        for table in BUCKETS:
+            if table not in existing:
+                conn.execute("INSERT OR REPLACE INTO rollup_state (name, boundary_id, position_id) VALUES (?, ?, 0)", (table, boundary))
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    if backfill_remaining(conn) <= BACKFILL_INLINE:
+        backfill(conn, pause=0)
+ 
+ 
+def rebuild_accounts(conn):
+    conn.execute("DELETE FROM rollup_accounts")
+    conn.execute('''
+    INSERT INTO rollup_accounts (account_type, status, currency, accounts, balance)
+    SELECT account_type, COALESCE(status, 'active'), currency, COUNT(*), COALESCE(SUM(balance), 0)
+    FROM accounts GROUP BY account_type, COALESCE(status, 'active'), currency
+    ''')
+ 
+ 
+def backfill_remaining(conn):
+    """Transaction ids the backfill still has to go through"""
+    return conn.execute("SELECT COALESCE(SUM(boundary_id - position_id), 0) FROM rollup_state").fetchone()[0]
+ 
+ 
+def backfill(conn, chunk=BACKFILL_CHUNK, pause=BACKFILL_PAUSE, progress=None):
+    """Count the transactions that predate the volume rollups, a range of ids at a time
+     
+    Each range is aggregated and added in one short write transaction
+    that also records how far the backfill got, so postings are only held
+    up briefly and an interrupted backfill resumes where it stopped.
+    Returns the number of steps taken.
+    """
+    steps = 0
+    for table, (key, length) in BUCKETS.items():
+        while True:
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT boundary_id, position_id FROM rollup_state WHERE name = ?", (table,)).fetchone()
+                if row is None or row[1] >= row[0]:
+                    conn.rollback()
+                    break
+                boundary, position = row
+                end = min(position + chunk, boundary)
+                conn.execute(f'''
+                INSERT INTO {table} ({key}, account_type, currency, transactions, credits, debits)
+                SELECT substr(t.transaction_date, 1, {length}), COALESCE(a.account_type, ''), COALESCE(a.currency, '{BASE}'), COUNT(*),
+                       SUM(CASE WHEN t.transaction_type IN {CREDIT_TYPES} THEN t.amount ELSE 0 END),
+                       SUM(CASE WHEN t.transaction_type IN {CREDIT_TYPES} THEN 0 ELSE t.amount END)
+                FROM transactions t LEFT JOIN accounts a ON a.id = t.account_id
+                WHERE t.id > ? AND t.id <= ? AND COALESCE(t.status, 'completed') = 'completed'
+                GROUP BY 1, 2, 3
+                ON CONFLICT DO UPDATE SET transactions = transactions + excluded.transactions,
+                    credits = credits + excluded.credits, debits = debits + excluded.debits
+                ''', (position, end))
+                conn.execute("UPDATE rollup_state SET position_id = ? WHERE name = ?", (end, table))
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            steps += 1
+            if progress:
+                progress(table, end, boundary)
+            if pause:
+                time.sleep(max(pause, time.perf_counter() - started))
+    return steps
+ 
+ 
+def rebuild(conn):
+    """Recompute every rollup from the base tables in one transaction
+     
+    Only needed to clear the rounding drift of many incremental balance
+    updates, or after editing the ledger by hand; it holds the write lock
+    throughout, unlike backfill(). Buckets of months that were moved to
+    the archive (see archive.py) keep their rows, since their
+    transactions are no longer here to recount.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rebuild_accounts(conn)
+        boundary = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+        for table, (key, length) in BUCKETS.items():
+            conn.execute(f"DELETE FROM {table} WHERE substr({key}, 1, 7) NOT IN (SELECT month FROM archive_months)")
+            conn.execute(f'''
+            INSERT INTO {table} ({key}, account_type, currency, transactions, credits, debits)
+            SELECT substr(t.transaction_date, 1, {length}), COALESCE(a.account_type, ''), COALESCE(a.currency, '{BASE}'), COUNT(*),
+                   SUM(CASE WHEN t.transaction_type IN {CREDIT_TYPES} THEN t.amount ELSE 0 END),
+                   SUM(CASE WHEN t.transaction_type IN {CREDIT_TYPES} THEN 0 ELSE t.amount END)
+            FROM transactions t LEFT JOIN accounts a ON a.id = t.account_id
+            WHERE COALESCE(t.status, 'completed') = 'completed'
+              AND substr(t.transaction_date, 1, 7) NOT IN (SELECT month FROM archive_months)
+            GROUP BY 1, 2, 3
+            ''')
+            conn.execute("INSERT OR REPLACE INTO rollup_state (name, boundary_id, position_id) VALUES (?, ?, ?)", (table, boundary, boundary))
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+ 
+ 
+def volume(conn, by='day', since=None, until=None, account_type=None, fx=None):
+    """Transaction volume per day or hour from the rollups, oldest first
+     
+    ``since``/``until`` are inclusive and may be dates or timestamps
+    ('2024-05-01', '2024-05-01 13:00:00'); they are cut to the bucket.
+    Without an account_type the types are summed and come back as None.
+    Amounts are converted to the base currency with ``fx`` (fx.FXRates;
+    by default the newest rates in conn's database) before they are summed.
+    """
+    table = 'rollup_daily' if by == 'day' else 'rollup_hourly'
+    key, length = BUCKETS[table]
+    conditions, params = [], []
+    if since is not None:
+        conditions.append(f"{key} >= ?")
+        params.append(since[:length])
+    if until is not None:
+        conditions.append(f"{key} <= ?")
+        params.append(until[:length])
+    if account_type is not None:
+        conditions.append("account_type = ?")
+        params.append(account_type)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    if account_type is None:
+        query = f"SELECT {key}, NULL, currency, SUM(transactions), SUM(credits), SUM(debits) FROM {table}{where} GROUP BY {key}, currency ORDER BY {key}"
+    else:
+        query = f"SELECT {key}, account_type, currency, transactions, credits, debits FROM {table}{where} ORDER BY {key}"
+    if fx is None:
+        fx = FXRates().load(conn)
+    # One row per bucket and currency, folded into one bucket in the base currency
+    buckets = {}
+    for bucket, bucket_type, currency, transactions, credits, debits in conn.execute(query, params):
+        credits, debits = fx.to_base(credits, currency), fx.to_base(debits, currency)
+        previous = buckets.get(bucket)
+        if previous is None:
+            buckets[bucket] = VolumeBucket(bucket, bucket_type, transactions, credits, debits)
+        else:
+            buckets[bucket] = previous._replace(transactions=previous.transactions + transactions,
+                                                credits=previous.credits + credits, debits=previous.debits + debits)
+    return list(buckets.values())
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Maintain and query the transaction volume rollups")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("backfill", help="Count the transactions that predate the rollups")
+    fill.add_argument("--chunk", type=int, default=BACKFILL_CHUNK, help="Transaction ids per step")
+    fill.add_argument("--pause", type=float, default=BACKFILL_PAUSE, help="Minimum seconds between steps, so postings get the lock")
+    commands.add_parser("rebuild", help="Recompute all rollups in one go (blocks postings meanwhile)")
+    report = commands.add_parser("report", help="Print volume per day or hour")
+    report.add_argument("--by", choices=("day", "hour"), default="day")
+    report.add_argument("--since", default=None)
+    report.add_argument("--until", default=None)
+    report.add_argument("--type", default=None, help="Only this account type")
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    database.create_schema(conn)
+    start = time.perf_counter()
+    if args.command == "backfill":
+        steps = backfill(conn, args.chunk, args.pause,
+                         progress=lambda table, position, boundary: print(f"\r{table}: {position}/{boundary}", end="", flush=True))
+        print(f"\n{steps} steps in {time.perf_counter() - start:.2f}s")
+    elif args.command == "rebuild":
+        rebuild(conn)
+        print(f"Rebuilt in {time.perf_counter() - start:.2f}s")
+    else:
+        rows = volume(conn, args.by, args.since, args.until, args.type)
+        for row in rows:
+            print(f"{row.bucket:<14} {row.account_type or '':<12} {row.transactions:>8} in {row.credits:>14,.2f} out {row.debits:>14,.2f}")
+        print(f"({len(rows)} rows, {(time.perf_counter() - start) * 1000:.1f} ms)")
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
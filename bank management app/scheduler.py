@@ -0,0 +1,300 @@
+import argparse
+import calendar
+import datetime
+import heapq
+import sys
+import threading
+import time
+ 
+import database
+import timeutil
+from events import POSTING
+from fraud import FraudRules
+from fx import FXRates
+from ledger import Ledger, LedgerError, check_amount
+from models import StandingOrder
+from writer import PostingWriter
+ 
+INTERVALS = ('daily', 'weekly', 'monthly')
+ 
+# Orders executed per writer job; other postings get the writer between jobs
+BATCH = 500
+# Missed runs older than this are skipped instead of paid late
+CATCH_UP = 7 * 24 * 3600 * timeutil.MICROS
+# Consecutive refused runs (insufficient funds, closed account) before an order stops
+MAX_FAILURES = 3
+# How often the scheduler looks for orders created by other processes, in seconds
+RELOAD_INTERVAL = 60
+ 
+ 
+def occurrence(first_run, interval, index):
+    """Time of run number ``index`` (0 is the first) of an order, in epoch microseconds
+     
+    Computed from the first run each time, on local wall-clock time, so
+    runs keep their time of day across DST changes and a monthly order
+    started on the 31st pays on the last day of shorter months without
+    drifting to the 28th afterwards.
+    """
+    start = timeutil.to_datetime(first_run)
+    if interval == 'daily':
+        when = start + datetime.timedelta(days=index)
+    elif interval == 'weekly':
+        when = start + datetime.timedelta(weeks=index)
+    else:
+        months = start.month - 1 + index
+        year, month = start.year + months // 12, months % 12 + 1
+        when = start.replace(year=year, month=month, day=min(start.day, calendar.monthrange(year, month)[1]))
+    return timeutil.from_datetime(when)
+ 
+ 
+def create_order(ledger, user_id, from_id, to_id, amount, interval, description=None, first_run=None, end_time=None, conn=None):
+    """Store a standing order; the first transfer happens at ``first_run`` (default: now)"""
+    check_amount(amount)
+    if interval not in INTERVALS:
+        raise LedgerError(f"Interval must be one of {', '.join(INTERVALS)}")
+    if int(from_id) == int(to_id):
+        raise LedgerError("Cannot transfer to the same account")
+    first_run = first_run or timeutil.now()
+    with ledger.transaction(conn) as cursor:
+        source = ledger.get_account(from_id, user_id, conn=conn)
+        target = ledger.get_account(to_id, conn=conn)
+        if source is None or target is None:
+            raise LedgerError("Account not found")
+        if source.status != 'active' or target.status != 'active':
+            raise LedgerError("Account is not active")
+        cursor.execute('''
+        INSERT INTO standing_orders (user_id, from_account, to_account, amount, description, interval,
+                                     first_run, next_run, occurrences, end_time, status, failures, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, 'active', 0, ?)
+        ''', (user_id, from_id, to_id, amount, description or f"Standing order ({interval})", interval,
+              first_run, first_run, end_time, timeutil.now()))
+        cursor.row_factory = database.row_factory(StandingOrder)
+        return cursor.execute("SELECT * FROM standing_orders WHERE id = ?", (cursor.lastrowid,)).fetchone()
+ 
+ 
+def cancel_order(order_id, user_id=None, conn=None):
+    """Stop an active order; returns False if there is no such order of the user"""
+    cursor = conn.execute("UPDATE standing_orders SET status = 'cancelled' WHERE id = ? AND (? IS NULL OR user_id = ?) AND status = 'active'",
+                          (order_id, user_id, user_id))
+    return cursor.rowcount > 0
+ 
+ 
+def list_orders(conn, user_id=None):
+    """Standing orders of a user (or everyone), soonest first"""
+    cursor = database.model_cursor(conn, StandingOrder)
+    cursor.execute("SELECT * FROM standing_orders WHERE ? IS NULL OR user_id = ? ORDER BY status != 'active', next_run",
+                   (user_id, user_id))
+    return cursor.fetchall()
+ 
+ 
+def run_orders(ledger, order_ids, now, conn=None):
+    """Run the given orders that are due at ``now``; returns (posting results, [(next_run, id)] still active)
+     
+    Every order runs in its own savepoint together with the update of its
+    schedule, so a transfer is never paid without its run being recorded,
+    and an order already run by another process is simply skipped. A
+    refused transfer counts as a failed run; the order moves on to its
+    next run either way.
+    """
+    results = []
+    upcoming = []
+    for order_id in order_ids:
+        with ledger.transaction(conn) as cursor:
+            cursor.row_factory = database.row_factory(StandingOrder)
+            order = cursor.execute("SELECT * FROM standing_orders WHERE id = ?", (order_id,)).fetchone()
+            if order is None or order.status != 'active':
+                continue
+            if order.next_run > now:
+                upcoming.append((order.next_run, order.id))
+                continue
+            try:
+                result = ledger.transfer(order.from_account, order.to_account, order.amount, order.description,
+                                         user_id=order.user_id, conn=conn)
+                results.append(result)
+                failures, last_result = 0, result.reference_number
+            except LedgerError as e:
+                failures, last_result = order.failures + 1, str(e)
+             
+            # Advance past the run just made, and past runs too old to catch up on
+            occurrences = order.occurrences + 1
+            next_run = occurrence(order.first_run, order.interval, occurrences)
+            while next_run < now - CATCH_UP:
+                occurrences += 1
+                next_run = occurrence(order.first_run, order.interval, occurrences)
+            if failures >= MAX_FAILURES:
+                status = 'failed'
+            elif order.end_time is not None and next_run > order.end_time:
+                status = 'finished'
+            else:
+                status = 'active'
+                upcoming.append((next_run, order.id))
+            cursor.execute('''
+            UPDATE standing_orders SET occurrences = ?, next_run = ?, failures = ?, status = ?, last_run = ?, last_result = ?
+            WHERE id = ?
+            ''', (occurrences, next_run, failures, status, now, last_result, order.id))
+    return results, upcoming
+ 
+ 
+class Scheduler:
+    """Runs standing orders when they fall due
+     
+    Due times sit in a heap of (next_run, order id), so finding the due
+    orders costs O(log n) per order rather than a table scan, and the
+    thread sleeps until the earliest one. Due orders are handed to the
+    posting writer ``batch`` at a time (see run_orders). After downtime
+    every missed run within CATCH_UP is paid, oldest first, one run per
+    order per pass. Orders created in this process are added with add();
+    those created by other processes are picked up every RELOAD_INTERVAL
+    seconds. Committed transfers are published on ``events``.
+    """
+     
+    def __init__(self, ledger, writer, path=None, batch=BATCH, events=None):
+        self.ledger = ledger
+        self.writer = writer
+        self.path = path
+        self.batch = batch
+        self.events = events
+        self.heap = []
+        # Current due time per order; heap entries that don't match are stale and skipped
+        self.scheduled = {}
+        self.last_id = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = {'runs': 0, 'batches': 0}
+     
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.load()
+            self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self.thread.start()
+        return self
+     
+    def stop(self, timeout=None):
+        if self.thread is not None:
+            self.stopped.set()
+            self.wake.set()
+            self.thread.join(timeout)
+            self.thread = None
+     
+    def load(self):
+        """Add the active orders created since the last load"""
+        conn = database.connect(self.path, readonly=True)
+        try:
+            rows = conn.execute("SELECT id, next_run FROM standing_orders WHERE id > ? AND status = 'active' ORDER BY id",
+                                (self.last_id,)).fetchall()
+        finally:
+            conn.close()
+        for order_id, next_run in rows:
+            self.add(order_id, next_run)
+            self.last_id = max(self.last_id, order_id)
+     
+    def add(self, order_id, next_run):
+        """Schedule (or reschedule) an order and wake the thread if it is now the earliest"""
+        with self.lock:
+            self.scheduled[order_id] = next_run
+            heapq.heappush(self.heap, (next_run, order_id))
+            earliest = self.heap[0][1] == order_id
+        if earliest:
+            self.wake.set()
+     
+    def create(self, user_id, from_id, to_id, amount, interval, description=None, first_run=None, end_time=None):
+        """Store a new order through the writer and schedule it"""
+        order = self.writer.call(create_order, self.ledger, user_id, from_id, to_id, amount, interval, description, first_run, end_time)
+        self.add(order.id, order.next_run)
+        return order
+     
+    def due(self, now):
+        """Pop up to ``batch`` orders due at ``now``"""
+        orders = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now and len(orders) < self.batch:
+                next_run, order_id = heapq.heappop(self.heap)
+                if self.scheduled.get(order_id) == next_run:
+                    del self.scheduled[order_id]
+                    orders.append(order_id)
+        return orders
+     
+    def run_pending(self, now=None):
+        """Run every order due now, a batch at a time; returns the number of transfers made"""
+        made = 0
+        while not self.stopped.is_set():
+            now = now or timeutil.now()
+            orders = self.due(now)
+            if not orders:
+                break
+            try:
+                results, upcoming = self.writer.call(run_orders, self.ledger, orders, now)
+            except Exception:
+                # Put them back for the next pass
+                for order_id in orders:
+                    self.add(order_id, now)
+                raise
+            for next_run, order_id in upcoming:
+                self.add(order_id, next_run)
+            if self.events is not None:
+                for result in results:
+                    self.events.publish(POSTING, result)
+            made += len(results)
+            self.stats['runs'] += len(orders)
+            self.stats['batches'] += 1
+            now = None
+        return made
+     
+    def _run(self):
+        last_load = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                self.run_pending()
+                if time.monotonic() - last_load >= RELOAD_INTERVAL:
+                    self.load()
+                    last_load = time.monotonic()
+            except Exception as e:
+                print(f"Scheduler: {e}", file=sys.stderr)
+                self.stopped.wait(1)
+            with self.lock:
+                delay = (self.heap[0][0] - timeutil.now()) / timeutil.MICROS if self.heap else RELOAD_INTERVAL
+            self.wake.wait(min(max(delay, 0), RELOAD_INTERVAL))
+            self.wake.clear()
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Standing orders: list them, or run the due ones once")
+    parser.add_argument("--db", default=None, help="Database file (default: BANK_DB_PATH or bank_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("list", help="Print standing orders")
+    show.add_argument("--user", type=int, default=None)
+    commands.add_parser("run", help="Pay every due order now and exit (e.g. from cron)")
+    cancel = commands.add_parser("cancel", help="Cancel an order")
+    cancel.add_argument("order_id", type=int)
+    args = parser.parse_args()
+     
+    conn = database.connect(args.db)
+    database.create_schema(conn)
+    if args.command == "list":
+        for order in list_orders(conn, args.user):
+            print(f"{order.id:>6} user {order.user_id:<6} {order.from_account} -> {order.to_account} ${order.amount:,.2f} "
+                  f"{order.interval:<8} {order.status:<9} next {timeutil.format_time(order.next_run)} {order.last_result or ''}")
+    elif args.command == "cancel":
+        if not cancel_order(args.order_id, conn=conn):
+            parser.error(f"No active order {args.order_id}")
+        conn.commit()
+        print(f"Order {args.order_id} cancelled")
+    else:
+        # Same ledger as the app and the bank CLI: transfers between currencies and the velocity limits
+        fx = FXRates(args.db).load(conn)
+        ledger = Ledger(args.db, rules=FraudRules(args.db, fx).load(conn), fx=fx)
+        writer = PostingWriter(args.db).start()
+        scheduler = Scheduler(ledger, writer, args.db)
+        scheduler.load()
+        start = time.perf_counter()
+        made = scheduler.run_pending()
+        writer.stop()
+        print(f"{scheduler.stats['runs']} orders run, {made} transfers made in {time.perf_counter() - start:.2f}s")
+    conn.close()
+ 
+ 
+if __name__ == "__main__":
+    main()
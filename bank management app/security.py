@@ -0,0 +1,219 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import time
+ 
+# Length of the hex digests written by the original unsalted SHA-256 scheme
+LEGACY_HASH_LENGTH = 64
+ 
+ 
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+ 
+ 
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+ 
+ 
+class PasswordHasher:
+    """Base class for salted password hashers
+     
+    Encoded hashes look like ``algorithm$params$salt$hash`` so the cost
+    parameters travel with every stored password and can be raised later.
+    """
+     
+    algorithm = None
+    salt_size = 16
+     
+    def params(self):
+        """Return the cost parameters as a dictionary of integers"""
+        raise NotImplementedError
+     
+    def derive(self, password, salt, params):
+        """Derive the raw key for a password, salt and parameter set"""
+        raise NotImplementedError
+     
+    def encode(self, password, salt=None):
+        """Hash a password with a fresh random salt"""
+        salt = salt or os.urandom(self.salt_size)
+        params = self.params()
+        key = self.derive(password, salt, params)
+        param_string = ",".join(f"{name}={value}" for name, value in params.items())
+        return f"{self.algorithm}${param_string}${_b64encode(salt)}${_b64encode(key)}"
+     
+    def verify(self, password, encoded):
+        """Check a password against an encoded hash from this hasher"""
+        algorithm, params, salt, key = split_encoded(encoded)
+        if algorithm != self.algorithm:
+            return False
+        derived = self.derive(password, salt, params)
+        return hmac.compare_digest(derived, key)
+     
+    def needs_update(self, encoded):
+        """Return True if the hash was made with other settings than ours"""
+        algorithm, params, _, _ = split_encoded(encoded)
+        return algorithm != self.algorithm or params != self.params()
+ 
+ 
+class ScryptHasher(PasswordHasher):
+    """Memory-hard hasher built on hashlib.scrypt"""
+     
+    algorithm = "scrypt"
+     
+    def __init__(self, n=2 ** 14, r=8, p=1, dklen=32):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.dklen = dklen
+     
+    def params(self):
+        return {"n": self.n, "r": self.r, "p": self.p}
+     
+    def derive(self, password, salt, params):
+        n, r, p = params["n"], params["r"], params["p"]
+        # OpenSSL refuses anything above 32 MiB unless maxmem is raised
+        maxmem = 2 * 128 * r * (n + p) + 1024 * 1024
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=self.dklen)
+ 
+ 
+class PBKDF2Hasher(PasswordHasher):
+    """PBKDF2-HMAC-SHA256 hasher, used where scrypt is unavailable"""
+     
+    algorithm = "pbkdf2_sha256"
+     
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+     
+    def params(self):
+        return {"i": self.iterations}
+     
+    def derive(self, password, salt, params):
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params["i"])
+ 
+ 
+def split_encoded(encoded):
+    """Split an encoded hash into (algorithm, params, salt, key)"""
+    try:
+        algorithm, param_string, salt, key = encoded.split("$")
+        params = {}
+        for item in param_string.split(","):
+            name, value = item.split("=")
+            params[name] = int(value)
+        return algorithm, params, _b64decode(salt), _b64decode(key)
+    except ValueError:
+        return None, {}, b"", b""
+ 
+ 
+def is_legacy_hash(encoded):
+    """Return True for hashes written by the old unsalted SHA-256 scheme"""
+    return len(encoded) == LEGACY_HASH_LENGTH and "$" not in encoded
+ 
+ 
+HASHERS = {
+    ScryptHasher.algorithm: ScryptHasher(),
+    PBKDF2Hasher.algorithm: PBKDF2Hasher(),
+}
+ 
+# Prefer scrypt, but some OpenSSL builds ship without it
+DEFAULT_ALGORITHM = ScryptHasher.algorithm if hasattr(hashlib, "scrypt") else PBKDF2Hasher.algorithm
+ 
+ 
+def get_hasher(algorithm=None):
+    """Return the hasher for an algorithm name (the default one if omitted)"""
+    return HASHERS[algorithm or DEFAULT_ALGORITHM]
+ 
+ 
+def hash_password(password):
+    """Hash a password with the default hasher"""
+    return get_hasher().encode(password)
+ 
+ 
+def verify_password(password, encoded):
+    """Check a password against a stored hash
+     
+    Returns a tuple (valid, replacement). ``replacement`` is a freshly
+    encoded hash when the stored one is legacy SHA-256 or uses outdated
+    parameters, so callers can upgrade it transparently after login.
+    """
+    if not encoded:
+        return False, None
+     
+    if is_legacy_hash(encoded):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        if hmac.compare_digest(legacy, encoded):
+            return True, hash_password(password)
+        return False, None
+     
+    algorithm = split_encoded(encoded)[0]
+    hasher = HASHERS.get(algorithm)
+    if hasher is None or not hasher.verify(password, encoded):
+        return False, None
+     
+    if get_hasher().algorithm != algorithm or hasher.needs_update(encoded):
+        return True, hash_password(password)
+    return True, None
+ 
+ 
+# Verified against when a username does not exist, so unknown users take
+# as long to reject as a wrong password does
+DUMMY_HASH = None
+ 
+ 
+def verify_unknown_user(password):
+    """Spend the same effort as a real verification and always fail"""
+    global DUMMY_HASH
+    if DUMMY_HASH is None:
+        DUMMY_HASH = hash_password("dummy-password")
+    verify_password(password, DUMMY_HASH)
+    return False, None
+ 
+ 
+def benchmark(target_ms=250, rounds=3):
+    """Time the available hashers to pick cost parameters for this machine
+     
+    Returns a list of result dictionaries. The strongest setting of each
+    algorithm that stays under ``target_ms`` is marked as recommended.
+    """
+    candidates = []
+    if hasattr(hashlib, "scrypt"):
+        candidates += [ScryptHasher(n=2 ** exp) for exp in range(12, 18)]
+    candidates += [PBKDF2Hasher(iterations=count) for count in (100000, 200000, 400000, 600000, 1000000)]
+     
+    results = []
+    for hasher in candidates:
+        encoded = hasher.encode("benchmark-password")
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            hasher.verify("benchmark-password", encoded)
+            timings.append((time.perf_counter() - start) * 1000)
+        results.append({
+            "algorithm": hasher.algorithm,
+            "params": hasher.params(),
+            "ms": min(timings),
+            "recommended": False,
+        })
+     
+    for algorithm in {result["algorithm"] for result in results}:
+        fitting = [r for r in results if r["algorithm"] == algorithm and r["ms"] <= target_ms]
+        if fitting:
+            fitting[-1]["recommended"] = True
+    return results
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark password hashing cost parameters")
+    parser.add_argument("--target-ms", type=float, default=250, help="Acceptable time per login verification")
+    parser.add_argument("--rounds", type=int, default=3, help="Measurements per setting (fastest is kept)")
+    args = parser.parse_args()
+     
+    for result in benchmark(args.target_ms, args.rounds):
+        params = ",".join(f"{name}={value}" for name, value in result["params"].items())
+        marker = "  <- recommended" if result["recommended"] else ""
+        print(f"{result['algorithm']:<15} {params:<20} {result['ms']:8.1f} ms{marker}")
+ 
+ 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+ 
+from cache import LRUCache
+ 
+# Idle time after which a session has to log in again (seconds)
+SESSION_TTL = 15 * 60
+ 
+# Identifies this branch terminal for per-terminal login throttling
+TERMINAL_ID = socket.gethostname()
+ 
+ 
+class Session:
+    """A logged-in user and the token that identifies them"""
+     
+    __slots__ = ('token', 'user', 'created', 'expires')
+     
+    def __init__(self, token, user, created, expires):
+        self.token = token
+        self.user = user
+        self.created = created
+        self.expires = expires
+ 
+ 
+class SessionManager:
+    """Issues session tokens and expires them after a period of inactivity"""
+     
+    def __init__(self, ttl=SESSION_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.sessions = {}
+        self.lock = threading.Lock()
+     
+    def create(self, user):
+        """Start a new session for a user and return it"""
+        now = self.clock()
+        session = Session(secrets.token_urlsafe(32), user, now, now + self.ttl)
+        with self.lock:
+            self.sessions[session.token] = session
+        return session
+     
+    def get(self, token):
+        """Return the live session for a token, or None if unknown or expired"""
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if session.expires <= self.clock():
+                del self.sessions[token]
+                return None
+            return session
+     
+    def touch(self, token):
+        """Extend a session after user activity; returns False if it has expired"""
+        session = self.get(token)
+        if session is None:
+            return False
+        session.expires = self.clock() + self.ttl
+        return True
+     
+    def revoke(self, token):
+        """End a session (logout)"""
+        with self.lock:
+            self.sessions.pop(token, None)
+     
+    def purge_expired(self):
+        """Drop every expired session and return how many were removed"""
+        now = self.clock()
+        with self.lock:
+            expired = [token for token, session in self.sessions.items() if session.expires <= now]
+            for token in expired:
+                del self.sessions[token]
+        return len(expired)
+ 
+ 
+class LoginThrottle:
+    """Sliding-window counter of failed logins per username and per terminal
+     
+    Only the most recent ``limit`` failure times are kept per key, so a key
+    is blocked while its oldest remembered failure is still inside the
+    window. Keys live in an LRU so a storm of random usernames cannot grow
+    memory without bound.
+    """
+     
+    def __init__(self, max_per_user=5, max_per_terminal=20, window=300, max_keys=10000, clock=time.monotonic):
+        self.max_per_user = max_per_user
+        self.max_per_terminal = max_per_terminal
+        self.window = window
+        self.clock = clock
+        self.users = LRUCache(max_keys)
+        self.terminals = LRUCache(max_keys)
+        self.lock = threading.Lock()
+     
+    def _retry_after(self, failures, limit, now):
+        if failures is None or len(failures) < limit:
+            return 0
+        return max(0, failures[0] + self.window - now)
+     
+    def retry_after(self, username, terminal=TERMINAL_ID):
+        """Return how many seconds to wait before another attempt (0 if allowed)"""
+        now = self.clock()
+        with self.lock:
+            return max(
+                self._retry_after(self.users.get(username.lower()), self.max_per_user, now),
+                self._retry_after(self.terminals.get(terminal), self.max_per_terminal, now)
+            )
+     
+    def record_failure(self, username, terminal=TERMINAL_ID):
+        """Remember a failed attempt for the username and the terminal"""
+        now = self.clock()
+        with self.lock:
+            for cache, key, limit in ((self.users, username.lower(), self.max_per_user),
+                                      (self.terminals, terminal, self.max_per_terminal)):
+                failures = cache.get(key)
+                if failures is None:
+                    failures = deque(maxlen=limit)
+                    cache.put(key, failures)
+                failures.append(now)
+     
+    def reset(self, username):
+        """Forget the failures of a username after a successful login"""
+        self.users.pop(username.lower())
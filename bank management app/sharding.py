@@ -0,0 +1,435 @@
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+ 
+import database
+import timeutil
+from fraud import FraudRules
+from fx import FXRates, create_tables as create_fx_tables
+from ledger import Ledger, LedgerError, PostingResult, check_amount, new_reference, timestamp, verify_login
+from models import User
+from writer import PostingWriter
+ 
+# Virtual nodes per shard on the hash ring; more nodes spread users more evenly
+VNODES = 64
+ 
+ 
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+ 
+ 
+class ShardRouter:
+    """Consistent-hash ring mapping a user id to a shard index
+     
+    Each shard is placed on the ring ``vnodes`` times under its name, so
+    adding a shard only moves the users that land on its new points
+    (about 1/N of them) instead of reshuffling everyone.
+    """
+     
+    def __init__(self, names, vnodes=VNODES):
+        self.names = list(names)
+        points = sorted((ring_hash(f"{name}#{replica}"), index)
+                        for index, name in enumerate(self.names) for replica in range(vnodes))
+        self.hashes = [point for point, _ in points]
+        self.shards = [index for _, index in points]
+     
+    def route(self, user_id):
+        position = bisect.bisect(self.hashes, ring_hash(user_id)) % len(self.hashes)
+        return self.shards[position]
+ 
+ 
+def create_directory_schema(conn):
+    """Global tables kept next to the shards: id allocation, routing lookups and the transfer log"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_directory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS account_directory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL
+    )
+    ''')
+    # Coordinator log of cross-shard transfers: preparing -> committed/aborted -> done
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transfer_log (
+        reference_number TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        from_account INTEGER NOT NULL,
+        to_account INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        user_id INTEGER,
+        idempotency_key TEXT,
+        result TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transfer_log_open ON transfer_log (state) WHERE state != 'done'")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_transfer_log_key ON transfer_log (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    conn.commit()
+    # Exchange rates are bank-wide, so they are loaded here rather than per shard
+    create_fx_tables(conn)
+ 
+ 
+def shard_paths(directory, count):
+    """File names of a sharded layout: shard0.db ... shard<N-1>.db plus directory.db"""
+    return [os.path.join(directory, f"shard{index}.db") for index in range(count)], os.path.join(directory, "directory.db")
+ 
+ 
+class Shard:
+    """One database file with its own ledger, posting writer and reader connections"""
+     
+    def __init__(self, index, path, fx=None):
+        self.index = index
+        self.path = path
+        self.ledger = Ledger(path, rules=FraudRules(path, fx), fx=fx)
+        self.writer = PostingWriter(path)
+        self.local = threading.local()
+     
+    def reader(self):
+        """Read-only connection for the calling thread"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = database.connect(self.path, readonly=True)
+        return conn
+ 
+ 
+class ShardedLedger:
+    """Ledger API over N database files, routed by user
+     
+    A user's row, accounts and transactions all live on the shard the
+    router picks for the user id, so every user-facing query touches one
+    file and postings on different shards commit in parallel, each shard
+    having its own writer. User and account ids come from the directory
+    database, which also routes an account id to its owner and logs
+    cross-shard transfers. Methods take (and ignore) ``conn`` so the
+    class can stand in for Ledger.
+    """
+     
+    def __init__(self, paths, directory_path):
+        # One rate cache for every shard, reading the directory database
+        self.fx = FXRates(directory_path)
+        self.shards = [Shard(index, path, self.fx) for index, path in enumerate(paths)]
+        self.router = ShardRouter(os.path.basename(path) for path in paths)
+        self.directory_path = directory_path
+        self.directory = PostingWriter(directory_path)
+        self.local = threading.local()
+        self.fan_out_pool = ThreadPoolExecutor(len(self.shards), thread_name_prefix="fan-out")
+         
+        for shard in self.shards:
+            conn = database.connect(shard.path)
+            database.create_schema(conn)
+            conn.close()
+        conn = database.connect(directory_path)
+        create_directory_schema(conn)
+        conn.close()
+     
+    def start(self):
+        for shard in self.shards:
+            shard.ledger.rules.load()
+            shard.writer.start()
+        self.directory.start()
+        self.recover()
+        return self
+     
+    def stop(self):
+        for shard in self.shards:
+            shard.writer.stop()
+        self.directory.stop()
+        self.fan_out_pool.shutdown()
+     
+    # Routing
+     
+    def directory_reader(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = database.connect(self.directory_path, readonly=True)
+        return conn
+     
+    def shard_for_user(self, user_id):
+        return self.shards[self.router.route(user_id)]
+     
+    def owner_of(self, account_id):
+        """User id owning an account, from the directory"""
+        row = self.directory_reader().execute("SELECT user_id FROM account_directory WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            raise LedgerError("Account not found")
+        return row[0]
+     
+    def shard_for_account(self, account_id):
+        return self.shard_for_user(self.owner_of(account_id))
+     
+    # Users
+     
+    def register_user(self, username, password, full_name, email, phone=None, address=None, registration_date=None):
+        """Reserve a global user id, then store the user on its shard; returns the id"""
+        def reserve(conn):
+            try:
+                cursor = conn.execute("INSERT INTO user_directory (username, email) VALUES (?, ?)", (username, email))
+            except sqlite3.IntegrityError:
+                raise LedgerError("Username or email already exists")
+            return cursor.lastrowid
+         
+        user_id = self.directory.call(reserve)
+        registered = timeutil.from_local_text(registration_date) if registration_date else timeutil.now()
+         
+        def store(conn):
+            conn.execute('''
+            INSERT INTO users (id, username, password, full_name, email, phone, address, registration_date, registration_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, username, password, full_name, email, phone, address, registration_date or timestamp(registered), registered))
+         
+        self.shard_for_user(user_id).writer.call(store)
+        return user_id
+     
+    def find_user_id(self, username):
+        row = self.directory_reader().execute("SELECT id FROM user_directory WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+     
+    def get_user(self, username, conn=None):
+        user_id = self.find_user_id(username)
+        if user_id is None:
+            return None
+        shard = self.shard_for_user(user_id)
+        return shard.ledger.get_user(username, conn=shard.reader())
+     
+    def authenticate(self, username, password, conn=None):
+        return verify_login(self.get_user(username), password)
+     
+    def rehash_password(self, user, replacement, conn=None):
+        shard = self.shard_for_user(user.id)
+        return shard.writer.call(shard.ledger.rehash_password, user, replacement)
+     
+    # Queries, each on a single shard
+     
+    def get_account(self, account_id, user_id=None, conn=None):
+        try:
+            shard = self.shard_for_account(account_id)
+        except LedgerError:
+            return None
+        return shard.ledger.get_account(account_id, user_id, conn=shard.reader())
+     
+    def get_accounts(self, user_id, conn=None):
+        shard = self.shard_for_user(user_id)
+        return shard.ledger.get_accounts(user_id, conn=shard.reader())
+     
+    def history(self, user_id, account_id=None, limit=50, before_id=None, after_id=None, conn=None, since=None, until=None):
+        """Transactions of one user; ids are per shard, but all of a user's rows share one shard"""
+        shard = self.shard_for_user(user_id)
+        return shard.ledger.history(user_id, account_id, limit, before_id, after_id, conn=shard.reader(), since=since, until=until)
+     
+    def get_transaction(self, transaction_id, user_id=None, conn=None):
+        if user_id is None:
+            raise LedgerError("Transaction ids are only unique per user in sharded mode")
+        shard = self.shard_for_user(user_id)
+        return shard.ledger.get_transaction(transaction_id, user_id, conn=shard.reader())
+     
+    # Postings
+     
+    def open_account(self, user_id, account_type, initial_deposit, idempotency_key=None, conn=None, currency=None):
+        account_id = self.directory.call(
+            lambda conn: conn.execute("INSERT INTO account_directory (user_id) VALUES (?)", (user_id,)).lastrowid)
+        shard = self.shard_for_user(user_id)
+        return shard.writer.call(shard.ledger.open_account, user_id, account_type, initial_deposit,
+                                 idempotency_key=idempotency_key, account_id=account_id, currency=currency)
+     
+    def deposit(self, account_id, amount, description=None, user_id=None, idempotency_key=None, conn=None):
+        shard = self.shard_for_account(account_id)
+        return shard.writer.call(shard.ledger.deposit, account_id, amount, description, user_id=user_id,
+                                 idempotency_key=idempotency_key)
+     
+    def withdraw(self, account_id, amount, description=None, user_id=None, idempotency_key=None, conn=None):
+        shard = self.shard_for_account(account_id)
+        return shard.writer.call(shard.ledger.withdraw, account_id, amount, description, user_id=user_id,
+                                 idempotency_key=idempotency_key)
+     
+    def close_account(self, account_id, user_id=None, conn=None):
+        shard = self.shard_for_account(account_id)
+        return shard.writer.call(shard.ledger.close_account, account_id, user_id=user_id)
+     
+    def purge_idempotency_keys(self, max_age=None, conn=None):
+        kwargs = {} if max_age is None else {"max_age": max_age}
+        return sum(shard.writer.call(shard.ledger.purge_idempotency_keys, **kwargs) for shard in self.shards)
+     
+    def transfer(self, from_id, to_id, amount, description=None, user_id=None, idempotency_key=None, conn=None):
+        """Transfer on one shard directly, or across shards with two-phase commit"""
+        check_amount(amount)
+        from_id, to_id = int(from_id), int(to_id)
+        if from_id == to_id:
+            raise LedgerError("Cannot transfer to the same account")
+        source = self.shard_for_account(from_id)
+        target = self.shard_for_account(to_id)
+        if source is target:
+            return source.writer.call(source.ledger.transfer, from_id, to_id, amount, description, user_id=user_id,
+                                      idempotency_key=idempotency_key)
+        return self._transfer_across(source, target, from_id, to_id, amount, description or "Transfer between accounts",
+                                     user_id, idempotency_key)
+     
+    def _log(self, reference_number, state, result=None):
+        def update(conn):
+            conn.execute("UPDATE transfer_log SET state = ?, result = COALESCE(?, result), updated_at = ? WHERE reference_number = ?",
+                         (state, result, time.time(), reference_number))
+        self.directory.call(update)
+     
+    def _transfer_across(self, source, target, from_id, to_id, amount, description, user_id, idempotency_key):
+        reference_number = new_reference("TRF")
+        posted = timeutil.now()
+        transaction_date = timestamp(posted)
+         
+        # The log entry comes first, so recovery knows about every prepared transfer
+        def begin(conn):
+            if idempotency_key is not None:
+                # IS, so a retry without a user (the bank CLI, a cron job) finds its first attempt too
+                row = conn.execute("SELECT state, result FROM transfer_log WHERE user_id IS ? AND idempotency_key = ?",
+                                   (user_id, idempotency_key)).fetchone()
+                if row is not None:
+                    return row
+            now = time.time()
+            conn.execute('''
+            INSERT INTO transfer_log (reference_number, state, from_account, to_account, amount, user_id, idempotency_key, created_at, updated_at)
+            VALUES (?, 'preparing', ?, ?, ?, ?, ?, ?, ?)
+            ''', (reference_number, from_id, to_id, amount, user_id, idempotency_key, now, now))
+            return None
+         
+        previous = self.directory.call(begin)
+        if previous is not None:
+            state, result = previous
+            if result is None:
+                raise LedgerError("A transfer with this idempotency key is still in progress")
+            result = json.loads(result)
+            if isinstance(result, dict):
+                raise LedgerError(result["error"])
+            return PostingResult(*result)
+         
+        # Phase one: reserve on both sides
+        try:
+            balance = source.writer.call(source.ledger.reserve_debit, reference_number, from_id, amount, description,
+                                         transaction_date, user_id=user_id, posted=posted)
+            account = self.get_account(from_id)
+            target.writer.call(target.ledger.reserve_credit, reference_number, to_id, amount, description, transaction_date,
+                               posted=posted, currency=account.currency if account else None)
+        except Exception as e:
+            self._log(reference_number, "aborted", json.dumps({"error": str(e)}))
+            self._finish(reference_number, "aborted", from_id, to_id)
+            raise
+         
+        # Decision point: once 'committed' is logged the transfer will complete, even after a crash
+        result = PostingResult(reference_number, "Transfer", amount, from_id, to_id, balance, transaction_date)
+        self._log(reference_number, "committed", json.dumps(result))
+        self._finish(reference_number, "committed", from_id, to_id)
+        return result
+     
+    def _finish(self, reference_number, decision, from_id, to_id):
+        """Phase two on both shards, then mark the log entry done"""
+        for account_id in (from_id, to_id):
+            shard = self.shard_for_account(account_id)
+            step = shard.ledger.settle_transfer if decision == "committed" else shard.ledger.cancel_transfer
+            shard.writer.call(step, reference_number, account_id)
+        self._log(reference_number, "done")
+     
+    def recover(self):
+        """Finish cross-shard transfers interrupted by a crash; returns how many"""
+        conn = database.connect(self.directory_path)
+        rows = conn.execute("SELECT reference_number, state, from_account, to_account FROM transfer_log WHERE state != 'done'").fetchall()
+        conn.close()
+        for reference_number, state, from_id, to_id in rows:
+            # Without a commit decision the transfer is rolled back
+            decision = "committed" if state == "committed" else "aborted"
+            if state == "preparing":
+                self._log(reference_number, "aborted", json.dumps({"error": "Transfer interrupted"}))
+            self._finish(reference_number, decision, from_id, to_id)
+        return len(rows)
+     
+    # Admin queries, fanned out to every shard in parallel
+     
+    def fan_out(self, func):
+        """Run func(shard, conn) on every shard concurrently; returns the results in shard order"""
+        def call(shard):
+            conn = database.connect(shard.path, readonly=True)
+            try:
+                return func(shard, conn)
+            finally:
+                conn.close()
+        return list(self.fan_out_pool.map(call, self.shards))
+     
+    def query_all(self, sql, params=()):
+        """Run a read-only query on every shard and concatenate the rows"""
+        rows = []
+        for shard_rows in self.fan_out(lambda shard, conn: conn.execute(sql, params).fetchall()):
+            rows.extend(shard_rows)
+        return rows
+     
+    def totals(self):
+        """Users, accounts, transactions and deposits held, per shard and overall"""
+        def count(shard, conn):
+            return {
+                "shard": shard.index,
+                "users": conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+                "accounts": conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0],
+                "transactions": conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0],
+                "balance": conn.execute("SELECT COALESCE(SUM(balance), 0) FROM accounts WHERE status = 'active'").fetchone()[0],
+            }
+        shards = self.fan_out(count)
+        overall = {key: sum(shard[key] for shard in shards) for key in ("users", "accounts", "transactions", "balance")}
+        return {"shards": shards, "total": overall}
+     
+    def find_users(self, pattern, limit=50):
+        """Search usernames and names on every shard"""
+        rows = self.query_all("SELECT * FROM users WHERE username LIKE ? OR full_name LIKE ? LIMIT ?",
+                              (pattern, pattern, limit))
+        return [User._make(row) for row in rows][:limit]
+ 
+ 
+class ShardedWriter:
+    """Stands in for PostingWriter in front of a ShardedLedger
+     
+    The sharded ledger routes each posting to its shard's own writer, so
+    this only moves the blocking call off the caller's thread.
+    """
+     
+    def __init__(self, ledger, workers=32):
+        self.ledger = ledger
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="sharded-posting")
+     
+    def start(self):
+        return self
+     
+    def stop(self):
+        self.executor.shutdown()
+     
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+     
+    def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+ 
+ 
+def main():
+    parser = argparse.ArgumentParser(description="Create a sharded database layout or show its totals")
+    parser.add_argument("directory", help="Folder holding shard<N>.db and directory.db")
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args()
+     
+    os.makedirs(args.directory, exist_ok=True)
+    paths, directory_path = shard_paths(args.directory, args.shards)
+    ledger = ShardedLedger(paths, directory_path).start()
+    try:
+        print(json.dumps(ledger.totals(), indent=2))
+    finally:
+        ledger.stop()
+ 
+ 
+if __name__ == "__main__":
+    main()
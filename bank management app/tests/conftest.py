@@ -0,0 +1,33 @@
+import os
+import sys
+ 
+import pytest
+ 
+# The app modules import each other by plain name, as when run from their folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ 
+import database
+import security
+from ledger import Ledger
+ 
+ 
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh database file with the full schema"""
+    path = str(tmp_path / "bank.db")
+    conn = database.connect(path)
+    database.create_schema(conn)
+    conn.close()
+    return path
+ 
+ 
+@pytest.fixture
+def ledger(db_path):
+    return Ledger(db_path)
+ 
+ 
+@pytest.fixture
+def account(ledger):
+    """Id of an open account with a zero balance"""
+    user_id = ledger.register_user("alice", security.hash_password("secret123"), "Alice", "alice@example.com")
+    return ledger.open_account(user_id, "Savings", 0).account_id
@@ -0,0 +1,30 @@
+import argparse
+import datetime
+ 
+import archive
+import cli
+import database
+from ledger import new_reference, timestamp
+ 
+ 
+def back_date(path, month):
+    """Move every transaction into an old month, so the archive takes it"""
+    conn = database.connect(path)
+    conn.execute("UPDATE transactions SET transaction_date = ? || substr(transaction_date, 8)", (month,))
+    conn.commit()
+    conn.close()
+ 
+ 
+def test_cancelled_transfer_is_left_out_of_archived_totals(db_path, ledger, account, capsys):
+    ledger.deposit(account, 100.0)
+    reference_number = new_reference("TRF")
+    ledger.reserve_debit(reference_number, account, 40.0, "Transfer", timestamp())
+    ledger.cancel_transfer(reference_number, account)
+    back_date(db_path, "2020-01")
+     
+    moved = archive.archive_transactions(db_path, today=datetime.date(2022, 1, 1))
+     
+    assert moved == {"2020-01": 2}
+    assert ledger.archived_summaries(account) == [("2020-01", 1, 100.0, 0.0)]
+    assert cli.reconcile(argparse.Namespace(db=db_path)) == 0
+    assert "0 out of balance" in capsys.readouterr().err
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+ 
+import pytest
+ 
+import backup
+import database
+ 
+ 
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch, db_path):
+    """Journal every commit to the test database, as BANK_JOURNAL_DIR does"""
+    directory = str(tmp_path / "journal")
+    monkeypatch.setattr(database, "JOURNAL_DIR", directory)
+    monkeypatch.setattr(database, "JOURNAL_DB", os.path.abspath(db_path))
+    return directory
+ 
+ 
+def balance(path, account_id):
+    conn = database.connect(path, readonly=True)
+    try:
+        return conn.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()[0]
+    finally:
+        conn.close()
+ 
+ 
+def test_restore_replays_the_journal_up_to_a_time(tmp_path, db_path, ledger, account, journal_dir):
+    backup_path = backup.online_backup(db_path, str(tmp_path / "backup.db"))
+    ledger.deposit(account, 100.0)
+    time.sleep(0.01)
+    cutoff = time.time()
+    time.sleep(0.01)
+    ledger.deposit(account, 50.0)
+    restored = str(tmp_path / "restored.db")
+     
+    assert backup.restore(backup_path, restored, journal_dir, until=cutoff) == 1
+    assert balance(restored, account) == 100.0
+     
+    assert backup.restore(backup_path, restored, journal_dir) == 2
+    assert balance(restored, account) == 150.0
+    assert backup.journal_position(database.connect(restored, readonly=True)) == backup.last_seq(journal_dir)
+ 
+ 
+def test_restore_refuses_a_journal_with_a_gap(tmp_path, db_path, ledger, account, journal_dir):
+    backup_path = backup.online_backup(db_path, str(tmp_path / "backup.db"))
+    for amount in (10.0, 20.0, 30.0):
+        ledger.deposit(account, amount)
+    entries = list(backup.read_journal(journal_dir))
+    lost = entries[1]["seq"]
+    for name in os.listdir(journal_dir):
+        with open(os.path.join(journal_dir, name)) as f:
+            lines = [line for line in f if json.loads(line)["seq"] != lost]
+        with open(os.path.join(journal_dir, name), "w") as f:
+            f.writelines(lines)
+     
+    with pytest.raises(ValueError, match=f"Journal is missing batches {lost} to {lost}"):
+        backup.restore(backup_path, str(tmp_path / "restored.db"), journal_dir)
@@ -0,0 +1,20 @@
+import pytest
+ 
+from fraud import FraudRules
+from fx import FXRates
+from ledger import Ledger
+ 
+ 
+@pytest.fixture
+def checked_ledger(db_path):
+    """A ledger with the fraud rules and exchange rates, as the app builds it"""
+    fx = FXRates(db_path)
+    return Ledger(db_path, rules=FraudRules(db_path, fx).load(), fx=fx)
+ 
+ 
+def test_postings_accept_account_ids_as_text(checked_ledger, account):
+    text_id = str(account)
+     
+    assert checked_ledger.deposit(text_id, 100.0).account_id == account
+    assert checked_ledger.withdraw(text_id, 30.0).balance == 70.0
+    assert checked_ledger.close_account(text_id).account_id == account
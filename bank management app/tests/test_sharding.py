@@ -0,0 +1,99 @@
+import pytest
+ 
+import security
+from sharding import ShardedLedger, shard_paths
+ 
+ 
+class Crash(BaseException):
+    """Stands for the process dying; not an Exception, so no handler on the way cleans up"""
+ 
+ 
+def open_sharded(directory):
+    paths, directory_path = shard_paths(str(directory), 2)
+    return ShardedLedger(paths, directory_path).start()
+ 
+ 
+@pytest.fixture
+def sharded(tmp_path):
+    ledger = open_sharded(tmp_path)
+    yield ledger
+    ledger.stop()
+ 
+ 
+@pytest.fixture
+def accounts(sharded):
+    """Two funded accounts of users that live on different shards"""
+    users = {}
+    number = 0
+    while len(users) < 2:
+        user_id = sharded.register_user(f"user{number}", security.hash_password("secret123"), "User", f"user{number}@example.com")
+        users.setdefault(sharded.shard_for_user(user_id).index, user_id)
+        number += 1
+    return [sharded.open_account(user_id, "Savings", 100.0).account_id for user_id in users.values()]
+ 
+ 
+def balances(ledger, account_ids):
+    return [ledger.get_account(account_id).balance for account_id in account_ids]
+ 
+ 
+def log_states(ledger):
+    return [row[0] for row in ledger.directory_reader().execute("SELECT state FROM transfer_log")]
+ 
+ 
+def test_cross_shard_transfer(sharded, accounts):
+    result = sharded.transfer(*accounts, 30.0)
+     
+    assert result.balance == 70.0
+    assert balances(sharded, accounts) == [70.0, 130.0]
+    assert log_states(sharded) == ["done"]
+ 
+ 
+def test_recovery_rolls_back_a_preparing_transfer(tmp_path, sharded, accounts):
+    def crash_before_decision(reference_number, state, result=None):
+        if state == "committed":
+            raise Crash()
+    sharded._log = crash_before_decision
+    with pytest.raises(Crash):
+        sharded.transfer(*accounts, 30.0)
+    sharded.stop()
+     
+    recovered = open_sharded(tmp_path)
+    try:
+        assert balances(recovered, accounts) == [100.0, 100.0]
+        assert log_states(recovered) == ["done"]
+        assert recovered.recover() == 0
+    finally:
+        recovered.stop()
+ 
+ 
+def test_recovery_completes_a_committed_transfer(tmp_path, sharded, accounts):
+    def crash_after_decision(reference_number, decision, from_id, to_id):
+        raise Crash()
+    sharded._finish = crash_after_decision
+    with pytest.raises(Crash):
+        sharded.transfer(*accounts, 30.0)
+    sharded.stop()
+     
+    recovered = open_sharded(tmp_path)
+    try:
+        assert balances(recovered, accounts) == [70.0, 130.0]
+        assert log_states(recovered) == ["done"]
+    finally:
+        recovered.stop()
+ 
+ 
+def test_cross_shard_transfer_retried_without_a_user_posts_once(sharded, accounts):
+    first = sharded.transfer(*accounts, 30.0, idempotency_key="rent-may")
+    again = sharded.transfer(*accounts, 30.0, idempotency_key="rent-may")
+     
+    assert again == first
+    assert balances(sharded, accounts) == [70.0, 130.0]
+ 
+ 
+def test_cross_shard_transfer_retried_by_its_owner_posts_once(sharded, accounts):
+    owner = sharded.owner_of(accounts[0])
+    first = sharded.transfer(*accounts, 30.0, user_id=owner, idempotency_key="rent-may")
+    again = sharded.transfer(*accounts, 30.0, user_id=owner, idempotency_key="rent-may")
+     
+    assert again == first
+    assert balances(sharded, accounts) == [70.0, 130.0]
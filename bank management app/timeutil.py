@@ -0,0 +1,73 @@
+import datetime
+import time
+ 
+# The *_time columns hold UTC epoch microseconds. The older *_date text
+# columns keep the local wall-clock time for the screens and tools that
+# still read them.
+TEXT_FORMAT = "%Y-%m-%d %H:%M:%S"
+DISPLAY_FORMAT = "%Y-%m-%d %H:%M"
+MICROS = 1000000
+ 
+# SQL turning a local TEXT_FORMAT column into epoch microseconds (the text has whole seconds)
+TEXT_TO_MICROS = "CAST(strftime('%s', {column}, 'utc') AS INTEGER) * 1000000"
+ 
+ 
+def now():
+    """Current time in epoch microseconds"""
+    return time.time_ns() // 1000
+ 
+ 
+def from_datetime(value):
+    """Epoch microseconds of a datetime; naive datetimes are taken as local time"""
+    return int(value.timestamp()) * MICROS + value.microsecond
+ 
+ 
+def to_datetime(micros):
+    """Local, naive datetime of an epoch-microsecond value"""
+    return datetime.datetime.fromtimestamp(micros // MICROS).replace(microsecond=micros % MICROS)
+ 
+ 
+def from_local_text(text):
+    """Epoch microseconds of a local 'YYYY-MM-DD[ HH:MM[:SS]]' string"""
+    for fmt in (TEXT_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return from_datetime(datetime.datetime.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise ValueError(f"Not a date: {text}")
+ 
+ 
+def local_text(micros):
+    """The stored local text of a time, as written to the *_date columns"""
+    return to_datetime(micros).strftime(TEXT_FORMAT)
+ 
+ 
+def format_time(micros, fmt=DISPLAY_FORMAT, default=""):
+    """Local time for display; ``default`` for rows without a time"""
+    if micros is None:
+        return default
+    return to_datetime(micros).strftime(fmt)
+ 
+ 
+def local_range(start=None, end=None):
+    """Half-open (since, until) epoch-microsecond bounds of local days
+     
+    ``start`` and ``end`` are dates, datetimes or 'YYYY-MM-DD[ HH:MM]'
+    strings; a bare date as ``end`` includes that whole day. Either bound
+    may be None for an open end.
+    """
+    def bound(value, whole_day):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            micros = from_local_text(value)
+            if whole_day and len(value.strip()) == 10:
+                micros = from_datetime(to_datetime(micros) + datetime.timedelta(days=1))
+            return micros
+        if isinstance(value, datetime.datetime):
+            return from_datetime(value)
+        # A date: midnight that day, or midnight after it for the end
+        day = value + datetime.timedelta(days=1) if whole_day else value
+        return from_datetime(datetime.datetime.combine(day, datetime.time()))
+     
+    return bound(start, False), bound(end, True)
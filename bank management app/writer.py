@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+ 
+import database
+from events import POSTING
+from ledger import PostingResult
+ 
+ 
+class WriterBusy(Exception):
+    """The posting queue is full; the caller should retry later"""
+ 
+ 
+class PostingWriter:
+    """Single thread that owns the writable connection and group-commits postings
+     
+    Callers submit ledger calls and get a Future back. The writer takes the
+    first waiting posting, collects whatever else arrives within
+    ``max_wait`` seconds (up to ``max_batch``), runs them all inside one
+    transaction and commits once, so a burst of postings shares one fsync.
+    Each posting runs in its own savepoint (see Ledger.transaction), so a
+    refused posting is rolled back without affecting the rest of the batch.
+    With an ``events`` bus, every committed PostingResult is published on it.
+    While the journal is on, each batch is logged by its connection at
+    commit (see backup.Journal).
+    """
+     
+    def __init__(self, path=None, max_batch=128, max_wait=0.002, queue_size=10000, events=None):
+        self.path = path
+        self.events = events
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue(queue_size)
+        self.thread = None
+        self.stats = {'batches': 0, 'postings': 0, 'failed': 0, 'largest_batch': 0}
+     
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="posting-writer", daemon=True)
+            self.thread.start()
+        return self
+     
+    def stop(self, timeout=None):
+        """Finish the queued postings and stop the thread"""
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+     
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, conn=<writer connection>, **kwargs) and return a Future"""
+        future = Future()
+        try:
+            self.requests.put_nowait((func, args, kwargs, future))
+        except queue.Full:
+            raise WriterBusy("Too many pending postings, retry later")
+        return future
+     
+    def call(self, func, *args, **kwargs):
+        """Submit a posting and wait for its result"""
+        return self.submit(func, *args, **kwargs).result()
+     
+    def _collect(self, first):
+        """Gather the postings that arrive shortly after the first one"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                # Take everything already queued without waiting
+                job = self.requests.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if job is None:
+                # Put the stop marker back so the main loop sees it after this batch
+                self.requests.put(None)
+                break
+            batch.append(job)
+        return batch
+     
+    def _run(self):
+        conn = database.connect(self.path)
+        conn.execute("PRAGMA busy_timeout = 30000")
+        try:
+            while True:
+                first = self.requests.get()
+                if first is None:
+                    break
+                self._commit_batch(conn, self._collect(first))
+        finally:
+            conn.close()
+     
+    def _commit_batch(self, conn, batch):
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.cancelled():
+                    future.set_exception(e)
+            self.stats['failed'] += len(batch)
+            return
+         
+        for func, args, kwargs, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                done.append((future, func(*args, conn=conn, **kwargs)))
+            except Exception as e:
+                future.set_exception(e)
+                self.stats['failed'] += 1
+         
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for future, _ in done:
+                future.set_exception(e)
+            self.stats['failed'] += len(done)
+            return
+         
+        for future, result in done:
+            # Publish first, so a caller woken by the result finds the event queued
+            if self.events is not None and isinstance(result, PostingResult):
+                self.events.publish(POSTING, result)
+            future.set_result(result)
+        self.stats['batches'] += 1
+        self.stats['postings'] += len(done)
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))